@@ -135,6 +135,8 @@ class Pitivi(Gtk.Application, Loggable):
         self.info('starting up')
         self._setup()
         self._checkVersion()
+        if not self.proxy_manager.proxyingUnsupported:
+            self.proxy_manager.benchmarkFormats()
 
     def _setup(self):
         self.settings = GlobalSettings()
@@ -18,10 +18,14 @@
 # Boston, MA 02110-1301, USA.
 # TODO reimplement after GES port
 """Automatic alignment of `Clip`s."""
-import array
+import collections
+import hashlib
 import os
+import pickle
 import time
 
+from gi.repository import GES
+from gi.repository import GLib
 from gi.repository import Gst
 from gi.repository import Gtk
 
@@ -31,16 +35,32 @@ try:
 except ImportError:
     numpy = None
 
+try:
+    from scipy.fftpack import next_fast_len
+except ImportError:
+    next_fast_len = None
+
 from gettext import gettext as _
 
 import pitivi.configure as configure
 
+from pitivi.timeline.previewers import get_wavefile_location_for_uri
+from pitivi.timeline.previewers import SAMPLE_DURATION
 from pitivi.utils.ui import beautify_ETA
+from pitivi.utils.fingerprint import getFingerprintIndex
 from pitivi.utils.misc import call_false
+from pitivi.utils.misc import get_proxy_target
 from pitivi.utils.extract import Extractee
+from pitivi.utils.extract import RandomAccessAudioExtractor
 from pitivi.utils.loggable import Loggable
 
 
+# The maximum length of the envelopes which are cross-correlated with FFTs,
+# longer envelopes being decimated by COARSE_FACTOR first.
+COARSE_LENGTH = 2 ** 16
+COARSE_FACTOR = 8
+
+
 def nextpow2(x):
     a = 1
     while a < x:
@@ -48,6 +68,91 @@ def nextpow2(x):
     return a
 
 
+def fastlen(x):
+    """
+    Find the smallest size not smaller than x for which the FFT is fast.
+
+    The FFT is fast for sizes whose only prime factors are 2, 3 and 5, so
+    less padding is needed than with L{nextpow2}.
+
+    @param x: the minimum size
+    @type x: L{int}
+    @rtype: L{int}
+    """
+    if next_fast_len:
+        return next_fast_len(int(x))
+    best = nextpow2(x)
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            # Find the smallest power of 2 such that p35 * p2 >= x
+            p2 = nextpow2(-(-x // p35))
+            best = min(best, p35 * p2)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+class SpectrumCache(object):
+
+    """
+    Cache of the FFTs of the mean-subtracted envelopes.
+
+    The envelopes are identified by their content, so aligning the same
+    clips again, for example with different clips, reuses the spectra.
+    """
+
+    def __init__(self, size=32):
+        self._size = size
+        # (digest, fft size) -> spectrum, in order of last use.
+        self._spectra = collections.OrderedDict()
+
+    def get(self, envelopes, L):
+        """
+        Get the spectra of the mean-subtracted envelopes.
+
+        The missing spectra are computed together, with a single FFT
+        over the matrix of the stacked envelopes.
+
+        @param envelopes: the waveforms
+        @type envelopes: Sequence(numpy array)
+        @param L: the size of the FFT
+        @type L: L{int}
+        @returns: the spectra, as the rows of a matrix
+        @rtype: 2-D numpy array of complex
+        """
+        envelopes = [numpy.ascontiguousarray(e, dtype=numpy.float64)
+                     for e in envelopes]
+        keys = [(hashlib.sha1(e.data).digest(), len(e), L) for e in envelopes]
+        spectra = numpy.empty((len(envelopes), L // 2 + 1),
+                              dtype=numpy.complex128)
+        missing = []
+        for row, key in enumerate(keys):
+            spectrum = self._spectra.pop(key, None)
+            if spectrum is None:
+                missing.append(row)
+            else:
+                spectra[row] = spectrum
+                self._spectra[key] = spectrum
+
+        if missing:
+            stacked = numpy.zeros((len(missing), L))
+            for i, row in enumerate(missing):
+                e = envelopes[row]
+                stacked[i, :len(e)] = e - numpy.mean(e)
+            spectra[missing] = numpy.fft.rfft(stacked, L, axis=1)
+            for row in missing:
+                self._spectra[keys[row]] = spectra[row].copy()
+
+        while len(self._spectra) > self._size:
+            self._spectra.popitem(last=False)
+        return spectra
+
+
+spectrum_cache = SpectrumCache()
+
+
 def submax(left, middle, right):
     """
     Find the maximum of a quadratic function from three samples.
@@ -69,7 +174,7 @@ def submax(left, middle, right):
     """
     L = middle - left   # L and R are both positive if middle is the
     R = middle - right  # observed max of the integer samples
-    return 0.5 * (R - L) / (R + L)
+    return 0.5 * (L - R) / (R + L)
     # Derivation: Consider a quadratic q(x) := P(0) - P(x).  Then q(x) has
     # two roots, one at 0 and one at z, and the extreme is at (0+z)/2
     # (i.e. at z/2)
@@ -77,9 +182,9 @@ def submax(left, middle, right):
     # q(1) = b*(1 - z) = R
     # q(-1) = b*(1 + z) = L
     # (1+z)/(1-z) = L/R  (from here it's just algebra to find a)
-    # z + 1 = R/L - (R/L)*z
-    # z*(1+R/L) = R/L - 1
-    # z = (R/L - 1)/(R/L + 1) = (R-L)/(R+L)
+    # z + 1 = L/R - (L/R)*z
+    # z*(1+L/R) = L/R - 1
+    # z = (L/R - 1)/(L/R + 1) = (L-R)/(L+R)
 
 
 def rigidalign(reference, targets):
@@ -104,27 +209,222 @@ def rigidalign(reference, targets):
     # L is the maximum size of a cross-correlation between the
     # reference and any of the targets.
     L = len(reference) + max(len(t) for t in targets) - 1
-    # We round up L to the next power of 2 for speed in the FFT.
-    L = nextpow2(L)
+    # We round up L to a size for which the FFT is fast.
+    L = fastlen(L)
+    fref = spectrum_cache.get([reference], L)[0].conj()
+    # The targets are transformed together as the rows of a matrix.
+    ftargets = spectrum_cache.get(targets, L)
+    # Compute the cross-correlations
+    xcorrs = numpy.fft.irfft(fref * ftargets, L, axis=1)
+    # shift maximizes dotproduct(t[shift:],reference)
+    rows = numpy.arange(len(targets))
+    peaks = numpy.argmax(xcorrs, axis=1)
+    shifts = peaks + submax(xcorrs[rows, (peaks - 1) % L],
+                            xcorrs[rows, peaks],
+                            xcorrs[rows, (peaks + 1) % L])
+    # shifts now are floats indicating the interpolated maximums
+    lengths = numpy.array([len(t) for t in targets])
+    # Negative shifts appear large and positive, this corrects them
+    # to be negative.
+    shifts[shifts >= lengths] -= L
+    # Sign reversed to move the target instead of the reference
+    return [-float(shift) for shift in shifts]
+
+
+def decimate(envelope, factor):
+    """
+    Reduce the rate of an envelope by summing blocks of samples.
+
+    @param envelope: the waveform
+    @type envelope: numpy array
+    @param factor: the number of samples summed in each block
+    @type factor: L{int}
+    @returns: the waveform at a rate reduced by factor.  The samples of
+        an incomplete last block are dropped.
+    @rtype: numpy array
+    """
+    num_blocks = len(envelope) // factor
+    return numpy.sum(numpy.reshape(envelope[:num_blocks * factor],
+                                   (num_blocks, factor)), axis=1)
+
+
+def _refineshift(reference, target, shift, radius):
+    """
+    Find the best shift of target against reference close to shift.
+
+    The cross-correlation is computed directly, only for the shifts
+    within radius of shift.
+
+    @returns: the interpolated shift maximizing the cross-correlation
+    @rtype: L{float}
+    """
     reference = reference - numpy.mean(reference)
-    fref = numpy.fft.rfft(reference, L).conj()
-    shifts = []
-    for t in targets:
-        t = t - numpy.mean(t)
-        # Compute cross-correlation
-        xcorr = numpy.fft.irfft(fref * numpy.fft.rfft(t, L))
-        # shift maximizes dotproduct(t[shift:],reference)
-        # int() to convert numpy.int32 to python int
-        shift = int(numpy.argmax(xcorr))
-        subsample_shift = submax(xcorr[(shift - 1) % L],
-                                 xcorr[shift],
-                                 xcorr[(shift + 1) % L])
-        shift = shift + subsample_shift
-        # shift is now a float indicating the interpolated maximum
-        if shift >= len(t):  # Negative shifts appear large and positive
-            shift -= L       # This corrects them to be negative
-        shifts.append(-shift)
-        # Sign reversed to move the target instead of the reference
+    target = target - numpy.mean(target)
+    center = int(round(shift))
+    candidates = range(center - radius - 1, center + radius + 2)
+    scores = []
+    for candidate in candidates:
+        # target[k] is compared with reference[k + candidate]
+        start = max(0, -candidate)
+        end = min(len(target), len(reference) - candidate)
+        if end <= start:
+            scores.append(-numpy.inf)
+            continue
+        scores.append(numpy.dot(reference[start + candidate:end + candidate],
+                                target[start:end]))
+    # Ignore the borders, which are only used for the interpolation.
+    best = 1 + int(numpy.argmax(scores[1:-1]))
+    if numpy.isinf(scores[best - 1]) or numpy.isinf(scores[best + 1]):
+        return float(candidates[best])
+    return candidates[best] + submax(scores[best - 1], scores[best],
+                                     scores[best + 1])
+
+
+def _phaseshift(reference, target):
+    """
+    Find the subsample shift of target against reference.
+
+    Unlike L{submax}, which is biased toward the integer shifts, the
+    shift is fitted to the phase of the low half of the cross-spectrum.
+
+    @param reference: the reference signal, already aligned to the
+        nearest integer shift
+    @type reference: numpy array
+    @param target: the signal to register, as long as reference
+    @type target: numpy array
+    @returns: the shift s such that target[k] matches reference[k + s]
+    @rtype: L{float}
+    """
+    n = len(target)
+    fref = numpy.fft.rfft(reference - numpy.mean(reference))
+    ftarget = numpy.fft.rfft(target - numpy.mean(target))
+    # Above a quarter of the frequencies, the phase can wrap around.
+    bins = numpy.arange(1, max(2, n // 4))
+    cross = ftarget[bins] * numpy.conj(fref[bins])
+    omega = 2 * numpy.pi * bins / n
+    weights = numpy.abs(cross) * omega
+    denominator = numpy.sum(weights * omega)
+    if denominator == 0:
+        return 0.
+    return float(numpy.sum(weights * numpy.angle(cross)) / denominator)
+
+
+def _pairwiseshifts(envelopes, max_length=COARSE_LENGTH):
+    """
+    Compute the cross-correlation peak of every pair of envelopes.
+
+    The FFT of each envelope is computed once, and the cross-correlations
+    of each envelope with all the following ones are computed in a single
+    batched inverse FFT.
+
+    Envelopes longer than max_length are first aligned coarsely after being
+    decimated, then the shifts are refined at the full rate by correlating
+    only around the coarse shifts, so very long recordings do not need
+    huge FFTs.
+
+    @param envelopes: the waveforms
+    @type envelopes: Sequence(numpy array)
+    @returns: (i, j, shift, confidence) for each pair i < j.  shift is the
+        position of envelopes[j] relative to envelopes[i], as returned by
+        L{rigidalign}.  confidence measures how much the peak stands out
+        from the rest of the cross-correlation.
+    @rtype: list((int, int, float, float))
+    """
+    if max(len(e) for e in envelopes) > max_length:
+        factor = COARSE_FACTOR
+        coarse = _pairwiseshifts([decimate(e, factor) for e in envelopes],
+                                 max_length)
+        return [(i, j, _refineshift(envelopes[i], envelopes[j],
+                                    shift * factor, factor),
+                 confidence)
+                for i, j, shift, confidence in coarse]
+
+    L = fastlen(2 * max(len(e) for e in envelopes) - 1)
+    spectra = spectrum_cache.get(envelopes, L)
+    results = []
+    for i in range(len(envelopes) - 1):
+        xcorrs = numpy.fft.irfft(spectra[i].conj() * spectra[i + 1:], L,
+                                 axis=1)
+        for k, xcorr in enumerate(xcorrs):
+            j = i + 1 + k
+            shift = int(numpy.argmax(xcorr))
+            std = numpy.std(xcorr)
+            if std > 0:
+                confidence = (xcorr[shift] - numpy.mean(xcorr)) / std
+            else:
+                confidence = 0
+            shift += submax(xcorr[(shift - 1) % L],
+                            xcorr[shift],
+                            xcorr[(shift + 1) % L])
+            if shift >= len(envelopes[j]):  # Negative shifts appear large
+                shift -= L
+            results.append((i, j, -shift, confidence))
+    return results
+
+
+def globalalign(envelopes, reference=0, min_confidence=6.):
+    """
+    Estimate consistent shifts between all the envelopes.
+
+    Unlike L{rigidalign}, the envelopes do not all need to overlap the
+    reference.  The shifts of all the pairs of envelopes are measured,
+    and the positions which best agree with them are found by weighted
+    least squares over the graph of overlapping envelopes.  The pairs
+    whose correlation peak has a confidence under min_confidence are
+    ignored, except those needed to connect all the envelopes, which are
+    picked from the most confident ones.
+
+    @param envelopes: the waveforms to align
+    @type envelopes: Sequence(Sequence(Number))
+    @param reference: the index of the waveform to regard as fixed
+    @type reference: L{int}
+    @param min_confidence: the confidence above which all the pairs are
+        taken into account
+    @type min_confidence: L{float}
+    @returns: The shift of each envelope relative to the reference,
+        0 for the reference itself.
+    @rtype: list(float)
+    """
+    n = len(envelopes)
+    if n < 2:
+        return [0.] * n
+    pairs = _pairwiseshifts(envelopes)
+
+    # Kruskal's algorithm for a maximum spanning tree, to make sure every
+    # envelope is connected to the others through its best matches.
+    parents = list(range(n))
+
+    def root(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    edges = []
+    for i, j, shift, confidence in sorted(pairs, key=lambda p: -p[3]):
+        root_i, root_j = root(i), root(j)
+        if root_i != root_j:
+            parents[root_i] = root_j
+        elif confidence < min_confidence:
+            continue
+        edges.append((i, j, shift, max(confidence, 1e-3)))
+
+    # Solve x[j] - x[i] = shift for all the edges, with x[reference] = 0.
+    unknowns = [i for i in range(n) if i != reference]
+    columns = {i: c for c, i in enumerate(unknowns)}
+    a = numpy.zeros((len(edges), n - 1))
+    b = numpy.zeros(len(edges))
+    for row, (i, j, shift, confidence) in enumerate(edges):
+        weight = numpy.sqrt(confidence)
+        if j in columns:
+            a[row, columns[j]] = weight
+        if i in columns:
+            a[row, columns[i]] = -weight
+        b[row] = weight * shift
+    solution = numpy.linalg.lstsq(a, b, rcond=-1)[0]
+    shifts = [0.] * n
+    for i, c in columns.items():
+        shifts[i] = float(solution[c])
     return shifts
 
 
@@ -143,35 +443,39 @@ def _findslope(a):
     # The function returns a floating-point slope assuming that the matrix
     # has "square pixels".
     Y, X = a.shape
-    X /= 2
+    X //= 2
     x_pos = numpy.arange(1, X)
     x_neg = numpy.arange(2 * X - 1, X, -1)
-    best_end = 0
-    max_sum = 0
-    for end in range(Y):
-        y = (x_pos * end) // X
-        s = numpy.sum(a[y, x_pos])
-        if s > max_sum:
-            max_sum = s
-            best_end = end
-        s = numpy.sum(a[y, x_neg])
-        if s > max_sum:
-            max_sum = s
-            best_end = -end
+    # The rows crossed by the line ending at (end, X) for each end.
+    ends = numpy.arange(Y)
+    y = (x_pos[numpy.newaxis, :] * ends[:, numpy.newaxis]) // X
+    sums_pos = numpy.sum(a[y, x_pos], axis=1)
+    sums_neg = numpy.sum(a[y, x_neg], axis=1)
+    best_pos = int(numpy.argmax(sums_pos))
+    best_neg = int(numpy.argmax(sums_neg))
+    if sums_neg[best_neg] > sums_pos[best_pos]:
+        best_end = -best_neg
+    else:
+        best_end = best_pos
     return float(best_end) / X
 
 
-def affinealign(reference, targets, max_drift=0.02):
-    """ EXPERIMENTAL FUNCTION.
+def _norms(a):
+    # Helper function for affinealign, computing the norm of each column
+    # of a, with 1 instead of 0 so that the columns can be divided by it.
+    norms = numpy.sqrt(numpy.sum(numpy.abs(a) ** 2, axis=0))
+    norms[norms == 0] = 1
+    return norms
+
 
+def affinealign(reference, targets, max_drift=0.02):
+    """
     Perform an affine registration between a reference and a number of
     targets.  Designed for aligning the amplitude envelopes of recordings of
-    the same event by different devices.
+    the same event by different devices, whose clocks drift apart.
 
-    NOTE: This method is currently NOT USED by Pitivi, as it has proven both
-    unnecessary and unusable.  So far every test case has been registered
-    successfully by rigidalign, and until Pitivi supports time-stretching of
-    audio, the drift calculation cannot actually be used.
+    The reference must be longer than twice the block size, which is
+    C{20 / max_drift} samples.
 
     @param reference: the reference signal to which others will be registered
     @type reference: array(number)
@@ -186,34 +490,30 @@ def affinealign(reference, targets, max_drift=0.02):
            slowed down to be in sync with the reference)
     """
     L = len(reference) + max(len(t) for t in targets) - 1
-    L2 = nextpow2(L)
+    L2 = fastlen(L)
     bsize = int(20. / max_drift)  # NEEDS TUNING
     num_blocks = nextpow2(1.0 * len(reference) // bsize)  # NEEDS TUNING
     bspace = (len(reference) - bsize) // num_blocks
-    reference -= numpy.mean(reference)
-
-    # Construct FFT'd reference blocks
-    freference_blocks = numpy.zeros((L2 / 2 + 1, num_blocks),
-                                    dtype=numpy.complex)
-    for i in range(num_blocks):
-        s = i * bspace
-        tmp = numpy.zeros((L2,))
-        tmp[s:s + bsize] = reference[s:s + bsize]
-        freference_blocks[:, i] = numpy.fft.rfft(tmp, L2).conj()
+    reference = reference - numpy.mean(reference)
+
+    # Construct FFT'd reference blocks, all the blocks being transformed
+    # together as the columns of a matrix.
+    block_starts = numpy.arange(num_blocks) * bspace
+    block_indexes = block_starts[numpy.newaxis, :] + \
+        numpy.arange(bsize)[:, numpy.newaxis]
+    reference_blocks = numpy.zeros((L2, num_blocks))
+    reference_blocks[block_indexes, numpy.arange(num_blocks)] = \
+        reference[block_indexes]
+    freference_blocks = numpy.fft.rfft(reference_blocks, L2, axis=0).conj()
+    del reference_blocks
     freference_blocks[:10, :] = 0  # High-pass to ignore slow volume variations
 
     offsets = []
     drifts = []
-    for t in targets:
-        t -= numpy.mean(t)
-        ft = numpy.fft.rfft(t, L2)
+    for ft, t in zip(spectrum_cache.get(targets, L2), targets):
         # fxcorr is the FFT'd cross-correlation with the reference blocks
-        fxcorr_blocks = numpy.zeros((L2 / 2 + 1, num_blocks),
-                                    dtype=numpy.complex)
-        for i in range(num_blocks):
-            fxcorr_blocks[:, i] = ft * freference_blocks[:, i]
-            fxcorr_blocks[:, i] /= numpy.sqrt(
-                numpy.sum(fxcorr_blocks[:, i] ** 2))
+        fxcorr_blocks = ft[:, numpy.newaxis] * freference_blocks
+        fxcorr_blocks /= _norms(fxcorr_blocks)
         del ft
         # At this point xcorr_blocks would show a distinct bright line, nearly
         # orthogonal to time, indicating where each of these blocks found their
@@ -240,42 +540,34 @@ def affinealign(reference, targets, max_drift=0.02):
         halfautocorr = numpy.fft.fft(fxcorr_blocks, 2 * num_blocks, 1)
         halfautocorr = numpy.abs(halfautocorr)
         halfautocorr = numpy.fft.ifft(halfautocorr, None, 1)
-        halfautocorr = numpy.fft.irfft(halfautocorr, None, 0)
+        halfautocorr = numpy.fft.irfft(halfautocorr, L2, 0)
         # Now it's actually the half-autocorrelation.
         # Chop out the bit we don't care about
-        halfautocorr = halfautocorr[:bspace * num_blocks * max_drift, :]
-        # Remove the local-correlation peak.
-        halfautocorr[-1:2, -1:2] = 0  # NEEDS TUNING
+        halfautocorr = halfautocorr[:int(bspace * num_blocks * max_drift) + 1, :]
+        # Remove the local-correlation peak, which wraps around the columns.
+        halfautocorr[:2, :2] = 0  # NEEDS TUNING
+        halfautocorr[:2, -1] = 0
         # Normalize each column (appears to be necessary)
-        for i in range(2 * num_blocks):
-            halfautocorr[:, i] /= numpy.sqrt(
-                numpy.sum(halfautocorr[:, i] ** 2))
+        halfautocorr /= _norms(halfautocorr)
         # from matplotlib.pyplot import imshow,show
         # imshow(halfautocorr,interpolation='nearest',aspect='auto');show()
         drift = _findslope(halfautocorr) / bspace
         del halfautocorr
 
         # inverse transform and shift everything into alignment
-        xcorr_blocks = numpy.fft.irfft(fxcorr_blocks, None, 0)
+        xcorr_blocks = numpy.fft.irfft(fxcorr_blocks, L2, 0)
         del fxcorr_blocks
         # TODO: see if phase ramps are worthwhile here
-        for i in range(num_blocks):
-            blockcenter = i * bspace + bsize / 2
-            shift = int(blockcenter * drift)
-            if shift > 0:
-                temp = xcorr_blocks[:shift, i].copy()
-                xcorr_blocks[:-shift, i] = xcorr_blocks[shift:, i].copy()
-                xcorr_blocks[-shift:, i] = temp
-            elif shift < 0:
-                temp = xcorr_blocks[shift:, i].copy()
-                xcorr_blocks[-shift:, i] = xcorr_blocks[:shift, i].copy()
-                xcorr_blocks[:-shift, i] = temp
-
-        # from matplotlib.pyplot import imshow,show
-        # imshow(xcorr_blocks,interpolation='nearest',aspect='auto');show()
+        # Rotate each block by the shift caused by the drift at its center,
+        # so that row k of block i comes from row k + shift[i].
+        blockcenters = block_starts + bsize / 2
+        shifts = (blockcenters * drift).astype(int)
+        rows = (numpy.arange(xcorr_blocks.shape[0])[:, numpy.newaxis] +
+                shifts[numpy.newaxis, :]) % xcorr_blocks.shape[0]
 
         # xcorr is the drift-compensated cross-correlation
-        xcorr = numpy.sum(xcorr_blocks, axis=1)
+        xcorr = numpy.sum(xcorr_blocks[rows, numpy.arange(num_blocks)],
+                          axis=1)
         del xcorr_blocks
 
         offset = numpy.argmax(xcorr)
@@ -294,21 +586,149 @@ def affinealign(reference, targets, max_drift=0.02):
     return offsets, drifts
 
 
+def driftalign(reference, target, offset, max_drift, num_windows=32):
+    """
+    Estimate the clock drift of a target already roughly aligned.
+
+    Unlike L{affinealign}, no FFT of the whole envelopes is needed.  The
+    overlap of the target with the reference is split in num_windows
+    windows, the shift of each window is searched directly, only within
+    the drift range around offset, and a line is fitted to the shifts.
+    The subsample part of each shift is measured from the phase of the
+    cross-spectrum, because the parabolic interpolation of the peak is
+    biased toward the integer shifts, which biases the drift.
+
+    @param reference: the reference signal
+    @type reference: numpy array
+    @param target: the signal to register
+    @type target: numpy array
+    @param offset: the approximate point in reference at which target
+        starts, as returned by L{globalalign}
+    @type offset: L{float}
+    @param max_drift: the maximum absolute clock drift rate searched
+    @type max_drift: positive L{float}
+    @return: (offset, drift) as returned by L{affinealign} for one target,
+        or None if the overlap is too short to measure the drift
+    """
+    first = max(0, int(numpy.ceil(-offset)))
+    last = min(len(target), int(len(reference) - offset))
+    window = (last - first) // num_windows
+    if window < 2:
+        return None
+    radius = int(numpy.ceil(max_drift * (last - first))) + 1
+    centers = []
+    shifts = []
+    for start in range(first, first + num_windows * window, window):
+        chunk = target[start:start + window]
+        shift = int(round(_refineshift(reference, chunk, offset + start,
+                                       radius)))
+        if shift < 0 or shift + window > len(reference):
+            continue
+        shift += _phaseshift(reference[shift:shift + window], chunk)
+        # The shift is measured at the center of the window.
+        centers.append(start + window / 2)
+        shifts.append(shift + window / 2)
+    if len(centers) < 2:
+        return None
+    # The window starting at target[k] is found at reference[k + shift],
+    # so shift + center = offset + center * (1 + drift).
+    slope, intercept = numpy.polyfit(centers, shifts, 1)
+    return float(intercept), float(slope - 1)
+
+
 def getAudioTrack(clip):
     """
     Helper function for getting an audio track from a Clip
 
     @param clip: The Clip from which to locate an audio track
-    @type clip: L{Clip}
+    @type clip: L{GES.Clip}
     @returns: An audio track from clip, or None if clip has no audio track
-    @rtype: audio L{TrackElement} or L{NoneType}
+    @rtype: L{GES.AudioSource} or L{NoneType}
     """
-    for track in clip.track_elements:
-        if track.stream_type == AudioStream:
-            return track
+    if not isinstance(clip, GES.UriClip):
+        return None
+    for track_element in clip.find_track_elements(None, GES.TrackType.AUDIO,
+                                                  GES.AudioSource):
+        return track_element
     return None
 
 
+def getSampleRate(clip):
+    """
+    Helper function for getting the sample rate of the audio of a Clip
+
+    @param clip: The Clip with an audio track
+    @type clip: L{GES.UriClip}
+    @returns: The sample rate of the first audio stream of the clip's asset
+    @rtype: L{int}
+    """
+    audio_streams = clip.get_asset().get_info().get_audio_streams()
+    return audio_streams[0].get_sample_rate()
+
+
+def getCachedEnvelope(clip, blockrate):
+    """
+    Get the envelope of a clip from the waveforms cache.
+
+    The cache contains the RMS level of the whole file every
+    C{SAMPLE_DURATION}, it is summed over blocks to get the requested
+    block rate.
+
+    @param clip: The Clip whose envelope is needed
+    @type clip: L{GES.UriClip}
+    @param blockrate: The number of blocks per second
+    @type blockrate: L{int}
+    @returns: The envelope of the clip, or None if the file has not
+        been analyzed yet
+    @rtype: numpy array or L{NoneType}
+    """
+    try:
+        wavefile = get_wavefile_location_for_uri(clip.get_asset().get_id())
+        with open(wavefile, "rb") as samples:
+            samples = numpy.asarray(pickle.load(samples), dtype=numpy.float32)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+    start = clip.props.in_point // SAMPLE_DURATION
+    end = (clip.props.in_point + clip.props.duration) // SAMPLE_DURATION
+    if end > len(samples):
+        # The cache does not cover the whole clip.
+        return None
+
+    num_blocks = (end - start) * SAMPLE_DURATION * blockrate // Gst.SECOND
+    if not num_blocks:
+        return None
+    # The index of the first sample of each block, and of the end.
+    edges = (numpy.arange(num_blocks + 1) * Gst.SECOND //
+             (SAMPLE_DURATION * blockrate))
+    samples = samples[start:start + edges[-1]]
+    return numpy.add.reduceat(samples, edges[:-1])
+
+
+def findOverlappingAssets(clip):
+    """
+    Find the analyzed files which recorded the same audio as a Clip.
+
+    The audio fingerprints of the files are looked up in the index, so
+    this scales to libraries of any size, contrary to L{rigidalign}.
+
+    @param clip: The Clip whose audio is searched for
+    @type clip: L{GES.UriClip}
+    @returns: The URI of each overlapping file, the position in it of the
+        start of the clip (nanoseconds) and the number of matching
+        landmarks, the best matches first
+    @rtype: L{list} of (L{str}, L{int}, L{int})
+    """
+    index = getFingerprintIndex()
+    uri = get_proxy_target(clip).get_id()
+    if not index.contains(uri):
+        return []
+    overlaps = index.findOverlaps(uri, clip.props.in_point,
+                                  clip.props.duration)
+    return [(other_uri, offset + clip.props.in_point, score)
+            for other_uri, offset, score in overlaps]
+
+
 class ProgressMeter:
 
     """Abstract interface representing a progress meter."""
@@ -343,6 +763,9 @@ class ProgressAggregator(ProgressMeter):
         self._portions = []
         self._start = time.time()
         self._watchers = []
+        # Whether a call to _callForward is already scheduled, so that the
+        # updates from concurrent extractions are coalesced.
+        self._pending_update = False
 
     def getPortionCB(self, target):
         """Prepare a new input for the Aggregator.
@@ -366,7 +789,9 @@ class ProgressAggregator(ProgressMeter):
 
         def cb(thusfar):
             self._portions[i] = thusfar
-            GLib.idle_add(self._callForward)
+            if not self._pending_update:
+                self._pending_update = True
+                GLib.idle_add(self._callForward)
         return cb
 
     def addWatcher(self, function):
@@ -377,9 +802,10 @@ class ProgressAggregator(ProgressMeter):
         # invoked via GLib.idle_add(). Use of idle_add() is necessary
         # to ensure that watchers are always called from the main thread,
         # even if progress updates are received from other threads.
+        self._pending_update = False
         total_target = sum(self._targets)
         total_completed = sum(self._portions)
-        if total_target == 0:
+        if total_target == 0 or total_completed == 0:
             return False
         frac = min(1.0, float(total_completed) / total_target)
         now = time.time()
@@ -397,37 +823,84 @@ class EnvelopeExtractee(Extractee, Loggable):
     over each block.  This class computes the envelope incrementally,
     so that the entire signal does not ever need to be stored.
 
+    The envelope is written into a preallocated array, and the samples of
+    an incomplete block are kept until the next chunk completes it, so
+    each received sample is processed only once.
+
     """
 
-    def __init__(self, blocksize, callback, *cbargs):
+    def __init__(self, blocksize, callback, *cbargs, num_samples=0):
         """
         @param blocksize: the number of samples in a block
         @type blocksize: L{int}
         @param callback: a function to call when the extraction is complete.
             The function's first argument will be a numpy array
-            representing the envelope, and any later argument to this
-            function will be passed as subsequent arguments to callback.
+            representing the envelope, or None if the extraction failed,
+            and any later argument to this function will be passed as
+            subsequent arguments to callback.
+        @param num_samples: the expected number of samples, used to
+            allocate the envelope at once
+        @type num_samples: L{int}
 
         """
         Loggable.__init__(self)
         self._blocksize = blocksize
         self._cb = callback
         self._cbargs = cbargs
-        self._blocks = numpy.zeros((0,), dtype=numpy.float32)
-        self._empty = array.array('f', [])
-        # self._samples buffers up to self._threshold samples, before
-        # their envelope is computed and store in self._blocks, in order
-        # to amortize some of the function call overheads.
-        self._samples = array.array('f', [])
+        self._blocks = numpy.zeros((int(num_samples) // blocksize + 1,),
+                                   dtype=numpy.float32)
+        self._num_blocks = 0
+        # The samples of the last incomplete block.
+        self._partial = numpy.zeros((blocksize,), dtype=numpy.float32)
+        self._num_partial = 0
+        # The progress watchers are called every self._threshold samples,
+        # in order to amortize some of the function call overheads.
         self._threshold = 2000 * blocksize
+        self._num_samples = 0
+        self._notified_samples = 0
         self._progress_watchers = []
 
     def receive(self, a):
-        self._samples.extend(a)
-        if len(self._samples) < self._threshold:
-            return
-        else:
-            self._process_samples()
+        self._num_samples += len(a)
+        if self._num_partial:
+            # Complete the pending block first.
+            needed = self._blocksize - self._num_partial
+            head = a[:needed]
+            self._partial[self._num_partial:self._num_partial + len(head)] = head
+            self._num_partial += len(head)
+            a = a[needed:]
+            if self._num_partial < self._blocksize:
+                return
+            self._appendBlocks(numpy.abs(self._partial).sum(keepdims=True))
+            self._num_partial = 0
+
+        newblocks = len(a) // self._blocksize
+        if newblocks:
+            full = a[:newblocks * self._blocksize]
+            # This sum relies on the samples being a floating-point
+            # type. If they were int16 the sum might overflow.
+            self._appendBlocks(numpy.abs(full).reshape(
+                (newblocks, self._blocksize)).sum(1))
+
+        excess = len(a) - newblocks * self._blocksize
+        if excess:
+            self._partial[:excess] = a[-excess:]
+            self._num_partial = excess
+
+        if self._num_samples - self._notified_samples >= self._threshold:
+            self._notifyProgress()
+
+    def _appendBlocks(self, blocks):
+        end = self._num_blocks + len(blocks)
+        if end > len(self._blocks):
+            # The duration was underestimated, grow geometrically so that
+            # the copies stay amortized.
+            grown = numpy.zeros((max(end, 2 * len(self._blocks)),),
+                                dtype=numpy.float32)
+            grown[:self._num_blocks] = self._blocks[:self._num_blocks]
+            self._blocks = grown
+        self._blocks[self._num_blocks:end] = blocks
+        self._num_blocks = end
 
     def addWatcher(self, w):
         """
@@ -439,30 +912,19 @@ class EnvelopeExtractee(Extractee, Loggable):
         """
         self._progress_watchers.append(w)
 
-    def _process_samples(self):
-        excess = len(self._samples) % self._blocksize
-        if excess != 0:
-            samples_to_process = self._samples[:-excess]
-            self._samples = self._samples[-excess:]
-        else:
-            samples_to_process = self._samples
-            self._samples = array.array('f', [])
-        self.debug("Adding %s samples to %s blocks",
-                   len(samples_to_process), len(self._blocks))
-        newblocks = len(samples_to_process) // self._blocksize
-        samples_abs = numpy.abs(
-            samples_to_process).reshape((newblocks, self._blocksize))
-        self._blocks.resize((len(self._blocks) + newblocks,))
-        # This numpy.sum() call relies on samples_abs being a
-        # floating-point type. If samples_abs.dtype is int16
-        # then the sum may overflow.
-        self._blocks[-newblocks:] = numpy.sum(samples_abs, 1)
+    def _notifyProgress(self):
+        self._notified_samples = self._num_samples
         for w in self._progress_watchers:
-            w(self._blocksize * len(self._blocks) + excess)
+            w(self._num_samples)
 
     def finalize(self):
-        self._process_samples()  # absorb any remaining buffered samples
-        self._cb(self._blocks, *self._cbargs)
+        # The samples of an incomplete last block are dropped.
+        self._notifyProgress()
+        self._cb(self._blocks[:self._num_blocks], *self._cbargs)
+
+    def abort(self, error):
+        self.warning("Envelope extraction failed: %s", error)
+        self._cb(None, *self._cbargs)
 
 
 class AutoAligner(Loggable):
@@ -493,7 +955,41 @@ class AutoAligner(Loggable):
 
     """
 
-    def __init__(self, clips, callback):
+    MAX_EXTRACTIONS = max(1, min(4, os.cpu_count() or 1))
+    """
+    @ivar MAX_EXTRACTIONS: The maximum number of envelopes extracted
+    concurrently.
+
+    Each extraction decodes a file in its own pipeline, so the alignment
+    takes about as long as the slowest file when there are enough cores.
+
+    """
+
+    MAX_DRIFT = 0.001
+    """
+    @ivar MAX_DRIFT: The maximum clock drift rate which is compensated.
+
+    Consumer recorders drift by tens of milliseconds per hour, that is
+    about 1e-5.  The drift can only be measured when the reference is
+    longer than twice C{20 / MAX_DRIFT} blocks.
+
+    """
+
+    MIN_DRIFT = 0.00001
+    """
+    @ivar MIN_DRIFT: The clock drift rate under which no time-stretching
+    is applied.
+
+    """
+
+    DRIFT_EFFECT = "pitch"
+    """
+    @ivar DRIFT_EFFECT: The effect used to time-stretch the audio without
+    changing the pitch.
+
+    """
+
+    def __init__(self, clips, callback, region=None):
         """
         @param clips: an iterable of L{Clip}s.
             In this implementation, only L{Clip}s with at least one
@@ -502,6 +998,10 @@ class AutoAligner(Loggable):
         @param callback: A function to call when alignment is complete.  No
             arguments will be provided.
         @type callback: function
+        @param region: The (start, end) timeline positions, in nanoseconds,
+            of the part of the clips to compare, or None to compare the
+            whole clips.  Clips not covering the region are not moved.
+        @type region: (L{int}, L{int})
 
         """
         Loggable.__init__(self)
@@ -509,11 +1009,13 @@ class AutoAligner(Loggable):
         # are initially None prior to envelope extraction.
         self._clips = dict.fromkeys(clips)
         self._callback = callback
+        self._region = region
         # stack of (Track, Extractee) pairs waiting to be processed
         # When start() is called, the stack will be populated, and then
-        # processed sequentially.  Only one item from the stack will be
-        # actively in process at a time.
+        # processed by up to MAX_EXTRACTIONS extractors running concurrently.
         self._extraction_stack = []
+        # The extractors currently running, by clip.
+        self._extractors = {}
 
     @staticmethod
     def canAlign(clips):
@@ -534,22 +1036,42 @@ class AutoAligner(Loggable):
         # use the AutoAligner, which will crash immediately.
         return all(getAudioTrack(t) is not None for t in clips)
 
-    def _extractNextEnvelope(self):
-        audiotrack, extractee = self._extraction_stack.pop()
-        r = RandomAccessAudioExtractor(audiotrack.factory,
-                                       audiotrack.stream)
-        r.extract(extractee, audiotrack.in_point,
-                  audiotrack.out_point - audiotrack.in_point)
+    def _extractNextEnvelopes(self):
+        """Starts extractions until MAX_EXTRACTIONS are running."""
+        while self._extraction_stack and \
+                len(self._extractors) < self.MAX_EXTRACTIONS:
+            clip, audiotrack, extractee = self._extraction_stack.pop()
+            # Each extraction has its own pipeline, so the files are
+            # decoded in parallel.
+            r = RandomAccessAudioExtractor(clip.get_asset().get_id(),
+                                           getSampleRate(clip))
+            self._extractors[clip] = r
+            r.extract(extractee, audiotrack.props.in_point,
+                      audiotrack.props.duration)
         return False
 
     def _envelopeCb(self, array, clip):
-        self.debug("Receiving envelope for %s", clip)
-        self._clips[clip] = array
+        if array is None:
+            self.warning("Not aligning %s, its audio cannot be decoded", clip)
+            self._clips.pop(clip, None)
+        else:
+            self.debug("Receiving envelope for %s", clip)
+            self._clips[clip] = array
+        extractor = self._extractors.pop(clip, None)
+        if extractor:
+            extractor.release()
         if self._extraction_stack:
-            self._extractNextEnvelope()
-        else:  # This was the last envelope
+            self._extractNextEnvelopes()
+        elif not self._extractors:  # This was the last envelope
+            self._align()
+
+    def _align(self):
+        if len(self._clips) >= 2:
             self._performShifts()
-            self._callback()
+        else:
+            self.warning("Not enough clips left to align")
+        self._callback()
+        return False
 
     def start(self):
         """
@@ -569,29 +1091,43 @@ class AutoAligner(Loggable):
             else:  # forget any Clip without an audio track
                 self._clips.pop(clip)
         if len(pairs) >= 2:
+            # The longest tracks are extracted first, so that the shorter
+            # ones fill the remaining slots of the pool.
+            pairs.sort(key=lambda pair: pair[1].props.duration)
             for clip, audiotrack in pairs:
+                envelope = getCachedEnvelope(clip, self.BLOCKRATE)
+                if envelope is not None:
+                    # No need to decode the file again.
+                    self.debug("Using the cached envelope of %s", clip)
+                    self._clips[clip] = envelope
+                    continue
+
+                rate = getSampleRate(clip)
                 # blocksize is the number of samples per block
-                blocksize = audiotrack.stream.rate // self.BLOCKRATE
-                extractee = EnvelopeExtractee(
-                    blocksize, self._envelopeCb, clip)
+                blocksize = rate // self.BLOCKRATE
                 # numsamples is the total number of samples in the track,
                 # which is used by progress_aggregator to determine
                 # the percent completion.
-                numsamples = ((audiotrack.duration / Gst.SECOND) *
-                              audiotrack.stream.rate)
+                numsamples = ((audiotrack.props.duration / Gst.SECOND) *
+                              rate)
+                extractee = EnvelopeExtractee(
+                    blocksize, self._envelopeCb, clip, num_samples=numsamples)
                 extractee.addWatcher(
                     progress_aggregator.getPortionCB(numsamples))
-                self._extraction_stack.append((audiotrack, extractee))
+                self._extraction_stack.append((clip, audiotrack, extractee))
             # After we return, start the extraction cycle.
             # This GLib.idle_add call should not be necessary;
-            # we should be able to invoke _extractNextEnvelope directly
+            # we should be able to invoke _extractNextEnvelopes directly
             # here.  However, there is some as-yet-unexplained
             # race condition between the Python GIL, GTK UI updates,
             # GLib mainloop, and pygst multithreading, resulting in
             # occasional deadlocks during autoalignment.
             # This call to idle_add() reportedly eliminates the deadlock.
             # No one knows why.
-            GLib.idle_add(self._extractNextEnvelope)
+            if self._extraction_stack:
+                GLib.idle_add(self._extractNextEnvelopes)
+            else:
+                GLib.idle_add(self._align)
         else:  # We can't do anything without at least two audio tracks
             # After we return, call the callback function (once)
             GLib.idle_add(call_false, self._callback)
@@ -611,37 +1147,127 @@ class AutoAligner(Loggable):
 
         """
         def priority(clip):
-            return clip.priority
+            return clip.get_layer().props.priority
         return min(iter(self._clips.keys()), key=priority)
 
     def _performShifts(self):
         self.debug("performing shifts")
         reference = self._chooseReference()
-        # By using pop(), this line also removes the reference
-        # Clip and its envelope from further consideration,
-        # saving some CPU time in rigidalign.
-        reference_envelope = self._clips.pop(reference)
         # We call list() because we need a reliable ordering of the pairs
         # (In python 3, dict.items() returns an unordered dictview)
         pairs = list(self._clips.items())
+        # The index of the first block of each envelope which is compared.
+        crops = [0] * len(pairs)
+        if self._region:
+            pairs, crops = self._cropToRegion(pairs, reference)
         envelopes = [p[1] for p in pairs]
-        offsets = rigidalign(reference_envelope, envelopes)
-        for (movable, envelope), offset in zip(pairs, offsets):
+        # All the pairs of clips are correlated, so clips which do not
+        # overlap the reference are aligned through the other clips.
+        reference_index = [p[0] for p in pairs].index(reference)
+        offsets = globalalign(envelopes, reference_index)
+        drifts = self._estimateDrifts(envelopes, reference_index, offsets)
+        for (movable, envelope), offset, drift, crop in zip(pairs, offsets,
+                                                            drifts, crops):
+            if movable is reference:
+                continue
+            # Convert the offset between the cropped envelopes to the
+            # offset between the clips.
+            offset += crops[reference_index] - crop
+            if drift:
+                self._setDrift(movable, drift)
             # tshift is the offset rescaled to units of nanoseconds
             tshift = int((offset * Gst.SECOND) / self.BLOCKRATE)
             self.debug("Shifting %s to %i ns from %i",
-                       movable, tshift, reference.start)
-            newstart = reference.start + tshift
+                       movable, tshift, reference.props.start)
+            newstart = reference.props.start + tshift
             if newstart >= 0:
-                movable.start = newstart
+                movable.set_start(newstart)
             else:
                 # Timeline objects always must have a positive start point, so
                 # if alignment would move an object to start at negative time,
                 # we instead make it start at zero and chop off the required
                 # amount at the beginning.
-                movable.start = 0
-                movable.in_point = movable.in_point - newstart
-                movable.duration += newstart
+                movable.set_start(0)
+                movable.set_inpoint(movable.props.in_point - newstart)
+                movable.set_duration(movable.props.duration + newstart)
+
+    def _cropToRegion(self, pairs, reference):
+        """
+        Keep only the part of the envelopes inside the region.
+
+        @returns: The (clip, cropped envelope) pairs of the clips covering
+            the region, and the index of the first block kept for each.
+        @rtype: (list((L{Clip}, numpy array)), list(int))
+        """
+        region_start, region_end = self._region
+        cropped_pairs = []
+        crops = []
+        for clip, envelope in pairs:
+            start = clip.props.start
+            first = max(0, (region_start - start) * self.BLOCKRATE // Gst.SECOND)
+            last = min(len(envelope),
+                       (region_end - start) * self.BLOCKRATE // Gst.SECOND)
+            if last - first < self.BLOCKRATE:
+                # Less than a second of the clip is in the region.
+                if clip is reference:
+                    self.warning("The reference is not in the region, "
+                                 "comparing the whole clips")
+                    return pairs, [0] * len(pairs)
+                self.debug("Not aligning %s, outside of the region", clip)
+                continue
+            cropped_pairs.append((clip, envelope[first:last]))
+            crops.append(first)
+        return cropped_pairs, crops
+
+    def _estimateDrifts(self, envelopes, reference_index, offsets):
+        """
+        Estimate the clock drift of the envelopes relative to the reference.
+
+        The offsets of the drifting envelopes are updated to the position
+        at which they start, instead of their average position.
+
+        @returns: The drift rate of each envelope, 0 if not significant.
+        @rtype: list(float)
+        """
+        drifts = [0.] * len(envelopes)
+        reference = envelopes[reference_index]
+        if len(reference) <= 2 * int(20. / self.MAX_DRIFT) or \
+                Gst.ElementFactory.find("pitch") is None:
+            return drifts
+
+        for i, envelope in enumerate(envelopes):
+            if i == reference_index:
+                continue
+            # Only the neighbourhood of the coarse offset is searched, so
+            # no full-length FFT is needed.
+            estimate = driftalign(reference, envelope, offsets[i],
+                                  self.MAX_DRIFT)
+            if estimate is None:
+                continue
+            offset, drift = estimate
+            if abs(drift) < self.MIN_DRIFT:
+                continue
+            if abs(offset - offsets[i]) > abs(drift) * len(envelopes[i]) + 1:
+                # The envelope does not overlap the reference enough
+                # to measure its drift.
+                continue
+            self.debug("Envelope %d drifts by %f", i, drift)
+            drifts[i] = drift
+            offsets[i] = offset
+        return drifts
+
+    def _setDrift(self, clip, drift):
+        """Time-stretch the audio of the clip to compensate the drift."""
+        # A positive drift means the clip is faster than the reference.
+        tempo = 1 / (1 + drift)
+        for effect in clip.get_top_effects():
+            if effect.props.bin_description == self.DRIFT_EFFECT:
+                break
+        else:
+            effect = GES.Effect.new(self.DRIFT_EFFECT)
+            clip.add(effect)
+        self.debug("Setting the tempo of %s to %f", clip, tempo)
+        effect.set_child_property("tempo", tempo)
 
 
 class AlignmentProgressDialog:
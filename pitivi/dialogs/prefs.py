@@ -46,7 +46,8 @@ class PreferencesDialog(Loggable):
     """Preferences for how the app works."""
 
     prefs = {}
-    section_names = {"timeline": _("Timeline")}
+    section_names = {"timeline": _("Timeline"),
+                     "proxy": _("Proxy Files")}
 
     def __init__(self, app):
         Loggable.__init__(self)
@@ -98,10 +99,11 @@ class PreferencesDialog(Loggable):
         cls.prefs[section][attrname] = (label, description, widget_class, args)
 
     @classmethod
-    def addPathPreference(cls, attrname, label, description, section=None):
+    def addPathPreference(cls, attrname, label, description, section=None,
+                          action=Gtk.FileChooserAction.OPEN):
         """Adds a user preference for a file path."""
         cls._add_preference(attrname, label, description, section,
-                            widgets.PathWidget)
+                            widgets.PathWidget, action=action)
 
     @classmethod
     def addNumericPreference(cls, attrname, label, description, section=None,
@@ -19,8 +19,11 @@
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
 import os
+import sqlite3
 import threading
 import time
+from collections import deque
+from collections import OrderedDict
 from gettext import gettext as _
 from gettext import ngettext
 from hashlib import md5
@@ -45,7 +48,9 @@ from pitivi.dialogs.clipmediaprops import ClipMediaPropsDialog
 from pitivi.dialogs.filelisterrordialog import FileListErrorDialog
 from pitivi.mediafilespreviewer import PreviewWidget
 from pitivi.settings import GlobalSettings
+from pitivi.settings import xdg_cache_home
 from pitivi.shortcuts import ShortcutsWindow
+from pitivi.timeline.previewers import findThumbnailCache
 from pitivi.timeline.previewers import getThumbnailCache
 from pitivi.utils.loggable import Loggable
 from pitivi.utils.misc import disconnectAllByFunc
@@ -68,6 +73,25 @@ from pitivi.utils.ui import URI_TARGET_ENTRY
 SHOW_TREEVIEW = 1
 SHOW_ICONVIEW = 2
 
+# The maximum time spent inserting rows in the store in one go, so the UI
+# does not freeze when importing many files.
+ROWS_INSERTION_BUDGET = 0.04  # seconds
+# The number of rows inserted at once above which the store is sorted only
+# after inserting them, instead of at each insertion.
+ROWS_UNSORTED_INSERTION = 100  # rows
+# How often the information of the assets being proxied is refreshed.
+INFO_REFRESH_INTERVAL = 500  # ms
+# The maximum number of threads generating the missing thumbnails.
+MAX_THUMBNAILERS = max(1, min(4, os.cpu_count() or 1))
+# The number of frames shown when moving the pointer over an icon.
+FILMSTRIP_FRAMES = 16
+# The maximum number of filmstrips kept in memory.
+MAX_FILMSTRIPS = 200
+# The maximum number of files whose icons are kept in the icons cache.
+MAX_CACHED_ICONS = 1000  # files
+# The version of the schema of the icons cache.
+ICONS_CACHE_VERSION = 1
+
 GlobalSettings.addConfigSection('clip-library')
 GlobalSettings.addConfigOption('lastImportFolder',
                                section='clip-library',
@@ -115,6 +139,38 @@ for category, mime_types in SUPPORTED_FILE_FORMATS.items():
     for mime in mime_types:
         SUPPORTED_MIMETYPES.append(category + "/" + mime)
 
+# The number of bytes read from the files for guessing their type when the
+# extension is not enough.
+MAGIC_BYTES_SIZE = 4096
+
+
+def is_media_file(path):
+    """Checks cheaply whether the file might be imported in the project.
+
+    The type of the file is guessed from its extension and, if that is not
+    conclusive, from its first bytes, so most of the unrelated files are
+    filtered out before they reach the discoverer.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        bool: Whether the file looks like a supported media file.
+    """
+    content_type, uncertain = Gio.content_type_guess(path, None)
+    if uncertain:
+        try:
+            with open(path, "rb") as fileobj:
+                data = fileobj.read(MAGIC_BYTES_SIZE)
+        except OSError:
+            return False
+        content_type, unused_uncertain = Gio.content_type_guess(path, data)
+    mime = Gio.content_type_get_mime_type(content_type)
+    if not mime:
+        return False
+    return mime in SUPPORTED_MIMETYPES or \
+        mime.split("/")[0] in ("audio", "video")
+
 
 class FileChooserExtraWidget(Gtk.Grid, Loggable):
     def __init__(self, app):
@@ -179,6 +235,8 @@ class ThumbnailsDecorator(Loggable):
     ASSET_PROXYING_ERROR = "asset-proxying-error"
 
     DEFAULT_ALPHA = 255
+    # The maximum number of decorated thumbnails kept for reuse.
+    DECORATED_CACHE_SIZE = 1000
 
     for status in [PROXIED, IN_PROGRESS, ASSET_PROXYING_ERROR]:
         EMBLEMS[status] = []
@@ -186,14 +244,26 @@ class ThumbnailsDecorator(Loggable):
             EMBLEMS[status].append(GdkPixbuf.Pixbuf.new_from_file_at_size(
                 os.path.join(get_pixmap_dir(), "%s.svg" % status), size, size))
 
-    def __init__(self, thumbs, asset):
+    def __init__(self, thumbs, asset, fallback=False, decorated=None):
         Loggable.__init__(self)
         self.src_64 = thumbs[0]
         self.src_128 = thumbs[1]
+        # Whether the thumbs are generic icons waiting for a thumbnail.
+        self.fallback = fallback
+        # The decorated thumbnails by (source thumbnail id, state, size
+        # index), shared by the decorators of a media library. The source
+        # thumbnail is kept with the decorated one so its id cannot be
+        # reused meanwhile by another pixbuf.
+        self.__decorated = OrderedDict() if decorated is None else decorated
 
         self.__asset = asset
         self.decorate()
 
+    def setAsset(self, asset):
+        """Updates the decoration to reflect the state of another asset."""
+        self.__asset = asset
+        self.decorate()
+
     def __setState(self):
         asset = self.__asset
         target = asset.get_proxy_target()
@@ -213,29 +283,218 @@ class ThumbnailsDecorator(Loggable):
             self.thumb_128 = self.src_128
             return
 
-        self.thumb_64 = self.src_64.copy()
-        self.thumb_128 = self.src_128.copy()
-        for i, thumb in enumerate([self.thumb_64, self.thumb_128]):
-            emblems = self.EMBLEMS[self.state]
-            src = emblems[i]
-
-            # We need to set dest_y == offset_y for the source image
-            # not to be cropped, that API is weird.
-            if thumb.get_height() < src.get_height():
-                src = src.copy()
-                src = src.scale_simple(src.get_width(),
-                                       thumb.get_height(),
-                                       GdkPixbuf.InterpType.BILINEAR)
-
-            src.composite(thumb, dest_x=0,
-                          dest_y=thumb.get_height() - src.get_height(),
-                          dest_width=src.get_width(),
-                          dest_height=src.get_height(),
-                          offset_x=0,
-                          offset_y=thumb.get_height() - src.get_height(),
-                          scale_x=1.0, scale_y=1.0,
-                          interp_type=GdkPixbuf.InterpType.BILINEAR,
-                          overall_alpha=self.DEFAULT_ALPHA)
+        self.thumb_64 = self.__getDecorated(self.src_64, 0)
+        self.thumb_128 = self.__getDecorated(self.src_128, 1)
+
+    def __getDecorated(self, source, size_index):
+        key = (id(source), self.state, size_index)
+        cached = self.__decorated.get(key)
+        if cached and cached[0] is source:
+            self.__decorated.move_to_end(key)
+            return cached[1]
+
+        thumb = source.copy()
+        src = self.EMBLEMS[self.state][size_index]
+
+        # We need to set dest_y == offset_y for the source image
+        # not to be cropped, that API is weird.
+        if thumb.get_height() < src.get_height():
+            src = src.copy()
+            src = src.scale_simple(src.get_width(),
+                                   thumb.get_height(),
+                                   GdkPixbuf.InterpType.BILINEAR)
+
+        src.composite(thumb, dest_x=0,
+                      dest_y=thumb.get_height() - src.get_height(),
+                      dest_width=src.get_width(),
+                      dest_height=src.get_height(),
+                      offset_x=0,
+                      offset_y=thumb.get_height() - src.get_height(),
+                      scale_x=1.0, scale_y=1.0,
+                      interp_type=GdkPixbuf.InterpType.BILINEAR,
+                      overall_alpha=self.DEFAULT_ALPHA)
+
+        self.__decorated[key] = (source, thumb)
+        if len(self.__decorated) > self.DECORATED_CACHE_SIZE:
+            self.__decorated.popitem(last=False)
+        return thumb
+
+
+class SearchIndex(object):
+    """Index for finding quickly the texts containing a search string.
+
+    Attributes:
+        texts (dict): The lowercase indexed texts by key.
+    """
+
+    # The length of the substrings of the texts which are indexed.
+    N = 3
+
+    def __init__(self):
+        self.texts = {}
+        # The keys of the texts containing each trigram.
+        self.__keys = {}
+
+    def __trigrams(self, text):
+        return {text[i:i + self.N] for i in range(len(text) - self.N + 1)}
+
+    def add(self, key, text):
+        """Indexes the specified text, replacing the previous one of `key`."""
+        self.remove(key)
+        text = text.lower()
+        self.texts[key] = text
+        for trigram in self.__trigrams(text):
+            self.__keys.setdefault(trigram, set()).add(key)
+
+    def remove(self, key):
+        """Removes the text of `key` from the index."""
+        text = self.texts.pop(key, None)
+        if text is None:
+            return
+        for trigram in self.__trigrams(text):
+            keys = self.__keys[trigram]
+            keys.discard(key)
+            if not keys:
+                del self.__keys[trigram]
+
+    def clear(self):
+        """Removes all the texts from the index."""
+        self.texts.clear()
+        self.__keys.clear()
+
+    def search(self, text, candidates=None):
+        """Finds the texts containing the specified string.
+
+        Args:
+            text (str): The string to search for, case-insensitively.
+            candidates (Optional[set]): The keys among which to search, for
+                example the result of a search for a substring of `text`.
+
+        Returns:
+            set: The keys of the texts containing `text`.
+        """
+        text = text.lower()
+        if len(text) >= self.N:
+            keys_sets = sorted((self.__keys.get(trigram, set())
+                                for trigram in self.__trigrams(text)),
+                               key=len)
+            if candidates is not None:
+                keys_sets.insert(0, candidates)
+            candidates = set.intersection(*keys_sets)
+        elif candidates is None:
+            candidates = self.texts.keys()
+        return {key for key in candidates
+                if key in self.texts and text in self.texts[key]}
+
+
+class IconsCache(Loggable):
+    """Persistent cache of the icons of the files shown in the media library.
+
+    The icons are keyed by the URI of the file and are reused as long as
+    its size and its modification time do not change, so reopening a
+    project does not have to look for its thumbnails again. A moved or
+    copied file has a different URI, so its thumbnails are looked up again.
+
+    The changes are saved on disk only by `commit` and `close`, which also
+    forget the least recently used icons above the limit.
+
+    Attributes:
+        max_files (int): The maximum number of files whose icons are kept.
+    """
+
+    def __init__(self, dbfile, max_files=MAX_CACHED_ICONS):
+        Loggable.__init__(self)
+        self.max_files = max_files
+        self._db = sqlite3.connect(dbfile)
+        self._cur = self._db.cursor()
+        self._cur.execute("PRAGMA user_version")
+        if self._cur.fetchone()[0] != ICONS_CACHE_VERSION:
+            self._cur.execute("DROP TABLE IF EXISTS Icons")
+            self._cur.execute("PRAGMA user_version = %d" % ICONS_CACHE_VERSION)
+        self._cur.execute("CREATE TABLE IF NOT EXISTS Icons\
+                          (Uri TEXT NOT NULL PRIMARY KEY,\
+                          Fingerprint TEXT NOT NULL,\
+                          Icon64 BLOB NOT NULL,\
+                          Icon128 BLOB NOT NULL,\
+                          LastUsed REAL NOT NULL)")
+
+    @staticmethod
+    def fingerprint(uri):
+        """Gets a string which changes when the file is modified.
+
+        Returns:
+            str: The fingerprint, or None if the file cannot be accessed.
+        """
+        try:
+            stat = os.stat(path_from_uri(uri))
+        except OSError:
+            return None
+        return "%d:%d" % (stat.st_size, stat.st_mtime_ns)
+
+    @staticmethod
+    def __loadPixbuf(data):
+        loader = GdkPixbuf.PixbufLoader.new()
+        loader.write(data)
+        loader.close()
+        return loader.get_pixbuf()
+
+    @staticmethod
+    def __savePixbuf(pixbuf):
+        success, data = pixbuf.save_to_bufferv("png", [], [])
+        return sqlite3.Binary(data) if success else None
+
+    def getIcons(self, uri):
+        """Gets the icons of the specified file.
+
+        Returns:
+            List[GdkPixbuf.Pixbuf]: The thumb_64 and thumb_128 if available
+                and up to date, None otherwise.
+        """
+        self._cur.execute("SELECT Fingerprint, Icon64, Icon128 FROM Icons"
+                          " WHERE Uri = ?", (uri,))
+        row = self._cur.fetchone()
+        if not row or row[0] != self.fingerprint(uri):
+            return None, None
+        try:
+            icons = self.__loadPixbuf(row[1]), self.__loadPixbuf(row[2])
+        except GLib.GError as e:
+            self.warning("Invalid icons cached for %s: %s", uri, e)
+            return None, None
+        self._cur.execute("UPDATE Icons SET LastUsed = ? WHERE Uri = ?",
+                          (time.time(), uri))
+        return icons
+
+    def setIcons(self, uri, thumb_64, thumb_128):
+        """Saves the icons of the specified file."""
+        fingerprint = self.fingerprint(uri)
+        if fingerprint is None:
+            return
+        icon_64 = self.__savePixbuf(thumb_64)
+        icon_128 = self.__savePixbuf(thumb_128)
+        if icon_64 is None or icon_128 is None:
+            self.warning("PNG compression failed for %s", uri)
+            return
+        self._cur.execute("INSERT OR REPLACE INTO Icons"
+                          " VALUES (?, ?, ?, ?, ?)",
+                          (uri, fingerprint, icon_64, icon_128, time.time()))
+
+    def __prune(self):
+        self._cur.execute("DELETE FROM Icons WHERE Uri NOT IN"
+                          " (SELECT Uri FROM Icons"
+                          " ORDER BY LastUsed DESC LIMIT ?)",
+                          (self.max_files,))
+        if self._cur.rowcount > 0:
+            self.debug("Forgot the icons of %d files", self._cur.rowcount)
+
+    def commit(self):
+        """Saves the cache on disk."""
+        self.__prune()
+        self._db.commit()
+
+    def close(self):
+        """Saves the cache on disk and releases the database."""
+        self.commit()
+        self._db.close()
 
 
 class MediaLibraryWidget(Gtk.Box, Loggable):
@@ -253,11 +512,37 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         Gtk.Box.__init__(self)
         Loggable.__init__(self)
 
-        self.pending_rows = []
+        # The rows waiting to be inserted in the store, by asset URI.
+        self.pending_rows = OrderedDict()
+        self.__flush_source = 0
+        # The references to the storemodel rows, by asset URI.
+        self._rows = {}
+        # The information text of the rows, by asset URI.
+        self._search_index = SearchIndex()
+        # The search string and the URIs of the assets matching it.
+        self.__search_text = ""
+        self.__matching_uris = None
+        # The assets whose information changed since the last refresh.
+        self.__dirty_assets = set()
+        self.__refresh_source = 0
 
         self.app = app
         self._errors = []
+        # The (asset URI, file URI) of the assets needing a thumbnail.
         self._missing_thumbs = []
+        self.__thumbs_queue = deque()
+        self.__thumbnailers = 0
+        # The thumbnails generated and not yet shown, with the asset URIs.
+        self.__generated_thumbs = []
+        self.__thumbs_lock = threading.Lock()
+        self.__thumbs_source = 0
+        # The decorated thumbnails reused by the ThumbnailsDecorators.
+        self._decorated_thumbs = OrderedDict()
+        # The frames shown when scrubbing the icons, by asset URI.
+        self._filmstrips = OrderedDict()
+        self.__filmstrips_source = 0
+        # The URI of the asset whose icon is being scrubbed.
+        self.__scrubbed_uri = None
         self._project = None
         self._draggedPaths = None
         self.dragged = False
@@ -292,7 +577,6 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         self._import_button = builder.get_object("media_import_button")
         self._clipprops_button = builder.get_object("media_props_button")
         self._listview_button = builder.get_object("media_listview_button")
-        searchEntry = builder.get_object("media_search_entry")
 
         # Store
         self.storemodel = Gtk.ListStore(*STORE_MODEL_STRUCTURE)
@@ -322,8 +606,7 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         # Filtering model for the search box.
         # Use this instead of using self.storemodel directly
         self.modelFilter = self.storemodel.filter_new()
-        self.modelFilter.set_visible_func(
-            self._setRowVisible, data=searchEntry)
+        self.modelFilter.set_visible_func(self._setRowVisible)
 
         # TreeView
         # Displays icon, name, type, length
@@ -384,10 +667,19 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         self.iconview.props.item_padding = 3
         self.iconview.props.margin = 3
         self.iconview_cursor_pos = None
+        self.iconview.add_events(Gdk.EventMask.POINTER_MOTION_MASK |
+                                 Gdk.EventMask.LEAVE_NOTIFY_MASK)
+        self.iconview.connect(
+            "motion-notify-event", self._iconViewMotionNotifyEventCb)
+        self.iconview.connect(
+            "leave-notify-event", self._iconViewLeaveNotifyEventCb)
+        vadjustment = self.iconview_scrollwin.get_vadjustment()
+        vadjustment.connect("changed", self.__iconViewScrolledCb)
+        vadjustment.connect("value-changed", self.__iconViewScrolledCb)
 
-        cell = Gtk.CellRendererPixbuf()
-        self.iconview.pack_start(cell, False)
-        self.iconview.add_attribute(cell, "pixbuf", COL_ICON_128)
+        self.__icon_cell = Gtk.CellRendererPixbuf()
+        self.iconview.pack_start(self.__icon_cell, False)
+        self.iconview.add_attribute(self.__icon_cell, "pixbuf", COL_ICON_128)
 
         cell = Gtk.CellRendererText()
         cell.props.alignment = Pango.Alignment.CENTER
@@ -413,6 +705,9 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         project_manager.connect("new-project-loaded", self._newProjectLoadedCb)
         project_manager.connect("new-project-failed", self._newProjectFailedCb)
         project_manager.connect("project-closed", self._projectClosedCb)
+        self.app.proxy_manager.connect("progress", self.__proxyingProgressCb)
+        self.app.proxy_manager.connect("asset-preparing-cancelled",
+                                       self.__proxyingCancelledCb)
 
         # Drag and Drop
         self.drag_dest_set(Gtk.DestDefaults.DROP | Gtk.DestDefaults.MOTION,
@@ -460,10 +755,25 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         self.pack_start(self._progressbar, False, False, 0)
 
         self.thumbnailer = MediaLibraryWidget._getThumbnailer()
+        self._icons_cache = IconsCache(
+            os.path.join(xdg_cache_home(), "medialibrary-icons.db"))
 
     def finalize(self):
         self.debug("Finalizing %s", self)
 
+        if self.__flush_source:
+            GLib.source_remove(self.__flush_source)
+            self.__flush_source = 0
+        if self.__refresh_source:
+            GLib.source_remove(self.__refresh_source)
+            self.__refresh_source = 0
+        if self.__filmstrips_source:
+            GLib.source_remove(self.__filmstrips_source)
+            self.__filmstrips_source = 0
+        self.app.proxy_manager.disconnect_by_func(self.__proxyingProgressCb)
+        self.app.proxy_manager.disconnect_by_func(self.__proxyingCancelledCb)
+        self._icons_cache.close()
+
         self.app.project_manager.disconnect_by_func(self._new_project_loading_cb)
         self.app.project_manager.disconnect_by_func(self._newProjectLoadedCb)
         self.app.project_manager.disconnect_by_func(self._newProjectFailedCb)
@@ -508,16 +818,28 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         return 1
 
     def getAssetForUri(self, uri):
-        for path in self.modelFilter:
-            asset = path[COL_ASSET]
-            info = asset.get_info()
-            asset_uri = info.get_uri()
-            if asset_uri == uri:
-                self.debug("Found asset: %s for uri: %s", asset, uri)
-                return asset
+        row = self._getRow(uri)
+        if row is not None:
+            asset = row[COL_ASSET]
+            self.debug("Found asset: %s for uri: %s", asset, uri)
+            return asset
 
         self.warning("Did not find any asset for uri: %s", uri)
 
+    def _getRow(self, uri):
+        """Gets the storemodel row of the asset with the specified URI.
+
+        Args:
+            uri (str): The URI of the asset.
+
+        Returns:
+            Gtk.TreeModelRow: The row, or None if the asset is not shown.
+        """
+        row_ref = self._rows.get(uri)
+        if not row_ref or not row_ref.valid():
+            return None
+        return self.storemodel[row_ref.get_path()]
+
     def _setupViewAsDragAndDropSource(self, view):
         view.drag_source_set(0, [], Gdk.DragAction.COPY)
         view.enable_model_drag_source(
@@ -571,8 +893,24 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         # Realistically, nobody expects to search for only one character,
         # and skipping that makes a huge difference in responsiveness.
         if len(entry.get_text()) != 1:
+            self.__search(entry.get_text())
             self.modelFilter.refilter()
 
+    def __search(self, text):
+        """Finds the assets to be shown for the specified search string."""
+        # We must convert to markup form to be able to search for &, ', etc.
+        text = GLib.markup_escape_text(text.lower())
+        if not text:
+            self.__matching_uris = None
+        elif self.__search_text and self.__search_text in text and \
+                self.__matching_uris is not None:
+            # Only the assets which matched already can match.
+            self.__matching_uris = self._search_index.search(
+                text, self.__matching_uris)
+        else:
+            self.__matching_uris = self._search_index.search(text)
+        self.__search_text = text
+
     def _searchEntryIconClickedCb(self, entry, icon_pos, unused_event):
         if icon_pos == Gtk.EntryIconPosition.SECONDARY:
             entry.set_text("")
@@ -584,15 +922,20 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
             elif self.clip_view == SHOW_ICONVIEW:
                 self.iconview.grab_focus()
 
-    def _setRowVisible(self, model, iter, data):
+    def _setRowVisible(self, model, iter, unused_data):
         """Toggles the visibility of a liststore row."""
-        text = data.get_text().lower()
-        if not text:
-            # Avoid silly warnings.
+        if self.__matching_uris is None:
             return True
-        # We must convert to markup form to be able to search for &, ', etc.
-        text = GLib.markup_escape_text(text)
-        return text in model.get_value(iter, COL_INFOTEXT).lower()
+        return model.get_value(iter, COL_URI) in self.__matching_uris
+
+    def __indexInfoText(self, uri, info_text):
+        self._search_index.add(uri, info_text)
+        if self.__matching_uris is None:
+            return
+        if self.__search_text in self._search_index.texts[uri]:
+            self.__matching_uris.add(uri)
+        else:
+            self.__matching_uris.discard(uri)
 
     def _getIcon(self, iconname, alternate=None, size=48):
         icontheme = Gtk.IconTheme.get_default()
@@ -746,6 +1089,47 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
             64, 64, GdkPixbuf.InterpType.BILINEAR)
         return pixbuf_128, pixbuf_64
 
+    def __findThumbnails(self, asset, real_uri):
+        """Looks for existing thumbnails of the specified asset.
+
+        Returns:
+            List[GdkPixbuf.Pixbuf]: The thumb_64 and thumb_128 if available,
+                None otherwise.
+        """
+        # The code below tries to read existing thumbnails from the freedesktop
+        # thumbnails directory (~/.thumbnails). The filenames are simply
+        # the file URI hashed with md5, so we can retrieve them easily.
+        #
+        # From the freedesktop spec: "if the environment variable
+        # $XDG_CACHE_HOME is set and not blank then the directory
+        # $XDG_CACHE_HOME/thumbnails will be used, otherwise
+        # $HOME/.cache/thumbnails will be used."
+        # Older version of the spec also mentioned $HOME/.thumbnails
+        quoted_uri = quote_uri(real_uri)
+        thumbnail_hash = md5(quoted_uri.encode()).hexdigest()
+        try:
+            thumb_dir = os.environ['XDG_CACHE_HOME']
+            thumb_64, thumb_128 = self._getThumbnailInDir(
+                thumb_dir, thumbnail_hash)
+        except KeyError:
+            thumb_64, thumb_128 = (None, None)
+        if thumb_64 is None:
+            thumb_dir = os.path.expanduser("~/.cache/thumbnails/")
+            thumb_64, thumb_128 = self._getThumbnailInDir(
+                thumb_dir, thumbnail_hash)
+        if thumb_64 is None:
+            thumb_dir = os.path.expanduser("~/.thumbnails/")
+            thumb_64, thumb_128 = self._getThumbnailInDir(
+                thumb_dir, thumbnail_hash)
+        if thumb_64 is None and not asset.is_image():
+            thumb_cache = getThumbnailCache(asset)
+            thumb_64 = thumb_cache.getPreviewThumbnail()
+            if thumb_64:
+                thumb_128 = thumb_64.scale_simple(
+                    128, thumb_64.get_height() * 2,
+                    GdkPixbuf.InterpType.BILINEAR)
+        return thumb_64, thumb_128
+
     def _addAsset(self, asset):
         # 128 is the normal size for thumbnails, but for *icons* it looks
         # insane
@@ -760,94 +1144,137 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
 
         self.debug("Adding asset %s", asset.props.id)
 
-        # The code below tries to read existing thumbnails from the freedesktop
-        # thumbnails directory (~/.thumbnails). The filenames are simply
-        # the file URI hashed with md5, so we can retrieve them easily.
         video_streams = [
             stream_info for stream_info in info.get_stream_list()
             if isinstance(stream_info, GstPbutils.DiscovererVideoInfo)]
         real_uri = get_proxy_target(asset).props.id
+        fallback = False
         if video_streams:
-            # From the freedesktop spec: "if the environment variable
-            # $XDG_CACHE_HOME is set and not blank then the directory
-            # $XDG_CACHE_HOME/thumbnails will be used, otherwise
-            # $HOME/.cache/thumbnails will be used."
-            # Older version of the spec also mentioned $HOME/.thumbnails
-            quoted_uri = quote_uri(real_uri)
-            thumbnail_hash = md5(quoted_uri.encode()).hexdigest()
-            try:
-                thumb_dir = os.environ['XDG_CACHE_HOME']
-                thumb_64, thumb_128 = self._getThumbnailInDir(
-                    thumb_dir, thumbnail_hash)
-            except KeyError:
-                thumb_64, thumb_128 = (None, None)
-            if thumb_64 is None:
-                thumb_dir = os.path.expanduser("~/.cache/thumbnails/")
-                thumb_64, thumb_128 = self._getThumbnailInDir(
-                    thumb_dir, thumbnail_hash)
+            thumb_64, thumb_128 = self._icons_cache.getIcons(real_uri)
             if thumb_64 is None:
-                thumb_dir = os.path.expanduser("~/.thumbnails/")
-                thumb_64, thumb_128 = self._getThumbnailInDir(
-                    thumb_dir, thumbnail_hash)
+                thumb_64, thumb_128 = self.__findThumbnails(asset, real_uri)
+                if thumb_64 is not None:
+                    self._icons_cache.setIcons(real_uri, thumb_64, thumb_128)
             if thumb_64 is None:
+                fallback = True
+                if self.thumbnailer:
+                    self._missing_thumbs.append((asset.props.id, real_uri))
                 if asset.is_image():
                     thumb_64 = self._getIcon("image-x-generic")
                     thumb_128 = self._getIcon(
                         "image-x-generic", None, LARGE_SIZE)
                 else:
-                    thumb_cache = getThumbnailCache(asset)
-                    thumb_64 = thumb_cache.getPreviewThumbnail()
-                    if not thumb_64:
-                        thumb_64 = self._getIcon("video-x-generic")
-                        thumb_128 = self._getIcon("video-x-generic",
-                                                  None, LARGE_SIZE)
-                    else:
-                        thumb_128 = thumb_64.scale_simple(
-                            128, thumb_64.get_height() * 2,
-                            GdkPixbuf.InterpType.BILINEAR)
+                    thumb_64 = self._getIcon("video-x-generic")
+                    thumb_128 = self._getIcon("video-x-generic",
+                                              None, LARGE_SIZE)
         else:
             thumb_64 = self._getIcon("audio-x-generic")
             thumb_128 = self._getIcon("audio-x-generic", None, LARGE_SIZE)
 
-        thumbs_decorator = ThumbnailsDecorator([thumb_64, thumb_128], asset)
+        thumbs_decorator = ThumbnailsDecorator([thumb_64, thumb_128], asset,
+                                               fallback, self._decorated_thumbs)
         if info.get_duration() == Gst.CLOCK_TIME_NONE:
             duration = ''
         else:
             duration = beautify_length(info.get_duration())
         name = info_name(asset)
-        self.pending_rows.append((thumbs_decorator.thumb_64,
-                                  thumbs_decorator.thumb_128,
-                                  beautify_asset(asset),
-                                  asset,
-                                  asset.props.id,
-                                  duration,
-                                  name,
-                                  thumbs_decorator))
-        self._flushPendingRows()
+        self.pending_rows[asset.props.id] = (thumbs_decorator.thumb_64,
+                                             thumbs_decorator.thumb_128,
+                                             beautify_asset(asset),
+                                             asset,
+                                             asset.props.id,
+                                             duration,
+                                             name,
+                                             thumbs_decorator)
+        if self._project.loaded and len(self._project.loading_assets) <= 1:
+            # Nothing to batch when a single asset is being imported.
+            self.__flushPendingRow(asset.props.id)
+        elif not self.__flush_source:
+            self.__flush_source = GLib.idle_add(
+                self.__flushPendingRowsIdleCb, priority=GLib.PRIORITY_LOW)
+
+    def __flushPendingRowsIdleCb(self):
+        if self._flushPendingRows(ROWS_INSERTION_BUDGET):
+            return True
+        self.__flush_source = 0
+        return False
+
+    def _flushPendingRows(self, budget=None):
+        """Inserts the pending rows in the store.
+
+        When many rows are pending, the store is sorted once all of them
+        have been inserted.
+
+        Args:
+            budget (Optional[float]): The maximum time to spend, in seconds,
+                None to insert all the pending rows.
+
+        Returns:
+            bool: Whether some rows are still pending.
+        """
+        if not self.pending_rows:
+            return False
 
-    def _flushPendingRows(self):
         self.debug("Flushing %d pending model rows", len(self.pending_rows))
-        for row in self.pending_rows:
-            self.storemodel.append(row)
+        if len(self.pending_rows) > ROWS_UNSORTED_INSERTION:
+            # Inserting so many rows at their sorted position is slower
+            # than sorting the store once.
+            self.storemodel.set_sort_column_id(
+                Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID,
+                Gtk.SortType.ASCENDING)
+        start = time.time()
+        while self.pending_rows:
+            if budget is not None and time.time() - start > budget:
+                return True
+            unused_uri, row = self.pending_rows.popitem(last=False)
+            self.__insertRow(row)
+
+        # Nothing happens if the store is still sorted.
+        self.storemodel.set_sort_column_id(COL_URI, Gtk.SortType.ASCENDING)
+        return False
+
+    def __flushPendingRow(self, uri):
+        """Inserts right away the pending row of the specified asset."""
+        row = self.pending_rows.pop(uri, None)
+        if row:
+            self.__insertRow(row)
 
-        del self.pending_rows[:]
+    def __insertRow(self, row):
+        self.__indexInfoText(row[COL_URI], row[COL_INFOTEXT])
+        row_iter = self.storemodel.append(row)
+        self._rows[row[COL_URI]] = Gtk.TreeRowReference.new(
+            self.storemodel, self.storemodel.get_path(row_iter))
+
+    def __clearRows(self):
+        self.storemodel.clear()
+        self._rows.clear()
+        self._search_index.clear()
+        self.pending_rows.clear()
+        self.__dirty_assets.clear()
+        self._filmstrips.clear()
+        self._decorated_thumbs.clear()
+        self.__scrubbed_uri = None
+        # Save the icons found while the project was open.
+        self._icons_cache.commit()
+        self._missing_thumbs = []
+        # Stop the thumbnailing threads.
+        with self.__thumbs_lock:
+            self.__thumbs_queue.clear()
 
     # medialibrary callbacks
 
     def _assetLoadingProgressCb(self, project, progress, estimated_time):
+        if progress == 100:
+            # All the imported assets are shown when the import is done.
+            self._flushPendingRows()
         self._progressbar.set_fraction(progress / 100)
 
-        for row in self.storemodel:
-            row[COL_INFOTEXT] = beautify_asset(row[COL_ASSET])
-
         if progress == 0:
             self._startImporting(project)
             return
 
         if project.loaded:
-            num_proxying_files = [asset
-                                  for asset in project.loading_assets
-                                  if not asset.ready]
+            num_proxying_files = project.getNumAssetsInProgress()
             if estimated_time:
                 self.__last_proxying_estimate_time = beautify_ETA(int(
                     estimated_time * Gst.SECOND))
@@ -860,38 +1287,113 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
             # "There remains approximatively %s" (to handle gender and plurals)
             template = ngettext("Transcoding %d asset: %d%% (About %s left)",
                                 "Transcoding %d assets: %d%% (About %s left)",
-                                len(num_proxying_files))
+                                num_proxying_files)
             progress_message = template % (
-                len(num_proxying_files), progress,
+                num_proxying_files, progress,
                 self.__last_proxying_estimate_time)
             self._progressbar.set_text(progress_message)
-            self._last_imported_uris.update([asset.props.id for asset in
-                                             project.loading_assets])
 
         if progress == 100:
             self._doneImporting()
 
+    def __proxyingProgressCb(self, unused_proxy_manager, asset,
+                             unused_creation_progress, unused_estimated_time):
+        self.__markDirty(asset)
+
+    def __proxyingCancelledCb(self, unused_proxy_manager, asset):
+        self.__markDirty(asset)
+
+    def __markDirty(self, asset):
+        """Schedules the refresh of the information shown for an asset."""
+        self.__dirty_assets.add(asset)
+        if not self.__refresh_source:
+            self.__refresh_source = GLib.timeout_add(
+                INFO_REFRESH_INTERVAL, self.__refreshDirtyRowsCb)
+
+    def __refreshDirtyRowsCb(self):
+        for asset in self.__dirty_assets:
+            row = self._getRow(asset.props.id)
+            if row is not None:
+                self.__updateRow(row)
+        self.__dirty_assets.clear()
+        self.__refresh_source = 0
+        return False
+
+    def __updateRow(self, row):
+        """Updates the emblem and the info of a row to its asset's state."""
+        asset = row[COL_ASSET]
+        thumbs_decorator = row[COL_THUMB_DECORATOR]
+        thumbs_decorator.setAsset(asset)
+        row[COL_ICON_64] = thumbs_decorator.thumb_64
+        row[COL_ICON_128] = thumbs_decorator.thumb_128
+        info_text = beautify_asset(asset)
+        self.__indexInfoText(asset.props.id, info_text)
+        row[COL_INFOTEXT] = info_text
+
+    def __replaceRow(self, old_asset, asset):
+        """Shows an asset in place of another one, such as its proxy.
+
+        The thumbnails of the row of `old_asset` are reused, so nothing
+        has to be loaded from disk.
+        """
+        self.__flushPendingRow(old_asset.props.id)
+        self.__flushPendingRow(asset.props.id)
+        row = self._getRow(asset.props.id)
+        old_row = self._getRow(old_asset.props.id)
+        if row is not None:
+            if old_row is not None:
+                self.__removeAsset(old_asset)
+        elif old_row is not None:
+            self._rows.pop(old_asset.props.id)
+            self._search_index.remove(old_asset.props.id)
+            row_iter = old_row.iter
+            self.storemodel.set(row_iter, {COL_ASSET: asset,
+                                           COL_URI: asset.props.id,
+                                           COL_SEARCH_TEXT: info_name(asset)})
+            # The row might have moved, as the store is sorted by URI.
+            row = self.storemodel[row_iter]
+            self._rows[asset.props.id] = Gtk.TreeRowReference.new(
+                self.storemodel, row.path)
+        else:
+            self._addAsset(asset)
+            self.__flushPendingRow(asset.props.id)
+            return
+        self.__updateRow(row)
+
     def __assetProxyingCb(self, proxy, unused_pspec):
         self.debug("Proxy is %s", proxy.props.id)
-        self.__removeAsset(proxy)
+        target = proxy.get_proxy_target()
+        if target is not None:
+            self.__replaceRow(target, proxy)
+            return
 
-        if proxy.get_proxy_target() is not None:
-            # Re add the proxy so its emblem icon is updated.
-            self._addAsset(proxy)
+        # The proxy is not used anymore, show its target instead.
+        target_uri = self.app.proxy_manager.getTargetUri(proxy, self._project)
+        target = self._project.get_asset(target_uri, GES.UriClip)
+        if target is not None:
+            self.__replaceRow(proxy, target)
+        else:
+            self.__removeAsset(proxy)
 
     def __assetProxiedCb(self, asset, unused_pspec):
         self.debug("Asset proxied: %s -- %s", asset, asset.props.id)
         proxy = asset.props.proxy
-        self.__removeAsset(asset)
-        if not proxy:
-            self._addAsset(asset)
+        if proxy:
+            self.__replaceRow(asset, proxy)
+        else:
+            self.__refreshRow(asset)
 
         if self._project.loaded:
             self.app.gui.timeline_ui.switchProxies(asset)
 
-    def _assetAddedCb(self, unused_project, asset):
+    def _assetAddedCb(self, project, asset):
         """Checks whether the asset added to the project should be shown."""
-        if asset in [row[COL_ASSET] for row in self.storemodel]:
+        if project.loaded:
+            # Imported by the user, to be selected when the import is done.
+            self._last_imported_uris.add(asset.props.id)
+
+        if asset.props.id in self._rows or \
+                asset.props.id in self.pending_rows:
             self.info("Asset %s already in!", asset.props.id)
             return
 
@@ -916,21 +1418,32 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
     def __removeAsset(self, asset):
         """Removes the specified asset."""
         uri = asset.get_id()
-        # Find the corresponding line in the storemodel and remove it.
-        found = False
-        for row in self.storemodel:
-            if uri == row[COL_URI]:
-                self.storemodel.remove(row.iter)
-                found = True
-                break
-
-        if not found:
+        row = self._getRow(uri)
+        self._rows.pop(uri, None)
+        self._filmstrips.pop(uri, None)
+        if uri == self.__scrubbed_uri:
+            self.__scrubbed_uri = None
+        self._search_index.remove(uri)
+        if row is not None:
+            self.storemodel.remove(row.iter)
+        elif self.pending_rows.pop(uri, None):
+            self.debug("Removed %s before it was shown", uri)
+        else:
             self.info("Failed to remove %s as it was not found"
                       "in the liststore", uri)
 
     def _proxyingErrorCb(self, unused_project, asset):
-        self.__removeAsset(asset)
-        self._addAsset(asset)
+        self.__refreshRow(asset)
+
+    def __refreshRow(self, asset):
+        """Updates right away the row of an asset, adding it if missing."""
+        self.__flushPendingRow(asset.props.id)
+        row = self._getRow(asset.props.id)
+        if row is not None:
+            self.__updateRow(row)
+        else:
+            self._addAsset(asset)
+            self.__flushPendingRow(asset.props.id)
 
     def _errorCreatingAssetCb(self, unused_project, error, id, type):
         """Gathers asset loading errors."""
@@ -952,7 +1465,7 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
     def _doneImporting(self):
         self.debug("Importing took %.3f seconds",
                    time.time() - self.import_start_time)
-        self._flushPendingRows()
+        self._icons_cache.commit()
         self._progressbar.hide()
         if self._errors:
             errors_amount = len(self._errors)
@@ -969,13 +1482,15 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
             self._warning_label.set_text(text)
             self._import_warning_infobar.show_all()
 
-        missing_thumbs = self._missing_thumbs
+        # The thumbnails might have been found meanwhile, for example when
+        # the proxies have been created.
+        missing_thumbs = [(asset_uri, uri)
+                          for asset_uri, uri in self._missing_thumbs
+                          if self.__showsFallbackIcon(asset_uri)]
         self._missing_thumbs = []
         if missing_thumbs:
             self.info("Generating missing thumbnails: %d", len(missing_thumbs))
-            self._thumbs_process = threading.Thread(
-                target=MediaLibraryWidget._generateThumbnailsThread, args=(self, missing_thumbs))
-            self._thumbs_process.start()
+            self.__generateThumbnailsAsync(missing_thumbs)
 
         self._selectLastImportedUris()
 
@@ -997,27 +1512,104 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         self._selectSources(self._last_imported_uris)
         self._last_imported_uris = set()
 
-    def _generateThumbnailsThread(self, missing_thumbs):
-        for uri in missing_thumbs:
+    def __generateThumbnailsAsync(self, missing_thumbs):
+        """Generates thumbnails in a pool of threads.
+
+        Args:
+            missing_thumbs (List[(str, str)]): The URIs of the assets and of
+                the files needing a thumbnail.
+        """
+        with self.__thumbs_lock:
+            self.__thumbs_queue.extend(missing_thumbs)
+            num_threads = min(MAX_THUMBNAILERS - self.__thumbnailers,
+                              len(missing_thumbs))
+            self.__thumbnailers += num_threads
+        for unused_i in range(num_threads):
+            threading.Thread(target=self._generateThumbnailsThread).start()
+
+    def _generateThumbnailsThread(self):
+        while True:
+            with self.__thumbs_lock:
+                if not self.__thumbs_queue:
+                    self.__thumbnailers -= 1
+                    return
+                asset_uri, uri = self.__thumbs_queue.popleft()
+
             thumbnails = self._generateThumbnails(uri)
             if not thumbnails:
                 continue
-            pixbuf_128, pixbuf_64 = thumbnails
-            # Search through the model for the row corresponding to the asset.
-            found = False
-            for row in self.storemodel:
-                if uri == row[COL_URI]:
-                    found = True
-                    # Finally, show the new pixbuf in the UI
-                    if pixbuf_128:
-                        row[COL_ICON_128] = pixbuf_128
-                    if pixbuf_64:
-                        row[COL_ICON_64] = pixbuf_64
-                    break
-            if not found:
+
+            # The store must be updated in the main thread, the thumbnails
+            # generated meanwhile are shown together.
+            with self.__thumbs_lock:
+                self.__generated_thumbs.append((asset_uri, thumbnails))
+                if not self.__thumbs_source:
+                    self.__thumbs_source = GLib.idle_add(
+                        self.__showGeneratedThumbnailsCb)
+
+    def __getAssetRow(self, uri):
+        """Gets the row showing an asset, its proxy or its proxy target."""
+        row = self._getRow(uri)
+        if row is None:
+            row = self.__getRelatedRow(uri)
+        return row
+
+    def __showsFallbackIcon(self, uri):
+        """Checks whether an asset is shown with a generic icon."""
+        pending_row = self.pending_rows.get(uri)
+        if pending_row:
+            return pending_row[COL_THUMB_DECORATOR].fallback
+        row = self.__getAssetRow(uri)
+        return row is not None and row[COL_THUMB_DECORATOR].fallback
+
+    def __getRelatedRow(self, uri):
+        """Gets the row of the proxy or of the proxy target of an asset."""
+        if not self._project:
+            return None
+        asset = self._project.get_asset(uri, GES.UriClip)
+        if not asset:
+            return None
+        for related in (asset.get_proxy(), asset.get_proxy_target()):
+            if related:
+                row = self._getRow(related.props.id)
+                if row is not None:
+                    return row
+        return None
+
+    def __showGeneratedThumbnailsCb(self):
+        with self.__thumbs_lock:
+            generated_thumbs = self.__generated_thumbs
+            self.__generated_thumbs = []
+            self.__thumbs_source = 0
+
+        for asset_uri, (pixbuf_128, pixbuf_64) in generated_thumbs:
+            # The row might show the proxy or the target of the asset
+            # by now.
+            row = self.__getAssetRow(asset_uri)
+            if row is None:
                 # Can happen if the user removed the asset in the meanwhile.
-                self.log(
-                    "%s needed a thumbnail, but vanished from storemodel", uri)
+                self.log("%s needed a thumbnail, but vanished from storemodel",
+                         asset_uri)
+                continue
+
+            thumbs_decorator = row[COL_THUMB_DECORATOR]
+            if not thumbs_decorator.fallback:
+                self.log("%s got a thumbnail in the meanwhile", asset_uri)
+                continue
+
+            real_uri = get_proxy_target(row[COL_ASSET]).props.id
+            self._icons_cache.setIcons(real_uri, pixbuf_64, pixbuf_128)
+
+            # Finally, show the new pixbuf in the UI
+            thumbs_decorator.src_64 = pixbuf_64
+            thumbs_decorator.src_128 = pixbuf_128
+            thumbs_decorator.fallback = False
+            thumbs_decorator.decorate()
+            row[COL_ICON_64] = thumbs_decorator.thumb_64
+            row[COL_ICON_128] = thumbs_decorator.thumb_128
+        self._icons_cache.commit()
+
+        return False
 
     # Error Dialog Box callbacks
 
@@ -1403,6 +1995,132 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
                     iconview.unselect_all()
                     iconview.select_path(current_cursor_pos)
 
+    def _iconViewMotionNotifyEventCb(self, iconview, event):
+        x, y = int(event.x), int(event.y)
+        path = iconview.get_path_at_pos(x, y)
+        if not path:
+            self.__stopScrubbing()
+            return False
+
+        uri = self.modelFilter[path][COL_URI]
+        res, rect = iconview.get_cell_rect(path, self.__icon_cell)
+        if not res or not rect.width:
+            return False
+        # The event is relative to the bin window, the rect to the widget.
+        icon_x, unused_icon_y = iconview.convert_widget_to_bin_window_coords(
+            rect.x, rect.y)
+        position = (x - icon_x) / rect.width
+        if not 0 <= position < 1:
+            self.__stopScrubbing()
+            return False
+
+        row = self._getRow(uri)
+        frames = self.__getFilmstrip(row)
+        if not frames:
+            self.__stopScrubbing()
+            return False
+
+        if uri != self.__scrubbed_uri:
+            self.__stopScrubbing()
+            self.__scrubbed_uri = uri
+        frame = frames[int(position * len(frames))]
+        if row[COL_ICON_128] is not frame:
+            row[COL_ICON_128] = frame
+        return False
+
+    def _iconViewLeaveNotifyEventCb(self, unused_iconview, unused_event):
+        self.__stopScrubbing()
+        return False
+
+    def __stopScrubbing(self):
+        """Shows again the icon of the asset which has been scrubbed."""
+        if not self.__scrubbed_uri:
+            return
+        row = self._getRow(self.__scrubbed_uri)
+        self.__scrubbed_uri = None
+        if row is not None:
+            row[COL_ICON_128] = row[COL_THUMB_DECORATOR].thumb_128
+
+    def __getFilmstrip(self, row):
+        """Gets the frames shown when scrubbing the icon of a row.
+
+        The frames are taken from the thumbnails cached for the timeline,
+        the files are not decoded.
+
+        Returns:
+            List[GdkPixbuf.Pixbuf]: The frames, scaled to the size of the
+                icon. Empty if the asset has no cached thumbnails.
+        """
+        uri = row[COL_URI]
+        frames = self._filmstrips.get(uri)
+        if frames is not None:
+            self._filmstrips.move_to_end(uri)
+            return frames
+
+        frames = []
+        asset = row[COL_ASSET]
+        thumb_cache = None
+        if not asset.is_image() and asset.get_info().get_video_streams():
+            thumb_cache = findThumbnailCache(asset)
+        if thumb_cache:
+            icon = row[COL_THUMB_DECORATOR].thumb_128
+            try:
+                filmstrip = thumb_cache.getFilmstrip(FILMSTRIP_FRAMES)
+            except (sqlite3.Error, GLib.Error) as e:
+                self.warning("Could not read the thumbnails of %s: %s",
+                             uri, e)
+                filmstrip = []
+            for frame in filmstrip:
+                height = max(1, icon.get_width() * frame.get_height() //
+                             frame.get_width())
+                frames.append(frame.scale_simple(
+                    icon.get_width(), height, GdkPixbuf.InterpType.BILINEAR))
+
+        self._filmstrips[uri] = frames
+        if len(self._filmstrips) > MAX_FILMSTRIPS:
+            self._filmstrips.popitem(last=False)
+        return frames
+
+    def __iconViewScrolledCb(self, unused_adjustment):
+        if not self.__filmstrips_source:
+            self.__filmstrips_source = GLib.idle_add(
+                self.__loadVisibleFilmstripsCb, priority=GLib.PRIORITY_LOW)
+
+    def __loadVisibleFilmstripsCb(self):
+        more = False
+        try:
+            more = self.__loadNextVisibleFilmstrip()
+        finally:
+            # Allow scheduling the callback again, even if it failed.
+            if not more:
+                self.__filmstrips_source = 0
+        return more
+
+    def __loadNextVisibleFilmstrip(self):
+        """Loads the filmstrip of a visible icon, one at a time.
+
+        Returns:
+            bool: Whether there might be more filmstrips to load.
+        """
+        visible_range = None
+        if self.clip_view == SHOW_ICONVIEW:
+            visible_range = self.iconview.get_visible_range()
+        if not visible_range:
+            return False
+
+        start, end = visible_range
+        first = start.get_indices()[0]
+        last = min(end.get_indices()[0], first + MAX_FILMSTRIPS - 1)
+        for index in range(first, last + 1):
+            uri = self.modelFilter[index][COL_URI]
+            if uri not in self._filmstrips:
+                row = self._getRow(uri)
+                if row is not None:
+                    self.__getFilmstrip(row)
+                    return True
+
+        return False
+
     def __disconnectFromProject(self):
         self._project.disconnect_by_func(self._assetAddedCb)
         self._project.disconnect_by_func(self._assetLoadingProgressCb)
@@ -1416,7 +2134,7 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
 
         self._project = project
         self._resetErrorList()
-        self.storemodel.clear()
+        self.__clearRows()
         self._welcome_infobar.show_all()
         self._connectToProject(project)
 
@@ -1425,13 +2143,13 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         self._flushPendingRows()
 
     def _newProjectFailedCb(self, unused_project_manager, unused_uri, unused_reason):
-        self.storemodel.clear()
+        self.__clearRows()
         self._project = None
 
     def _projectClosedCb(self, unused_project_manager, unused_project):
         self.__disconnectFromProject()
         self._project_settings_set_infobar.hide()
-        self.storemodel.clear()
+        self.__clearRows()
         self._project = None
 
     def _addUris(self, uris):
@@ -1473,7 +2191,8 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         if directories:
             # Recursively import from folders that were dragged into the
             # library
-            self.app.threads.addThread(PathWalker, directories, self._addUris)
+            self.app.threads.addThread(PathWalker, directories,
+                                       self._addUris, is_media_file)
         if filenames:
             self._last_imported_uris.update(filenames)
             assets = self._project.assetsForUris(list(self._last_imported_uris))
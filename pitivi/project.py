@@ -18,10 +18,12 @@
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
 """Project related classes."""
+import collections
 import datetime
 import os
 import pwd
 import tarfile
+import threading
 import time
 from gettext import gettext as _
 
@@ -62,6 +64,17 @@ DEFAULT_NAME = _("New Project")
 DEFAULT_MUXER = "oggmux"
 DEFAULT_VIDEO_ENCODER = "theoraenc"
 DEFAULT_AUDIO_ENCODER = "vorbisenc"
+# The maximum number of assets being discovered at the same time when
+# importing files.
+MAX_DISCOVERIES = 8
+# The backup of the project is saved once the project has not been changed
+# for BACKUP_IDLE_DELAY, but at least every BACKUP_MAX_DELAY while the
+# project keeps being changed.
+BACKUP_IDLE_DELAY = 10  # seconds
+BACKUP_MAX_DELAY = 60  # seconds
+# How long to wait before trying again when the app is busy, for example
+# playing the timeline.
+BACKUP_RETRY_DELAY = 5  # seconds
 
 
 class ProjectManager(GObject.Object, Loggable):
@@ -95,8 +108,14 @@ class ProjectManager(GObject.Object, Loggable):
         self.app = app
         self.current_project = None
         self.disable_save = False
-        self._backup_lock = 0
         self.exitcode = 0
+        # The source of the timeout or idle callback saving the backup.
+        self.__backup_source = 0
+        # When the first and the last changes not yet backed up were made.
+        self.__first_change_time = 0
+        self.__last_change_time = 0
+        # The thread moving the last saved backup file in place.
+        self._backup_thread = None
 
     def _tryUsingBackupFile(self, uri):
         backup_path = self._makeBackupURI(path_from_uri(uri))
@@ -330,6 +349,7 @@ class ProjectManager(GObject.Object, Loggable):
                 # It is possible that self.current_project.uri == None when the backup
                 # timer sent us an old instance of the (now closed) project.
                 return False
+            self.__waitForBackup()
         elif uri is None:
             # "Normal save" scenario. The filechoosers in mainwindow ask users
             # for permission to overwrite the file (if needed), so we're safe.
@@ -345,12 +365,18 @@ class ProjectManager(GObject.Object, Loggable):
                           _("You do not have permissions to write to this folder."))
                 return False
 
+        save_uri = uri
+        if backup:
+            # The GES objects can be used only in the main thread, so the
+            # project is serialized here, in a temporary file. Syncing it to
+            # disk and moving it in place is done in a thread.
+            save_uri = uri + ".part"
         try:
             # "overwrite" is always True: our GTK filechooser save dialogs are
             # set to always ask the user on our behalf about overwriting, so
             # if saveProject is actually called, that means overwriting is OK.
             saved = self.current_project.save(
-                self.current_project.ges_timeline, uri,
+                self.current_project.ges_timeline, save_uri,
                 formatter_type, overwrite=True)
         except Exception as e:
             saved = False
@@ -368,10 +394,33 @@ class ProjectManager(GObject.Object, Loggable):
                 self.current_project.uri = uri
                 self.disable_save = False
             else:
-                self.debug('Saved backup: %s', uri)
+                self._backup_thread = threading.Thread(
+                    target=self._writeBackup,
+                    args=(path_from_uri(save_uri), path_from_uri(uri)))
+                self._backup_thread.start()
 
         return saved
 
+    def _writeBackup(self, tmp_path, path):
+        """Moves a serialized backup file in place, atomically.
+
+        Called in a separate thread, as syncing the file can take a while.
+        """
+        try:
+            with open(tmp_path, "rb") as tmp_file:
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self.warning("Failed to save the backup %s: %s", path, e)
+            return
+        self.debug("Saved backup: %s", path)
+
+    def __waitForBackup(self):
+        """Waits for the thread saving the backup file to finish."""
+        if self._backup_thread:
+            self._backup_thread.join()
+            self._backup_thread = None
+
     def exportProject(self, project, uri):
         """Exports a project and all its media files to a *.tar archive."""
         # Save the project to a temporary file.
@@ -456,6 +505,10 @@ class ProjectManager(GObject.Object, Loggable):
             return False
 
         self.current_project.finalize()
+        if self.__backup_source:
+            GLib.source_remove(self.__backup_source)
+            self.__backup_source = 0
+        self.__first_change_time = 0
 
         project = self.current_project
         self.current_project = None
@@ -529,34 +582,52 @@ class ProjectManager(GObject.Object, Loggable):
         self.loadProject(uri)
 
     def _projectChangedCb(self, project):
-        # _backup_lock is a timer, when a change in the project is done it is
-        # set to 10 seconds. If before those 10 secs pass another change occurs,
-        # 5 secs are added to the timeout callback instead of saving the backup
-        # file. The limit is 60 seconds.
-        uri = project.uri
-        if uri is None:
+        if project.uri is None:
             return
 
-        if self._backup_lock == 0:
-            self._backup_lock = 10
-            GLib.timeout_add_seconds(
-                self._backup_lock, self._saveBackupCb, project, uri)
-        else:
-            if self._backup_lock < 60:
-                self._backup_lock += 5
+        now = time.time()
+        if not self.__first_change_time:
+            self.__first_change_time = now
+        self.__last_change_time = now
+        if not self.__backup_source:
+            self.__scheduleBackup(BACKUP_IDLE_DELAY)
+
+    def __scheduleBackup(self, delay):
+        self.__backup_source = GLib.timeout_add(
+            int(delay * 1000), self.__backupTimeoutCb)
+
+    def __backupTimeoutCb(self):
+        self.__backup_source = 0
+        now = time.time()
+        idle_time = now - self.__last_change_time
+        pending_time = now - self.__first_change_time
+        if idle_time < BACKUP_IDLE_DELAY and pending_time < BACKUP_MAX_DELAY:
+            # The project is still being changed.
+            self.__scheduleBackup(min(BACKUP_IDLE_DELAY - idle_time,
+                                      BACKUP_MAX_DELAY - pending_time))
+            return False
 
-    def _saveBackupCb(self, unused_project, unused_uri):
-        if self._backup_lock > 10:
-            self._backup_lock -= 5
-            return True
-        else:
-            self.saveProject(backup=True)
-            self._backup_lock = 0
+        pipeline = self.current_project and self.current_project.pipeline
+        if (pipeline and pipeline.playing()) or \
+                (self._backup_thread and self._backup_thread.is_alive()):
+            self.__scheduleBackup(BACKUP_RETRY_DELAY)
+            return False
+
+        # Save when the pending events have been handled.
+        self.__backup_source = GLib.idle_add(self._saveBackupCb,
+                                             priority=GLib.PRIORITY_LOW)
+        return False
+
+    def _saveBackupCb(self):
+        self.__backup_source = 0
+        self.__first_change_time = 0
+        self.saveProject(backup=True)
         return False
 
     def _cleanBackup(self, uri):
         if uri is None:
             return
+        self.__waitForBackup()
         path = path_from_uri(self._makeBackupURI(uri))
         if os.path.exists(path):
             os.remove(path)
@@ -640,7 +711,16 @@ class Project(Loggable, GES.Project):
         self.loaded = False
         self.at_least_one_asset_missing = False
         self.app = app
-        self.loading_assets = []
+        # The assets being loaded or proxied, by ID.
+        self.loading_assets = {}
+        # The (duration, creation progress) of the loading assets, as
+        # accounted in the totals below, by ID.
+        self.__loading_weights = {}
+        self.__loading_duration = 0
+        # The sum of the durations weighted by the creation progress.
+        self.__loading_progress = 0
+        # The number of loading assets with a creation progress under 100.
+        self.__num_in_progress = 0
         self.asset_loading_progress = 100
         self.app.proxy_manager.connect("progress", self.__assetTranscodingProgressCb)
         self.app.proxy_manager.connect("error-preparing-asset",
@@ -660,6 +740,12 @@ class Project(Loggable, GES.Project):
         self._dirty = False
         self.nb_remaining_file_to_import = 0
         self.nb_imported_files = 0
+        # The URIs waiting for their discovery to be started.
+        self.__pending_uris = collections.deque()
+        # The URIs being discovered.
+        self.__discovering_uris = set()
+        self.__discovery_start = 0
+        self.__num_discovered = 0
 
         # Project property default values
         self.register_meta(GES.MetaFlag.READWRITE, "name", name)
@@ -944,45 +1030,78 @@ class Project(Loggable, GES.Project):
     # ------------------------------#
     def __assetTranscodingProgressCb(self, unused_proxy_manager, asset,
                                      creation_progress, estimated_time):
+        self.__updateLoadingAsset(asset)
         self.__updateAssetLoadingProgress(estimated_time)
 
-    def __updateAssetLoadingProgress(self, estimated_time=0):
-        num_loading_assets = len(self.loading_assets)
+    def __addLoadingAsset(self, asset):
+        self.__removeLoadingAsset(asset)
+        weight = (asset.get_duration(), asset.creation_progress)
+        self.__addLoadingWeight(weight)
+        self.__loading_weights[asset.props.id] = weight
+        self.loading_assets[asset.props.id] = asset
+
+    def __removeLoadingAsset(self, asset):
+        if self.loading_assets.pop(asset.props.id, None) is None:
+            return
+        self.__addLoadingWeight(
+            self.__loading_weights.pop(asset.props.id), -1)
+
+    def __updateLoadingAsset(self, asset):
+        """Updates the totals with the current state of a loading asset."""
+        weight = self.__loading_weights.get(asset.props.id)
+        if weight is None:
+            return
+        self.__addLoadingWeight(weight, -1)
+        weight = (asset.get_duration(), asset.creation_progress)
+        self.__addLoadingWeight(weight)
+        self.__loading_weights[asset.props.id] = weight
 
-        if num_loading_assets == 0:
+        if asset.creation_progress >= 100 and not asset.ready:
+            self.setModificationState(True)
+            asset.ready = True
+
+    def __addLoadingWeight(self, weight, sign=1):
+        duration, progress = weight
+        self.__loading_duration += sign * duration
+        self.__loading_progress += sign * duration * progress
+        if progress < 100:
+            self.__num_in_progress += sign
+
+    def __clearLoadingAssets(self):
+        self.loading_assets = {}
+        self.__loading_weights = {}
+        self.__loading_duration = 0
+        self.__loading_progress = 0
+        self.__num_in_progress = 0
+
+    def getNumAssetsInProgress(self):
+        """Gets the number of loading assets which are not ready yet."""
+        return self.__num_in_progress
+
+    def __updateAssetLoadingProgress(self, estimated_time=0):
+        if not self.loading_assets:
+            self.__clearLoadingAssets()
             self.app.action_log.commit("Adding assets")
             self.emit("asset-loading-progress", 100, estimated_time)
             return
 
-        total_import_duration = 0
-        for asset in self.loading_assets:
-            total_import_duration += asset.get_duration()
-
-        if total_import_duration == 0:
+        if self.__loading_duration <= 0:
             self.info("No known duration yet")
             return
 
-        self.asset_loading_progress = 0
-        all_ready = True
-        for asset in self.loading_assets:
-            asset_weight = asset.get_duration() / total_import_duration
-            self.asset_loading_progress += asset_weight * asset.creation_progress
-
-            if asset.creation_progress < 100:
-                all_ready = False
-            elif not asset.ready:
-                self.setModificationState(True)
-                asset.ready = True
-
+        all_ready = self.__num_in_progress == 0
         if all_ready:
             self.asset_loading_progress = 100
+        else:
+            progress = self.__loading_progress / self.__loading_duration
+            self.asset_loading_progress = max(0, min(100, progress))
 
         self.emit("asset-loading-progress", self.asset_loading_progress,
                   estimated_time)
 
         if all_ready:
             self.info("No more loading assets")
-            self.loading_assets = []
+            self.__clearLoadingAssets()
 
     def __assetTranscodingCancelledCb(self, unused_proxy_manager, asset):
         self.__setProxy(asset, None)
@@ -990,16 +1109,12 @@ class Project(Loggable, GES.Project):
 
     def __proxyErrorCb(self, unused_proxy_manager, asset, proxy, error):
         if asset is None:
-            asset_id = self.app.proxy_manager.getTargetUri(proxy)
+            asset_id = self.app.proxy_manager.getTargetUri(proxy, self)
             if asset_id:
                 asset = GES.Asset.request(proxy.get_extractable_type(),
                                           asset_id)
                 if not asset:
-                    for tmpasset in self.loading_assets:
-                        if tmpasset.props.id == asset_id:
-                            asset = tmpasset
-                            break
-
+                    asset = self.loading_assets.get(asset_id)
                     if not asset:
                         self.error("Could not get the asset %s from its proxy %s", asset_id,
                                    proxy.props.id)
@@ -1012,6 +1127,7 @@ class Project(Loggable, GES.Project):
 
         asset.proxying_error = error
         asset.creation_progress = 100
+        self.__updateLoadingAsset(asset)
 
         self.emit("proxying-error", asset)
         self.__updateAssetLoadingProgress()
@@ -1027,14 +1143,12 @@ class Project(Loggable, GES.Project):
             proxy.creation_progress = 100
 
         asset.set_proxy(proxy)
-        try:
-            self.loading_assets.remove(asset)
-        except ValueError:
-            pass
+        self.__removeLoadingAsset(asset)
 
         if proxy:
             self.add_asset(proxy)
-            self.loading_assets.append(proxy)
+            self.__addLoadingAsset(proxy)
+            self.__updateLoadingAsset(proxy)
 
         self.__updateAssetLoadingProgress()
 
@@ -1050,6 +1164,9 @@ class Project(Loggable, GES.Project):
             # Progress == 0 means "starting to import"
             self.emit("asset-loading-progress", 0, 0)
 
+        # The ID can change if the file is moved, see `__assetDiscovered`.
+        asset.loading_uri = asset.props.id
+
         if not self.loaded:
             self.debug("Project still loading, not using proxies: "
                        "%s", asset.props.id)
@@ -1061,13 +1178,15 @@ class Project(Loggable, GES.Project):
         asset.ready = False
         asset.force_proxying = False
         asset.proxying_error = None
-        self.loading_assets.append(asset)
+        self.__addLoadingAsset(asset)
 
     def do_asset_removed(self, asset):
         self.app.proxy_manager.cancelJob(asset)
 
     def do_asset_added(self, asset):
         """Handles `GES.Project::asset-added` emitted by self."""
+        if asset:
+            self.__assetDiscovered(asset)
         self._maybeInitSettingsFromAsset(asset)
         if asset and not GObject.type_is_a(asset.get_extractable_type(),
                                            GES.UriClip):
@@ -1075,11 +1194,14 @@ class Project(Loggable, GES.Project):
             self.debug("Ignoring asset: %s", asset.props.id)
             return
 
-        if asset not in self.loading_assets:
+        if asset.props.id not in self.loading_assets:
             self.debug("Asset %s is not in loading assets, "
                        " it must not be proxied", asset.get_id())
             return
 
+        # The duration of the asset is known now that it has been discovered.
+        self.__updateLoadingAsset(asset)
+
         if self.loaded:
             if not asset.get_proxy_target() in self.list_assets(GES.Extractable):
                 self.app.proxy_manager.addJob(asset, asset.force_proxying)
@@ -1091,22 +1213,20 @@ class Project(Loggable, GES.Project):
 
     def do_loading_error(self, error, asset_id, unused_type):
         """Handles `GES.Project::error-loading-asset` emitted by self."""
+        self.__uriDiscovered(asset_id)
         if not self.loaded:
             self.info("Error loading asset %s while loading a project"
                       " not updating proxy creation progress", asset_id)
             self.__updateAssetLoadingProgress()
             return
 
-        asset = None
-        for asset in self.loading_assets:
-            if asset.get_id() == asset_id:
-                break
-
+        asset = self.loading_assets.get(asset_id)
         self.error("Could not load %s: %s -> %s" % (asset_id, error,
                                                     asset))
-        asset.error = error
-        asset.creation_progress = 100
-        self.loading_assets.remove(asset)
+        if asset:
+            asset.error = error
+            asset.creation_progress = 100
+            self.__removeLoadingAsset(asset)
         self.__updateAssetLoadingProgress()
 
     def do_loaded(self, unused_timeline):
@@ -1200,6 +1320,7 @@ class Project(Loggable, GES.Project):
                                            " but it does not look like one!",
                                            asset.props.id)
                     os.remove(Gst.uri_get_location(asset.props.id))
+                    self.app.proxy_manager.releaseProxy(asset.props.id)
             else:
                 self.app.proxy_manager.cancelJob(asset)
 
@@ -1266,8 +1387,49 @@ class Project(Loggable, GES.Project):
             uris (List[str]): The URIs of the assets.
         """
         self.app.action_log.begin("Adding assets")
+        if not self.__pending_uris and not self.__discovering_uris:
+            self.__discovery_start = time.time()
+            self.__num_discovered = 0
+        self.__pending_uris.extend(quote_uri(uri) for uri in uris)
+        self.__discoverNextUris()
+
+    def __discoverNextUris(self):
+        """Starts discovering the pending URIs, at most MAX_DISCOVERIES."""
+        while self.__pending_uris and \
+                len(self.__discovering_uris) < MAX_DISCOVERIES:
+            uri = self.__pending_uris.popleft()
+            self.__discovering_uris.add(uri)
+            if not self.create_asset(uri, GES.UriClip):
+                # Already in the project or already failed.
+                self.__discovering_uris.discard(uri)
+
+    def __assetDiscovered(self, asset):
+        """Frees the discovery slot of an asset.
+
+        The asset might have been discovered under a different URI, when the
+        file has been found elsewhere, or when the proxy of an already
+        discovered asset is added instead of it.
+        """
+        uris = {asset.props.id, getattr(asset, "loading_uri", None)}
+        target = asset.get_proxy_target()
+        if target:
+            uris.add(target.props.id)
         for uri in uris:
-            self.create_asset(quote_uri(uri), GES.UriClip)
+            self.__uriDiscovered(uri)
+
+    def __uriDiscovered(self, uri):
+        if uri not in self.__discovering_uris:
+            return
+        self.__discovering_uris.remove(uri)
+        self.__num_discovered += 1
+        # Start the next discoveries before the discovered asset is
+        # processed, so the import is not considered finished meanwhile.
+        self.__discoverNextUris()
+        if not self.__pending_uris and not self.__discovering_uris:
+            elapsed = time.time() - self.__discovery_start
+            self.info("Discovered %d files in %.2f seconds (%.1f files/s)",
+                      self.__num_discovered, elapsed,
+                      self.__num_discovered / elapsed if elapsed else 0)
 
     def assetsForUris(self, uris):
         assets = []
@@ -1453,6 +1615,9 @@ class Project(Loggable, GES.Project):
         if not isinstance(asset, GES.UriClipAsset):
             # We are only interested in actual files, not in titles, for example.
             return
+        if asset.get_proxy_target():
+            # Proxies can be smaller than the original files.
+            return
 
         emit = False
         info = asset.get_info()
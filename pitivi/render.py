@@ -748,7 +748,11 @@ class RenderDialog(Loggable):
                     continue
 
                 if self.__automatically_use_proxies.get_active():
-                    if self.app.proxy_manager.isAssetFormatWellSupported(
+                    if self.app.proxy_manager.isScaledProxy(asset):
+                        self.info("Asset %s is a scaled proxy, "
+                                  "rendering from real asset.",
+                                  asset_target.props.id)
+                    elif self.app.proxy_manager.isAssetFormatWellSupported(
                             asset_target):
                         self.info("Asset %s format well supported, "
                                   "rendering from real asset.",
@@ -760,15 +764,37 @@ class RenderDialog(Loggable):
                         continue
 
                 if not asset_target.get_error():
-                    clip.set_asset(asset_target)
+                    self.__setAssetKeepingPositions(clip, asset_target)
                     self.error("Using %s as an asset (instead of %s)",
                                asset_target.get_id(),
                                asset.get_id())
                     self.__unproxiedClips[clip] = asset
 
+    @staticmethod
+    def __setAssetKeepingPositions(clip, asset):
+        """Replaces the asset of the clip, keeping the video positioning.
+
+        The proxy and the original can have different sizes, but the
+        positioning is expressed in project pixels so it must not change.
+        """
+        positions = {}
+        for source in clip.find_track_elements(None, GES.TrackType.VIDEO,
+                                               GES.VideoSource):
+            for prop in ("posx", "posy", "width", "height"):
+                res, value = source.get_child_property(prop)
+                if res:
+                    positions[prop] = value
+
+        clip.set_asset(asset)
+
+        for source in clip.find_track_elements(None, GES.TrackType.VIDEO,
+                                               GES.VideoSource):
+            for prop, value in positions.items():
+                source.set_child_property(prop, value)
+
     def __useProxyAssets(self):
         for clip, asset in self.__unproxiedClips.items():
-            clip.set_asset(asset)
+            self.__setAssetKeepingPositions(clip, asset)
 
         self.__unproxiedClips = {}
 
@@ -41,6 +41,7 @@ except ImportError:
 
 # pylint: disable=ungrouped-imports
 from pitivi.settings import get_dir, xdg_cache_home
+from pitivi.utils import fingerprint
 from pitivi.utils.loggable import Loggable
 from pitivi.utils.misc import binary_search, filename_from_uri, quantize
 from pitivi.utils.misc import quote_uri, hash_file, get_proxy_target
@@ -162,7 +163,11 @@ class TeedThumbnailBin(ThumbnailBin):
 
 # pylint: disable=too-many-instance-attributes
 class WaveformPreviewer(PreviewerBin):
-    """Bin to generate and save waveforms as a pickle file."""
+    """Bin to generate and save waveforms as a pickle file.
+
+    The audio fingerprint of the file is computed in the same pass and saved
+    in the fingerprint index.
+    """
 
     __gproperties__ = {
         "uri": (str,
@@ -179,10 +184,17 @@ class WaveformPreviewer(PreviewerBin):
     def __init__(self):
         PreviewerBin.__init__(self,
                               "audioconvert ! audioresample ! level name=level"
-                              " ! audioconvert ! audioresample")
+                              " ! spectrum name=spectrum bands=%d interval=%d"
+                              " ! audioconvert ! audioresample" %
+                              (fingerprint.SPECTRUM_BANDS,
+                               fingerprint.FRAME_DURATION))
         self.level = self.internal_bin.get_by_name("level")
+        self.spectrum = self.internal_bin.get_by_name("spectrum")
         self.debug("Creating waveforms!!")
         self.peaks = None
+        self.spectrogram = []
+        self.frequency_bins = None
+        self.fingerprint = False
 
         self.uri = None
         self.wavefile = None
@@ -204,6 +216,9 @@ class WaveformPreviewer(PreviewerBin):
             self.uri = value
             self.wavefile = get_wavefile_location_for_uri(self.uri)
             self.passthrough = os.path.exists(self.wavefile)
+            self.fingerprint = \
+                not fingerprint.getFingerprintIndex().contains(self.uri)
+            self.spectrum.props.post_messages = self.fingerprint
         elif prop.name == 'duration':
             self.duration = value
             self.n_samples = self.duration / SAMPLE_DURATION
@@ -239,8 +254,36 @@ class WaveformPreviewer(PreviewerBin):
                     else:
                         self.peaks[i][pos] = self.peaks[i][pos - 1]
 
+        if self.fingerprint and \
+                message.type == Gst.MessageType.ELEMENT and \
+                message.src == self.spectrum:
+            self.__addSpectrum(message.get_structure())
+
         return Gst.Bin.do_post_message(self, message)
 
+    def __addSpectrum(self, struct):
+        if not struct or not struct.has_field("magnitude"):
+            return
+
+        if self.frequency_bins is None:
+            caps = self.spectrum.get_static_pad("sink").get_current_caps()
+            res, rate = caps[0].get_int("rate")
+            if not res:
+                return
+            self.frequency_bins = fingerprint.frequencyBins(rate)
+
+        stream_time = struct.get_value("stream-time")
+        pos = int(stream_time / fingerprint.FRAME_DURATION)
+        if pos < len(self.spectrogram):
+            return
+        # Keep the frames aligned on the stream time when some are missing.
+        while len(self.spectrogram) < pos:
+            self.spectrogram.append(
+                numpy.full(fingerprint.NUM_BINS, -numpy.inf))
+        magnitudes = numpy.array(list(struct.get_value("magnitude")))
+        self.spectrogram.append(
+            fingerprint.reduceSpectrum(magnitudes, self.frequency_bins))
+
     def finalize(self, proxy=None):
         """Finalizes the previewer, saving data to file if needed."""
         if not self.passthrough and self.peaks:
@@ -255,6 +298,12 @@ class WaveformPreviewer(PreviewerBin):
             with open(self.wavefile, 'wb') as wavefile:
                 pickle.dump(list(samples), wavefile)
 
+        if self.fingerprint and self.spectrogram:
+            peaks = fingerprint.findPeaks(numpy.array(self.spectrogram))
+            fingerprint.getFingerprintIndex().addLandmarks(
+                self.uri, fingerprint.computeLandmarks(peaks))
+            self.spectrogram = []
+
         if proxy:
             proxy_wavefile = get_wavefile_location_for_uri(proxy.get_id())
             self.debug("symlinking %s and %s", self.wavefile, proxy_wavefile)
@@ -281,22 +330,33 @@ class PreviewGeneratorManager():
             GES.TrackType.AUDIO: [],
             GES.TrackType.VIDEO: []
         }
+        # The queue of Previewers started only when the other queue is empty.
+        self._low_priority_previewers = {
+            GES.TrackType.AUDIO: [],
+            GES.TrackType.VIDEO: []
+        }
 
-    def add_previewer(self, previewer):
+    def add_previewer(self, previewer, low_priority=False):
         """Adds the specified previewer to the queue.
 
         Args:
             previewer (Previewer): The previewer to control.
+            low_priority (Optional[bool]): Whether the previewer should wait
+                for the other previewers of the same type.
         """
         track_type = previewer.track_type
 
         current = self._current_previewers.get(track_type)
-        if previewer in self._previewers[track_type] or previewer is current:
+        if previewer in self._previewers[track_type] or \
+                previewer in self._low_priority_previewers[track_type] or \
+                previewer is current:
             # Already in the queue or already processing.
             return
 
-        if not self._previewers[track_type] and current is None:
+        if current is None:
             self._start_previewer(previewer)
+        elif low_priority:
+            self._low_priority_previewers[track_type].insert(0, previewer)
         else:
             self._previewers[track_type].insert(0, previewer)
 
@@ -311,8 +371,10 @@ class PreviewGeneratorManager():
         if next_previewer:
             next_previewer.disconnect_by_func(self.__previewer_done_cb)
 
-        if self._previewers[track_type]:
-            self._start_previewer(self._previewers[track_type].pop())
+        queue = self._previewers[track_type] or \
+            self._low_priority_previewers[track_type]
+        if queue:
+            self._start_previewer(queue.pop())
 
 
 class Previewer(Gtk.Layout):
@@ -338,9 +400,9 @@ class Previewer(Gtk.Layout):
         """Stops preview generation."""
         raise NotImplementedError
 
-    def becomeControlled(self):
+    def becomeControlled(self, low_priority=False):
         """Lets the PreviewGeneratorManager control our execution."""
-        Previewer.__manager.add_previewer(self)
+        Previewer.__manager.add_previewer(self, low_priority)
 
     def setSelected(self, selected):
         """Marks this instance as being selected."""
@@ -747,6 +809,36 @@ def getThumbnailCache(obj):
         return cache
 
 
+def findThumbnailCache(asset):
+    """Gets the ThumbnailCache of the specified asset, if it has thumbnails.
+
+    Unlike `getThumbnailCache`, no cache is created, so this can be used
+    for looking up many files cheaply.
+
+    Args:
+        asset (GES.UriClipAsset): The asset for which to get the cache.
+
+    Returns:
+        ThumbnailCache: The cache, or None if it contains no thumbnails.
+    """
+    uri = get_proxy_target(asset).props.id
+    if uri in CACHES:
+        return CACHES[uri]
+
+    try:
+        filehash = hash_file(Gst.uri_get_location(uri))
+    except OSError:
+        return None
+    if not os.path.exists(os.path.join(xdg_cache_home(), "thumbs", filehash)):
+        return None
+
+    cache = ThumbnailCache(uri)
+    if cache.isEmpty():
+        return None
+    CACHES[uri] = cache
+    return cache
+
+
 class ThumbnailCache(Loggable):
     """Caches thumbnails by key using LRU policy.
 
@@ -778,6 +870,11 @@ class ThumbnailCache(Loggable):
 
         os.symlink(self._dbfile, dbfile)
 
+    def isEmpty(self):
+        """Checks whether the cache contains no thumbnails."""
+        self._cur.execute("SELECT Time FROM Thumbs LIMIT 1")
+        return self._cur.fetchone() is None
+
     def getImagesSize(self):
         """Gets the image size.
 
@@ -801,6 +898,23 @@ class ThumbnailCache(Loggable):
 
         return self[timestamps[int(len(timestamps) / 2)][0]]
 
+    def getFilmstrip(self, num_frames):
+        """Gets thumbnails spread evenly over the cached ones.
+
+        Args:
+            num_frames (int): The maximum number of thumbnails.
+
+        Returns:
+            List[GdkPixbuf.Pixbuf]: The thumbnails, sorted by time.
+        """
+        self._cur.execute("SELECT Time FROM Thumbs ORDER BY Time")
+        timestamps = [row[0] for row in self._cur.fetchall()]
+        if not timestamps:
+            return []
+        indexes = sorted(set(i * len(timestamps) // num_frames
+                             for i in range(num_frames)))
+        return [self[timestamps[index]] for index in indexes]
+
     # pylint: disable=no-self-use
     def __getPixbufFromRow(self, row):
         jpeg = row[1]
@@ -984,6 +1098,8 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
         # Guard against malformed URIs
         self.wavefile = None
         self._uri = quote_uri(get_proxy_target(ges_elem).props.id)
+        # Whether the file is decoded only to compute its fingerprint.
+        self._fingerprint_only = False
 
         self._num_failures = 0
         self.adapter = None
@@ -1009,6 +1125,13 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
             with open(filename, "rb") as samples:
                 self.samples = pickle.load(samples)
             self._startRendering()
+            if not fingerprint.getFingerprintIndex().contains(self._uri):
+                # The waveform is reused, but the file still has to be
+                # decoded to compute its fingerprint. Nothing waits for it,
+                # so it's decoded as fast as possible, once no waveform is
+                # being generated.
+                self._fingerprint_only = True
+                self._launchPipeline()
         else:
             self.wavefile = filename
             self._launchPipeline()
@@ -1020,10 +1143,11 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
                                          self._uri + " ! waveformbin name=wave"
                                          " ! fakesink qos=false name=faked")
         faked = self.pipeline.get_by_name("faked")
-        faked.props.sync = True
+        faked.props.sync = not self._fingerprint_only
         self._wavebin = self.pipeline.get_by_name("wave")
         asset = self.ges_elem.get_parent().get_asset()
-        self._wavebin.props.uri = asset.get_id()
+        # The decoded file, so the waveform and fingerprint are saved for it.
+        self._wavebin.props.uri = self._uri
         self._wavebin.props.duration = asset.get_duration()
         decode = self.pipeline.get_by_name("decode")
         decode.connect("autoplug-select", self._autoplugSelectCb)
@@ -1033,7 +1157,7 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
         asset = self.ges_elem.get_parent().get_asset()
         self.n_samples = asset.get_duration() / SAMPLE_DURATION
         bus.connect("message", self._busMessageCb)
-        self.becomeControlled()
+        self.becomeControlled(low_priority=self._fingerprint_only)
 
     # pylint: disable=arguments-differ
     def set_size(self, unused_width, unused_height):
@@ -1044,7 +1168,8 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
 
     def _prepareSamples(self):
         self._wavebin.finalize()
-        self.samples = self._wavebin.samples
+        if not self._wavebin.passthrough:
+            self.samples = self._wavebin.samples
 
     def _startRendering(self):
         self.n_samples = len(self.samples)
@@ -1072,7 +1197,7 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
                              self._num_failures)
                 bus.disconnect_by_func(self._busMessageCb)
                 self._launchPipeline()
-                self.becomeControlled()
+                self.becomeControlled(low_priority=self._fingerprint_only)
             else:
                 Gst.debug_bin_to_dot_file_with_ts(self.pipeline,
                                                   Gst.DebugGraphDetails.ALL,
@@ -1093,7 +1218,8 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
                                        -1)
 
                 # In case we failed previously, we won't modulate next time
-                elif not self.adapter and prev == Gst.State.PAUSED and \
+                elif not self.adapter and not self._fingerprint_only and \
+                        prev == Gst.State.PAUSED and \
                         new == Gst.State.PLAYING and self._num_failures == 0:
                     self.adapter = PipelineCpuAdapter(self.pipeline)
                     self.adapter.start()
@@ -16,43 +16,18 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this program; if not, write to the
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
-# Boston, MA 02110-1301, USA.from gi.repository import Gst
+# Boston, MA 02110-1301, USA.
 """
 Classes for extracting decoded contents of streams into Python
 
 Code derived from ui/previewer.py.
 """
-# FIXME reimplement after GES port
 from collections import deque
 
+import numpy
 from gi.repository import Gst
 
 from pitivi.utils.loggable import Loggable
-# from pitivi.elements.singledecodebin import SingleDecodeBin
-# from pitivi.elements.extractionsink import ExtractionSink
-
-
-def linkDynamic(element, target):
-
-    def pad_added(unused_bin, pad, target):
-        compatpad = target.get_compatible_pad(pad)
-        if compatpad:
-            pad.link_full(compatpad, Gst.PAD_LINK_CHECK_NOTHING)
-    element.connect("pad-added", pad_added, target)
-
-
-def pipeline(graph):
-    E = iter(graph.items())
-    V = iter(graph.keys())
-    p = Gst.Pipeline()
-    p.add(*V)
-    for u, v in E:
-        if v:
-            try:
-                u.link(v)
-            except Gst.LinkError:
-                linkDynamic(u, v)
-    return p
 
 
 class Extractee:
@@ -64,7 +39,7 @@ class Extractee:
         Receive a chunk of data from an Extractor.
 
         @param array: The chunk of data as an array
-        @type array: any kind of numeric array
+        @type array: numpy array of float32
 
         """
         raise NotImplementedError
@@ -79,6 +54,18 @@ class Extractee:
         """
         raise NotImplementedError
 
+    def abort(self, error):
+        """
+        Inform the Extractee that the extraction failed.
+
+        Neither receive() nor finalize() will be called again.
+
+        @param error: the error which stopped the extraction
+        @type error: L{GLib.Error}
+
+        """
+        raise NotImplementedError
+
 
 class Extractor(Loggable):
 
@@ -89,17 +76,15 @@ class Extractor(Loggable):
 
     """
 
-    def __init__(self, factory, stream_):
+    def __init__(self, uri):
         """
         Create a new Extractor.
 
-        @param factory: the factory with which to decode the stream
-        @type factory: L{ObjectFactory}
-        @param stream_: the stream to decode
-        @type stream_: L{Stream}
+        @param uri: the URI of the file to decode
+        @type uri: L{str}
         """
         Loggable.__init__(self)
-        self.debug("Initialized with %s %s", factory, stream_)
+        self.debug("Initialized with %s", uri)
 
     def extract(self, extractee, start, duration):
         """
@@ -116,6 +101,10 @@ class Extractor(Loggable):
         """
         raise NotImplementedError
 
+    def release(self):
+        """Release the resources used for the extraction."""
+        raise NotImplementedError
+
 
 class RandomAccessExtractor(Extractor):
 
@@ -126,18 +115,11 @@ class RandomAccessExtractor(Extractor):
 
     """
 
-    def __init__(self, factory, stream_):
-        Extractor.__init__(self, factory, stream_)
-        # FIXME:
-        # why doesn't this work?
-        # bin = factory.makeBin(stream_)
-        uri = factory.uri
-        caps = stream_.caps
-        bin = SingleDecodeBin(uri=uri, caps=caps, stream=stream_)
+    def __init__(self, uri):
+        Extractor.__init__(self, uri)
+        self._pipelineInit(uri)
 
-        self._pipelineInit(factory, bin)
-
-    def _pipelineInit(self, factory, bin):
+    def _pipelineInit(self, uri):
         """
         Create the pipeline for the preview process.
 
@@ -155,33 +137,42 @@ class RandomAccessAudioExtractor(RandomAccessExtractor):
     """
     L{Extractor} for random access audio streams.
 
-    Closely inspired by L{RandomAccessAudioPreviewer}.
+    The first audio stream of the file is decoded, mixed down to mono and
+    passed to the L{Extractee}s as float32 numpy arrays.
 
     """
 
-    def __init__(self, factory, stream_):
+    def __init__(self, uri, rate):
+        """
+        @param uri: the URI of the file to decode
+        @type uri: L{str}
+        @param rate: the sample rate of the extracted data
+        @type rate: L{int}
+        """
         self._queue = deque()
-        RandomAccessExtractor.__init__(self, factory, stream_)
+        self._rate = rate
         self._ready = False
+        self._extractee = None
+        RandomAccessExtractor.__init__(self, uri)
 
-    def _pipelineInit(self, factory, sbin):
-        self.audioSink = ExtractionSink()
-        self.audioSink.set_stopped_cb(self._finishSegment)
+    def _pipelineInit(self, uri):
         # This audiorate element ensures that the extracted raw-data
         # timeline matches the timestamps used for seeking, even if the
         # audio source has gaps or other timestamp abnormalities.
-        audiorate = Gst.ElementFactory.make("audiorate")
-        conv = Gst.ElementFactory.make("audioconvert")
-        q = Gst.ElementFactory.make("queue")
-        self.audioPipeline = pipeline({
-            sbin: audiorate,
-            audiorate: conv,
-            conv: q,
-            q: self.audioSink,
-            self.audioSink: None})
+        self.audioPipeline = Gst.parse_launch(
+            "uridecodebin name=decode caps=audio/x-raw expose-all-streams=false"
+            " ! audiorate ! audioconvert ! audioresample"
+            " ! audio/x-raw,format=F32LE,layout=interleaved,channels=1,rate=%d"
+            " ! appsink name=sink sync=false emit-signals=true" % self._rate)
+        self.audioPipeline.get_by_name("decode").props.uri = uri
+        self.audioPipeline.get_by_name("decode").connect(
+            "pad-added", self._decodePadAddedCb)
+        self.audioSink = self.audioPipeline.get_by_name("sink")
+        self.audioSink.connect("new-sample", self._newSampleCb)
         bus = self.audioPipeline.get_bus()
         bus.add_signal_watch()
         bus.connect("message::error", self._busMessageErrorCb)
+        bus.connect("message::eos", self._busMessageEosCb)
         self._donecb_id = bus.connect("message::async-done",
                                       self._busMessageAsyncDoneCb)
 
@@ -194,11 +185,47 @@ class RandomAccessAudioExtractor(RandomAccessExtractor):
         # message is received before setting self._ready = True,
         # which enables extraction to proceed.
 
+    def _decodePadAddedCb(self, unused_decodebin, pad):
+        if pad.is_linked():
+            return
+        # Only the first audio stream is extracted, the others are
+        # discarded so they do not stop the pipeline.
+        fakesink = Gst.ElementFactory.make("fakesink")
+        fakesink.props.sync = False
+        self.audioPipeline.add(fakesink)
+        fakesink.sync_state_with_parent()
+        pad.link(fakesink.get_static_pad("sink"))
+
+    def _newSampleCb(self, appsink):
+        # Called from the streaming thread.
+        sample = appsink.emit("pull-sample")
+        if not sample or not self._extractee:
+            return Gst.FlowReturn.OK
+        buf = sample.get_buffer()
+        success, mapinfo = buf.map(Gst.MapFlags.READ)
+        if not success:
+            self.warning("Could not map the buffer")
+            return Gst.FlowReturn.OK
+        try:
+            samples = numpy.frombuffer(mapinfo.data, dtype=numpy.float32).copy()
+        finally:
+            buf.unmap(mapinfo)
+        self._extractee.receive(samples)
+        return Gst.FlowReturn.OK
+
     def _busMessageErrorCb(self, unused_bus, message):
         error, debug = message.parse_error()
         self.error("Event bus error: %s; %s", error, debug)
+        # The pipeline cannot recover, so all the queued extractions fail.
+        extractees = [extractee for extractee, unused_start, unused_duration
+                      in self._queue]
+        self.release()
+        for extractee in extractees:
+            extractee.abort(error)
 
-        return Gst.BusSyncReply.PASS
+    def _busMessageEosCb(self, unused_bus, unused_message):
+        if self._extractee:
+            self._finishSegment()
 
     def _busMessageAsyncDoneCb(self, bus, unused_message):
         self.debug("Pipeline is ready for seeking")
@@ -222,9 +249,10 @@ class RandomAccessAudioExtractor(RandomAccessExtractor):
         return res
 
     def _finishSegment(self):
-        self.audioSink.extractee.finalize()
-        self.audioSink.reset()
+        extractee = self._extractee
+        self._extractee = None
         self._queue.popleft()
+        extractee.finalize()
         # If there's more to do, keep running
         if self._queue:
             self._run()
@@ -237,13 +265,25 @@ class RandomAccessAudioExtractor(RandomAccessExtractor):
         # if self._ready is False, self._run() will be called from
         # self._busMessageDoneCb().
 
+    def release(self):
+        self._queue.clear()
+        self._extractee = None
+        if self.audioPipeline is None:
+            # Already released.
+            return
+        self._ready = False
+        bus = self.audioPipeline.get_bus()
+        bus.remove_signal_watch()
+        self.audioPipeline.set_state(Gst.State.NULL)
+        self.audioPipeline = None
+
     def _run(self):
         # Control flows in a cycle:
-        # _run -> _startSegment -> busMessageSegmentDoneCb -> _finishSegment -> _run
+        # _run -> _startSegment -> _busMessageEosCb -> _finishSegment -> _run
         # This forms a loop that extracts an entire segment (i.e. satisfies an
         # extract request) in each cycle. The cycle
         # runs until the queue of Extractees empties.  If the cycle is not
         # running, extract() will kick it off again.
         extractee, start, duration = self._queue[0]
-        self.audioSink.set_extractee(extractee)
+        self._extractee = extractee
         self._startSegment(start, duration)
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Audio fingerprints for finding the recordings of the same event.
+
+The fingerprint of a file is made of landmarks: pairs of peaks of its
+spectrogram, hashed by their frequencies and by the time between them.
+Recordings of the same event share many landmarks, always at the same
+time difference, so the files overlapping a clip and their offsets are
+found by counting the matching landmarks in the index.
+"""
+import os
+import sqlite3
+
+import numpy
+from gi.repository import Gst
+
+from pitivi.settings import xdg_cache_home
+from pitivi.utils.loggable import Loggable
+from pitivi.utils.misc import hash_file
+
+# The duration of the spectrogram frames.
+FRAME_DURATION = 50 * Gst.MSECOND
+# The number of bands computed by the spectrum element.
+SPECTRUM_BANDS = 1024
+# The spectrogram is reduced to NUM_BINS logarithmic frequency bins.
+NUM_BINS = 256
+MIN_FREQUENCY = 300
+MAX_FREQUENCY = 6000
+# How much louder than the average of its frame a peak must be, in dB.
+PEAK_THRESHOLD = 10
+PEAKS_PER_FRAME = 2
+# The number of peaks following each peak which are paired with it.
+FANOUT = 3
+# The maximum number of frames between the two peaks of a landmark.
+MAX_DELTA = 63
+# The landmark hash is made of the two bins and of the number of frames
+# between the peaks.
+BIN_BITS = 8
+DELTA_BITS = 6
+# The version of the landmarks, the index is rebuilt when it changes.
+LANDMARKS_VERSION = 2
+# The minimum number of landmarks matching at the same offset for two
+# files to be considered overlapping.
+MIN_MATCHES = 10
+
+
+def frequencyBins(rate, bands=SPECTRUM_BANDS):
+    """Maps the bands of the spectrum element to logarithmic bins.
+
+    Args:
+        rate (int): The sample rate of the analyzed audio.
+        bands (int): The number of bands of the spectrum.
+
+    Returns:
+        numpy.array: The bin of each band, -1 for the bands out of range.
+    """
+    frequencies = (numpy.arange(bands) + 0.5) * rate / (2 * bands)
+    bins = numpy.floor(numpy.log(frequencies / MIN_FREQUENCY) /
+                       numpy.log(MAX_FREQUENCY / MIN_FREQUENCY) * NUM_BINS)
+    bins[(bins < 0) | (bins >= NUM_BINS)] = -1
+    return bins.astype(int)
+
+
+def reduceSpectrum(magnitudes, bins):
+    """Reduces the magnitudes of a spectrum to the logarithmic bins.
+
+    Args:
+        magnitudes (numpy.array): The magnitude of each band, in dB.
+        bins (numpy.array): The bin of each band, see `frequencyBins`.
+
+    Returns:
+        numpy.array: The maximum magnitude in each bin.
+    """
+    frame = numpy.full(NUM_BINS, -numpy.inf)
+    valid = bins >= 0
+    numpy.maximum.at(frame, bins[valid], numpy.asarray(magnitudes)[valid])
+    # The low bins are narrower than the bands, so some contain no band.
+    # They get the magnitude of the bin below, otherwise each band around
+    # them would look like a peak.
+    empty = numpy.isneginf(frame)
+    if empty.any() and not empty.all():
+        filled = numpy.where(empty, 0, numpy.arange(NUM_BINS))
+        numpy.maximum.accumulate(filled, out=filled)
+        # The first bins get the magnitude of the first band.
+        first = int(numpy.argmin(empty))
+        filled[:first] = first
+        frame = frame[filled]
+    return frame
+
+
+def findPeaks(spectrogram):
+    """Finds the peaks of a spectrogram.
+
+    A peak is louder than its neighbors in time and frequency, and louder
+    than the average of its frame by PEAK_THRESHOLD. At most
+    PEAKS_PER_FRAME peaks are kept in each frame.
+
+    Args:
+        spectrogram (numpy.array): The (frames, NUM_BINS) magnitudes in dB.
+
+    Returns:
+        List[(int, int)]: The (frame, bin) of the peaks, sorted by frame.
+    """
+    # The empty bins are -inf, which would make the averages meaningless.
+    spectrogram = numpy.maximum(numpy.asarray(spectrogram, dtype=float),
+                                -1000.)
+    if spectrogram.ndim != 2 or len(spectrogram) < 3:
+        return []
+    padded = numpy.pad(spectrogram, 1, mode="constant",
+                       constant_values=-numpy.inf)
+    center = padded[1:-1, 1:-1]
+    local_max = ((center > padded[:-2, 1:-1]) & (center >= padded[2:, 1:-1]) &
+                 (center > padded[1:-1, :-2]) & (center >= padded[1:-1, 2:]))
+    loud = spectrogram > (numpy.mean(spectrogram, axis=1, keepdims=True) +
+                          PEAK_THRESHOLD)
+    candidates = numpy.where(local_max & loud, spectrogram, -numpy.inf)
+    peaks = []
+    strongest = numpy.argsort(-candidates, axis=1)[:, :PEAKS_PER_FRAME]
+    for frame, bins in enumerate(strongest):
+        for bin_ in sorted(bins):
+            if candidates[frame, bin_] > -numpy.inf:
+                peaks.append((frame, int(bin_)))
+    return peaks
+
+
+def computeLandmarks(peaks):
+    """Pairs the peaks into hashed landmarks.
+
+    Args:
+        peaks (List[(int, int)]): The (frame, bin) peaks, sorted by frame.
+
+    Returns:
+        List[(int, int)]: The (hash, frame) of each landmark.
+    """
+    landmarks = []
+    for i, (frame, bin_) in enumerate(peaks):
+        paired = 0
+        for other_frame, other_bin in peaks[i + 1:]:
+            delta = other_frame - frame
+            if delta > MAX_DELTA:
+                break
+            if delta == 0:
+                continue
+            landmarks.append(((bin_ << (BIN_BITS + DELTA_BITS)) |
+                              (other_bin << DELTA_BITS) | delta, frame))
+            paired += 1
+            if paired == FANOUT:
+                break
+    return landmarks
+
+
+class FingerprintIndex(Loggable):
+    """Persistent index of the landmarks of the analyzed files.
+
+    The files are identified by a hash of their content, so the index
+    survives moving them.
+    """
+
+    def __init__(self, path):
+        Loggable.__init__(self)
+        self._db = sqlite3.connect(path)
+        self._cur = self._db.cursor()
+        self._cur.execute("PRAGMA user_version")
+        if self._cur.fetchone()[0] != LANDMARKS_VERSION:
+            # The landmarks computed differently cannot be matched.
+            self._cur.execute("DROP TABLE IF EXISTS Assets")
+            self._cur.execute("DROP TABLE IF EXISTS Landmarks")
+            self._cur.execute("PRAGMA user_version = %d" % LANDMARKS_VERSION)
+        self._cur.execute("CREATE TABLE IF NOT EXISTS Assets\
+                          (Key TEXT NOT NULL PRIMARY KEY,\
+                          Uri TEXT NOT NULL)")
+        self._cur.execute("CREATE TABLE IF NOT EXISTS Landmarks\
+                          (Hash INTEGER NOT NULL,\
+                          Key TEXT NOT NULL,\
+                          Frame INTEGER NOT NULL)")
+        self._cur.execute("CREATE INDEX IF NOT EXISTS LandmarksHash\
+                          ON Landmarks (Hash)")
+        self._cur.execute("CREATE INDEX IF NOT EXISTS LandmarksKey\
+                          ON Landmarks (Key, Frame)")
+        self._db.commit()
+
+    @staticmethod
+    def _key(uri):
+        return hash_file(Gst.uri_get_location(uri))
+
+    def contains(self, uri):
+        """Checks whether the landmarks of the file have been indexed."""
+        self._cur.execute("SELECT Key FROM Assets WHERE Key = ?",
+                          (self._key(uri),))
+        return self._cur.fetchone() is not None
+
+    def addLandmarks(self, uri, landmarks):
+        """Indexes the landmarks of a file, replacing the previous ones.
+
+        Args:
+            uri (str): The URI of the file.
+            landmarks (List[(int, int)]): The (hash, frame) landmarks.
+        """
+        key = self._key(uri)
+        self._cur.execute("DELETE FROM Landmarks WHERE Key = ?", (key,))
+        self._cur.execute("INSERT OR REPLACE INTO Assets VALUES (?, ?)",
+                          (key, uri))
+        self._cur.executemany("INSERT INTO Landmarks VALUES (?, ?, ?)",
+                              [(hash_, key, frame)
+                               for hash_, frame in landmarks])
+        self._db.commit()
+        self.debug("Indexed %d landmarks for %s", len(landmarks), uri)
+
+    def findOverlaps(self, uri, start=0, duration=None,
+                     min_matches=MIN_MATCHES):
+        """Finds the indexed files overlapping a part of a file.
+
+        Args:
+            uri (str): The URI of the indexed file.
+            start (int): The position in the file where the part starts,
+                in nanoseconds.
+            duration (int): The duration of the part, in nanoseconds, or
+                None for the rest of the file.
+            min_matches (int): The minimum number of matching landmarks.
+
+        Returns:
+            List[(str, int, int)]: The URI of each overlapping file, the
+                position in it of the start of the file specified by `uri`
+                in nanoseconds, and the number of matching landmarks, the
+                best matches first.
+        """
+        key = self._key(uri)
+        first = start // FRAME_DURATION
+        last = first + duration // FRAME_DURATION if duration else 2 ** 62
+        # Count the matching landmarks by file and time difference.
+        self._cur.execute(
+            "SELECT Other.Key, Other.Frame - Query.Frame AS Delta, COUNT(*)"
+            " FROM Landmarks AS Query JOIN Landmarks AS Other"
+            " ON Other.Hash = Query.Hash"
+            " WHERE Query.Key = ? AND Query.Frame BETWEEN ? AND ?"
+            " AND Other.Key != Query.Key"
+            " GROUP BY Other.Key, Delta", (key, first, last))
+        votes = {}
+        for other_key, delta, count in self._cur.fetchall():
+            votes.setdefault(other_key, {})[delta] = count
+
+        overlaps = []
+        for other_key, deltas in votes.items():
+            # Tolerate one frame of jitter around the best offset.
+            score, delta = max(
+                (sum(deltas.get(delta + i, 0) for i in (-1, 0, 1)), delta)
+                for delta in deltas)
+            if score < min_matches:
+                continue
+            self._cur.execute("SELECT Uri FROM Assets WHERE Key = ?",
+                              (other_key,))
+            other_uri = self._cur.fetchone()[0]
+            overlaps.append((other_uri, delta * FRAME_DURATION, score))
+        overlaps.sort(key=lambda overlap: -overlap[2])
+        return overlaps
+
+
+__index = None
+
+
+def getFingerprintIndex():
+    """Gets the fingerprint index shared by all the projects."""
+    global __index
+    if __index is None:
+        __index = FingerprintIndex(
+            os.path.join(xdg_cache_home(), "fingerprints.db"))
+    return __index
@@ -179,30 +179,56 @@ def quote_uri(uri):
 
 
 class PathWalker(Thread):
-    """Thread for recursively searching in a list of directories."""
+    """Thread for recursively searching in a list of directories.
 
-    def __init__(self, paths, callback):
+    The URIs of the files found are passed to the callback in the main
+    thread, in batches of at most BATCH_SIZE, as the directories are walked.
+
+    Attributes:
+        accept (Optional[function]): Checks whether the file with the path
+            passed as argument should be passed to the callback.
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(self, paths, callback, accept=None):
         Thread.__init__(self)
         self.log("New PathWalker for %s", paths)
         self.paths = paths
         self.callback = callback
+        self.accept = accept
         self.stopme = threading.Event()
 
     def process(self):
+        start = time.time()
+        num_files = 0
+        num_accepted = 0
         for folder in self.paths:
             self.log("folder %s" % folder)
             if folder.startswith("file://"):
                 folder = unquote(folder[len("file://"):])
             for path, dirs, files in os.walk(folder):
-                if self.stopme.isSet():
-                    return
                 uris = []
                 for afile in files:
-                    uris.append(quote_uri("file://%s" %
-                                          os.path.join(path, afile)))
+                    if self.stopme.isSet():
+                        return
+                    num_files += 1
+                    filepath = os.path.join(path, afile)
+                    if self.accept and not self.accept(filepath):
+                        continue
+                    num_accepted += 1
+                    uris.append(quote_uri("file://%s" % filepath))
+                    if len(uris) == self.BATCH_SIZE:
+                        GLib.idle_add(self.callback, uris)
+                        uris = []
                 if uris:
                     GLib.idle_add(self.callback, uris)
 
+        elapsed = time.time() - start
+        self.info("Found %d files out of %d in %.2f seconds (%.1f files/s)",
+                  num_accepted, num_files, elapsed,
+                  num_files / elapsed if elapsed else 0)
+
     def abort(self):
         self.stopme.set()
 
@@ -17,7 +17,12 @@
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
 import os
+import re
+import shutil
+import sqlite3
+import tempfile
 import time
+from gettext import gettext as _
 
 from gi.repository import GES
 from gi.repository import Gio
@@ -26,10 +31,16 @@ from gi.repository import GObject
 from gi.repository import Gst
 from gi.repository import GstPbutils
 from gi.repository import GstTranscoder
+from gi.repository import Gtk
 
 from pitivi.configure import get_gstpresets_dir
+from pitivi.dialogs.prefs import PreferencesDialog
+from pitivi.settings import get_dir
 from pitivi.settings import GlobalSettings
+from pitivi.settings import xdg_cache_home
 from pitivi.utils.loggable import Loggable
+from pitivi.utils.misc import hash_file
+from pitivi.utils.misc import path_from_uri
 
 # Make sure gst knowns about our own GstPresets
 Gst.preset_set_app_dir(get_gstpresets_dir())
@@ -41,6 +52,13 @@ class ProxyingStrategy:
     NOTHING = "nothing"
 
 
+class ProxyingScale:
+    FULL = "full"
+    HALF = "half"
+    QUARTER = "quarter"
+    PROJECT = "project"
+
+
 GlobalSettings.addConfigSection("proxy")
 GlobalSettings.addConfigOption('proxyingStrategy',
                                section='proxy',
@@ -50,11 +68,80 @@ GlobalSettings.addConfigOption('numTranscodingJobs',
                                section='proxy',
                                key='num-proxying-jobs',
                                default=4)
+GlobalSettings.addConfigOption('proxyStoreDirectory',
+                               section='proxy',
+                               key='store-directory',
+                               default="")
+GlobalSettings.addConfigOption('proxyStoreQuota',
+                               section='proxy',
+                               key='store-quota',
+                               default=0)
+
+GlobalSettings.addConfigOption('proxyingScale',
+                               section='proxy',
+                               key='proxying-scale',
+                               default=ProxyingScale.FULL)
+
+PreferencesDialog.addChoicePreference('proxyingScale',
+                                      section="proxy",
+                                      label=_("Proxy resolution"),
+                                      description=_(
+                                          "The resolution of the proxy files. "
+                                          "Smaller proxy files are faster to "
+                                          "decode, the original files are used "
+                                          "when rendering."),
+                                      choices=[
+                                          (_("Same as the original file"),
+                                           ProxyingScale.FULL),
+                                          (_("Half"), ProxyingScale.HALF),
+                                          (_("Quarter"), ProxyingScale.QUARTER),
+                                          (_("Up to the project size"),
+                                           ProxyingScale.PROJECT)])
+
+PreferencesDialog.addPathPreference('proxyStoreDirectory',
+                                    section="proxy",
+                                    label=_("Proxy files folder"),
+                                    description=_(
+                                        "Folder where all the proxy files are stored. "
+                                        "When not set, the proxy files are created "
+                                        "next to the original files."),
+                                    action=Gtk.FileChooserAction.SELECT_FOLDER)
+
+PreferencesDialog.addNumericPreference('proxyStoreQuota',
+                                       section="proxy",
+                                       label=_("Proxy files folder size"),
+                                       description=_(
+                                           "Maximum size (in megabytes) of the proxy files "
+                                           "folder. When exceeded, the least recently used "
+                                           "proxy files are deleted. 0 means no limit."),
+                                       lower=0)
 
 
 ENCODING_FORMAT_PRORES = "prores-opus-in-matroska.gep"
 ENCODING_FORMAT_JPEG = "jpeg-opus-in-matroska.gep"
 
+# The intra-only proxy formats, in order of preference when no benchmark
+# has been run.
+PROXY_FORMATS = [(_("JPEG"), ENCODING_FORMAT_JPEG),
+                 (_("ProRes"), ENCODING_FORMAT_PRORES)]
+
+GlobalSettings.addConfigOption('proxyingFormat',
+                               section='proxy',
+                               key='proxying-format',
+                               default="",
+                               notify=True)
+
+PreferencesDialog.addChoicePreference('proxyingFormat',
+                                      section="proxy",
+                                      label=_("Proxy format"),
+                                      description=_(
+                                          "The format of the proxy files. When "
+                                          "automatic, the formats are measured "
+                                          "at the next start and the one with "
+                                          "the best encoding and seeking speed "
+                                          "on this computer is chosen."),
+                                      choices=[(_("Automatic"), "")] + PROXY_FORMATS)
+
 
 def createEncodingProfileSimple(container_caps, audio_caps, video_caps):
     c = GstPbutils.EncodingContainerProfile.new(None, None,
@@ -71,11 +158,424 @@ def createEncodingProfileSimple(container_caps, audio_caps, video_caps):
     return c
 
 
+class ProxyStore(Loggable):
+    """Central storage for proxy files, shared by all the projects.
+
+    The proxy files are named after a fingerprint of the content of the
+    original files, so copies of a file found at different locations share
+    the same proxy. When the store gets bigger than the quota, the least
+    recently used proxy files are removed.
+
+    Attributes:
+        directory (str): The path of the folder containing the proxy files.
+        quota (int): The maximum size of the proxy files, in bytes,
+            0 meaning no limit.
+    """
+
+    # The fingerprint at the start of the name of the proxy files.
+    __fingerprint_re = re.compile(r"^([0-9a-f]+\.\d+)\.")
+
+    def __init__(self, directory, quota=0):
+        Loggable.__init__(self)
+        self.directory = get_dir(directory)
+        self.quota = quota
+        # The fingerprints computed so far, by (uri, size, mtime).
+        self._fingerprints = {}
+        # The proxy files which should not be evicted, as they are used.
+        self._in_use = set()
+        self._db = sqlite3.connect(os.path.join(self.directory, "proxies.db"))
+        self._cur = self._db.cursor()
+        # The same content can be found at several locations, so a proxy
+        # can have several targets.
+        self._cur.execute("CREATE TABLE IF NOT EXISTS Targets\
+                          (Fingerprint TEXT NOT NULL,\
+                          Target TEXT NOT NULL,\
+                          LastUsed REAL NOT NULL,\
+                          PRIMARY KEY (Fingerprint, Target))")
+
+    def fingerprint(self, uri):
+        """Computes a fingerprint of the content of the specified file."""
+        path = Gst.uri_get_location(uri)
+        stat = os.stat(path)
+        key = (uri, stat.st_size, stat.st_mtime)
+        fingerprint = self._fingerprints.get(key)
+        if fingerprint is None:
+            fingerprint = "%s.%d" % (hash_file(path), stat.st_size)
+            self._fingerprints[key] = fingerprint
+        return fingerprint
+
+    def contains(self, proxy_uri):
+        """Checks whether the specified proxy URI points inside the store."""
+        path = Gst.uri_get_location(proxy_uri)
+        return os.path.dirname(path) == os.path.normpath(self.directory)
+
+    def getProxyUri(self, uri, extension):
+        """Gets the URI of the proxy file for the specified file."""
+        filename = "%s.%s" % (self.fingerprint(uri), extension)
+        return Gst.filename_to_uri(os.path.join(self.directory, filename))
+
+    def getTargetUris(self, proxy_uri):
+        """Gets the URIs of the files the proxy has been used for.
+
+        Returns:
+            List[str]: The URIs, the most recently used first.
+        """
+        filename = os.path.basename(Gst.uri_get_location(proxy_uri))
+        fingerprint = ".".join(filename.split(".")[:2])
+        self._cur.execute("SELECT Target FROM Targets WHERE Fingerprint = ?"
+                          " ORDER BY LastUsed DESC, rowid DESC",
+                          (fingerprint,))
+        return [row[0] for row in self._cur.fetchall()]
+
+    def use(self, uri, proxy_uri):
+        """Records that the specified proxy is used for the specified file."""
+        self._in_use.add(Gst.uri_get_location(proxy_uri))
+        self._cur.execute("INSERT OR REPLACE INTO Targets VALUES (?,?,?)",
+                          (self.fingerprint(uri), uri, time.time()))
+        self._db.commit()
+
+    def release(self, proxy_uri=None):
+        """Allows evicting the specified proxy, or all if none specified."""
+        if proxy_uri is None:
+            self._in_use.clear()
+        else:
+            self._in_use.discard(Gst.uri_get_location(proxy_uri))
+
+    def evict(self):
+        """Removes the least recently used proxies to satisfy the quota."""
+        if not self.quota:
+            return
+
+        self._cur.execute("SELECT Fingerprint, MAX(LastUsed) FROM Targets"
+                          " GROUP BY Fingerprint")
+        last_used = dict(self._cur.fetchall())
+        proxies = []
+        # The number of proxy files by fingerprint, as the scaled proxies
+        # of a file share the fingerprint of the full-size one.
+        counts = {}
+        total_size = 0
+        for filename in os.listdir(self.directory):
+            match = self.__fingerprint_re.match(filename)
+            if not match or filename.endswith(".part"):
+                continue
+            path = os.path.join(self.directory, filename)
+            size = os.path.getsize(path)
+            total_size += size
+            fingerprint = match.group(1)
+            counts[fingerprint] = counts.get(fingerprint, 0) + 1
+            proxies.append((last_used.get(fingerprint, 0), path, fingerprint, size))
+
+        for unused_last_used, path, fingerprint, size in sorted(proxies):
+            if total_size <= self.quota:
+                break
+            if path in self._in_use:
+                continue
+            self.info("Evicting proxy %s from the store", path)
+            try:
+                os.remove(path)
+            except OSError as e:
+                self.warning("Could not remove %s: %s", path, e)
+                continue
+            total_size -= size
+            counts[fingerprint] -= 1
+            if not counts[fingerprint]:
+                self._cur.execute("DELETE FROM Targets WHERE Fingerprint = ?",
+                                  (fingerprint,))
+        self._db.commit()
+
+
+class TranscodingJob(object):
+    """Throughput measurements of a transcoding job.
+
+    The throughput is the number of media seconds transcoded per wall-clock
+    second.
+
+    Attributes:
+        key (str): The kind of media being transcoded, see
+            `ProxyManager.getTranscodingKey`.
+        duration (float): The duration of the media, in seconds.
+        position (float): The duration transcoded so far, in seconds.
+        expected_throughput (float): The throughput recorded in the past for
+            the same kind of media, or 0 if unknown.
+        throughput (float): The smoothed throughput of the job, or 0 if not
+            yet known.
+    """
+
+    # The weight of the last measurement in the smoothed throughput.
+    SMOOTHING = 0.3
+
+    def __init__(self, key, duration, expected_throughput=0):
+        self.key = key
+        self.duration = duration
+        self.position = 0
+        self.expected_throughput = expected_throughput
+        self.throughput = 0
+        self.__start_time = None
+        self.__last_time = None
+
+    @property
+    def started(self):
+        return self.__start_time is not None
+
+    def start(self, now):
+        self.__start_time = now
+        self.__last_time = now
+
+    def update(self, position, now):
+        """Records the position reached at the specified time."""
+        elapsed = now - self.__last_time
+        if elapsed <= 0:
+            return
+
+        rate = max(0, position - self.position) / elapsed
+        if self.throughput:
+            self.throughput = self.SMOOTHING * rate + \
+                (1 - self.SMOOTHING) * self.throughput
+        else:
+            self.throughput = rate
+        self.position = position
+        self.__last_time = now
+
+    def averageThroughput(self):
+        """Gets the throughput since the job started."""
+        if not self.started or self.__last_time <= self.__start_time:
+            return 0
+        return self.position / (self.__last_time - self.__start_time)
+
+    def estimateTimeLeft(self, default_throughput=0):
+        """Estimates the wall-clock seconds needed to finish the job.
+
+        Returns:
+            float: The time left, or None if no throughput is known.
+        """
+        throughput = self.throughput or self.expected_throughput or \
+            default_throughput
+        if not throughput:
+            return None
+        return max(0, self.duration - self.position) / throughput
+
+
+class TranscodingHistory(Loggable):
+    """Persistent record of the transcoding throughputs by kind of media."""
+
+    # How many past jobs are averaged, so that the record follows
+    # changes of hardware or software.
+    MAX_SAMPLES = 20
+
+    def __init__(self, path):
+        Loggable.__init__(self)
+        self._db = sqlite3.connect(path)
+        self._cur = self._db.cursor()
+        self._cur.execute("CREATE TABLE IF NOT EXISTS History\
+                          (Key TEXT NOT NULL PRIMARY KEY,\
+                          Throughput REAL NOT NULL,\
+                          Samples INTEGER NOT NULL)")
+
+    def getThroughput(self, key):
+        """Gets the average throughput recorded for the kind of media.
+
+        Returns:
+            float: The throughput, or 0 if nothing has been recorded.
+        """
+        self._cur.execute("SELECT Throughput FROM History WHERE Key = ?",
+                          (key,))
+        row = self._cur.fetchone()
+        if not row:
+            return 0
+        return row[0]
+
+    def getAverageThroughput(self):
+        """Gets the average throughput over all the kinds of media."""
+        self._cur.execute("SELECT AVG(Throughput) FROM History")
+        return self._cur.fetchone()[0] or 0
+
+    def record(self, key, throughput):
+        """Adds the throughput of a finished job to the record."""
+        if throughput <= 0:
+            return
+
+        self._cur.execute("SELECT Throughput, Samples FROM History WHERE Key = ?",
+                          (key,))
+        row = self._cur.fetchone()
+        if row:
+            average, samples = row
+            samples = min(samples + 1, self.MAX_SAMPLES)
+            throughput = average + (throughput - average) / samples
+        else:
+            samples = 1
+        self.debug("Throughput for %s: %f", key, throughput)
+        self._cur.execute("INSERT OR REPLACE INTO History VALUES (?,?,?)",
+                          (key, throughput, samples))
+        self._db.commit()
+
+
+class ProxyFormatsBenchmark(GObject.Object, Loggable):
+    """Measures how fast the proxy formats are on this computer.
+
+    For each format, a short synthetic clip is encoded, then decoded with
+    accurate seeks at several positions. The cost of a format is the time
+    needed to encode one second of video plus the average seek latency.
+
+    Attributes:
+        results (dict): The cost of each benchmarked format, in seconds.
+    """
+
+    __gsignals__ = {
+        "done": (GObject.SIGNAL_RUN_LAST, None, (str,)),
+    }
+
+    WIDTH = 1280
+    HEIGHT = 720
+    NUM_BUFFERS = 50
+    FRAMERATE = 25
+    NUM_SEEKS = 5
+
+    def __init__(self, profiles):
+        """Creates a benchmark.
+
+        Args:
+            profiles (List[(str, GstPbutils.EncodingProfile)]): The encoding
+                target files and their profiles.
+        """
+        GObject.Object.__init__(self)
+        Loggable.__init__(self)
+        self.results = {}
+        self.__profiles = list(profiles)
+        self.__current = None
+        self.__pipeline = None
+        self.__started = 0
+        self.__seeks = []
+        self.__seek_times = []
+        self.__encode_time = 0
+        self.__directory = None
+
+    def start(self):
+        """Starts benchmarking, the "done" signal is emitted at the end."""
+        self.__directory = tempfile.mkdtemp("pitiviProxyBenchmark")
+        self.__next()
+
+    def __next(self):
+        self.__stopPipeline()
+        if not self.__profiles:
+            shutil.rmtree(self.__directory, ignore_errors=True)
+            best = ""
+            if self.results:
+                best = min(self.results, key=self.results.get)
+            self.info("Proxy formats costs: %s, best: %s", self.results, best)
+            self.emit("done", best)
+            return False
+
+        self.__current, profile = self.__profiles.pop(0)
+        self.__encode(profile)
+        return False
+
+    def __location(self):
+        return os.path.join(self.__directory, self.__current + ".mkv")
+
+    def __encode(self, profile):
+        self.__pipeline = Gst.Pipeline()
+        src = Gst.ElementFactory.make("videotestsrc")
+        src.props.num_buffers = self.NUM_BUFFERS
+        src.props.pattern = "smpte"
+        capsfilter = Gst.ElementFactory.make("capsfilter")
+        capsfilter.props.caps = Gst.Caps(
+            "video/x-raw,width=%d,height=%d,framerate=%d/1" %
+            (self.WIDTH, self.HEIGHT, self.FRAMERATE))
+        encodebin = Gst.ElementFactory.make("encodebin")
+        encodebin.props.profile = profile
+        sink = Gst.ElementFactory.make("filesink")
+        sink.props.location = self.__location()
+        for element in (src, capsfilter, encodebin, sink):
+            self.__pipeline.add(element)
+        src.link(capsfilter)
+        capsfilter.get_static_pad("src").link(
+            encodebin.get_request_pad("video_%u"))
+        encodebin.link(sink)
+
+        bus = self.__pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self.__encodeBusMessageCb, self.__pipeline)
+        self.__started = time.time()
+        self.__pipeline.set_state(Gst.State.PLAYING)
+
+    def __encodeBusMessageCb(self, unused_bus, message, pipeline):
+        if pipeline is not self.__pipeline:
+            # A message posted before the pipeline has been stopped.
+            return
+
+        if message.type == Gst.MessageType.EOS:
+            self.__encode_time = time.time() - self.__started
+            self.__stopPipeline()
+            self.__decode()
+        elif message.type == Gst.MessageType.ERROR:
+            self.warning("Could not encode with %s: %s", self.__current,
+                         message.parse_error())
+            self.__finishCurrent()
+
+    def __finishCurrent(self):
+        """Moves on to the next candidate, ignoring the pending messages."""
+        self.__stopPipeline()
+        GLib.idle_add(self.__next)
+
+    def __decode(self):
+        self.__pipeline = Gst.parse_launch(
+            "uridecodebin name=decode ! fakesink sync=false")
+        self.__pipeline.get_by_name("decode").props.uri = \
+            Gst.filename_to_uri(self.__location())
+        duration = self.NUM_BUFFERS * Gst.SECOND // self.FRAMERATE
+        self.__seeks = [duration * i // self.NUM_SEEKS
+                        for i in range(self.NUM_SEEKS, 0, -1)]
+        self.__seek_times = []
+        self.__started = 0
+
+        bus = self.__pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self.__decodeBusMessageCb, self.__pipeline)
+        self.__pipeline.set_state(Gst.State.PAUSED)
+
+    def __decodeBusMessageCb(self, unused_bus, message, pipeline):
+        if pipeline is not self.__pipeline:
+            # A message posted before the pipeline has been stopped.
+            return
+
+        if message.type == Gst.MessageType.ASYNC_DONE:
+            if self.__started:
+                self.__seek_times.append(time.time() - self.__started)
+
+            if not self.__seeks:
+                media_duration = self.NUM_BUFFERS / self.FRAMERATE
+                seek_latency = sum(self.__seek_times) / len(self.__seek_times)
+                self.results[self.__current] = \
+                    self.__encode_time / media_duration + seek_latency
+                self.__finishCurrent()
+                return
+
+            self.__started = time.time()
+            self.__pipeline.seek_simple(
+                Gst.Format.TIME,
+                Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE,
+                self.__seeks.pop())
+        elif message.type == Gst.MessageType.ERROR:
+            self.warning("Could not decode %s: %s", self.__current,
+                         message.parse_error())
+            self.__finishCurrent()
+
+    def __stopPipeline(self):
+        if not self.__pipeline:
+            return
+
+        bus = self.__pipeline.get_bus()
+        bus.remove_signal_watch()
+        self.__pipeline.set_state(Gst.State.NULL)
+        self.__pipeline = None
+
+
 class ProxyManager(GObject.Object, Loggable):
     """Transcodes assets and manages proxies."""
 
     __gsignals__ = {
         "progress": (GObject.SIGNAL_RUN_LAST, None, (object, int, int)),
+        "throughput": (GObject.SIGNAL_RUN_LAST, None, (object, float, float)),
         "proxy-ready": (GObject.SIGNAL_RUN_LAST, None, (object, object)),
         "asset-preparing-cancelled": (GObject.SIGNAL_RUN_LAST, None, (object,)),
         "error-preparing-asset": (GObject.SIGNAL_RUN_LAST, None, (object,
@@ -83,69 +583,200 @@ class ProxyManager(GObject.Object, Loggable):
                                                                   object)),
     }
 
+    WHITELIST_CONTAINERS = ["video/quicktime", "application/ogg",
+                            "video/x-matroska", "video/webm"]
+    WHITELIST_AUDIO = ["audio/mpeg", "audio/x-vorbis",
+                       "audio/x-raw", "audio/x-flac"]
+    WHITELIST_VIDEO = ["video/x-h264", "image/jpeg",
+                       "video/x-raw", "video/x-vp8",
+                       "video/x-theora"]
+
     WHITELIST_FORMATS = []
-    for container in ["video/quicktime", "application/ogg",
-                      "video/x-matroska", "video/webm"]:
-        for audio in ["audio/mpeg", "audio/x-vorbis",
-                      "audio/x-raw", "audio/x-flac"]:
-            for video in ["video/x-h264", "image/jpeg",
-                          "video/x-raw", "video/x-vp8",
-                          "video/x-theora"]:
+    for container in WHITELIST_CONTAINERS:
+        for audio in WHITELIST_AUDIO:
+            for video in WHITELIST_VIDEO:
                 WHITELIST_FORMATS.append(createEncodingProfileSimple(
                     container, audio, video))
 
     proxy_extension = "proxy.mkv"
+    # The part of the name of the scaled proxies specifying the size.
+    __size_re = re.compile(r"^(\d+)x(\d+)$")
 
     def __init__(self, app):
         GObject.Object.__init__(self)
         Loggable.__init__(self)
 
         self.app = app
-        self._total_time_to_transcode = 0
-        self._total_transcoded_time = 0
-        self._start_proxying_time = 0
         self._estimated_time = 0
+        # The TranscodingJob of each asset being transcoded, by URI.
+        self.__jobs = {}
+        # The size of the proxy of each queued asset, by URI, snapshotted
+        # when the job is queued so later settings changes don't affect it.
+        self.__proxy_sizes = {}
+        self.__history = TranscodingHistory(
+            os.path.join(xdg_cache_home(), "transcoding.db"))
         self.__running_transcoders = []
         self.__pending_transcoders = []
-
+        self.__proxy_store = None
+        self.app.project_manager.connect("project-closed",
+                                         self.__projectClosedCb)
+
+        # Capabilities cache, reset when the registry features change.
+        self.__registry_cookie = None
+        self.__encoders = []
+        self.__decoders = []
+        self.__supported_targets = {}
+        # Whether some stream caps intersect some format caps.
+        self.__caps_matches = {}
+        self.__whitelist_caps = [
+            [Gst.Caps(caps) for caps in whitelist]
+            for whitelist in (self.WHITELIST_CONTAINERS,
+                              self.WHITELIST_AUDIO,
+                              self.WHITELIST_VIDEO)]
+
+        self.__benchmark = None
         self.__encoding_target_file = None
+        self.__encoding_profile = None
         self.proxyingUnsupported = False
-        for encoding_format in [ENCODING_FORMAT_JPEG, ENCODING_FORMAT_PRORES]:
-            self.__encoding_profile = self.__getEncodingProfile(encoding_format)
-            if self.__encoding_profile:
+        self.__selectEncodingFormat()
+        if self.proxyingUnsupported:
+            self.error("Not supporting any proxy formats!")
+            return
+
+        self.app.settings.connect("proxyingFormatChanged",
+                                  self.__proxyingFormatChangedCb)
+
+    def __selectEncodingFormat(self):
+        """Sets the proxying format, preferring the one set by the user."""
+        encoding_formats = [encoding_format
+                            for unused_label, encoding_format in PROXY_FORMATS]
+        preferred = self.app.settings.proxyingFormat
+        if preferred in encoding_formats:
+            encoding_formats.remove(preferred)
+            encoding_formats.insert(0, preferred)
+
+        for encoding_format in encoding_formats:
+            encoding_profile = self.__getEncodingProfile(encoding_format)
+            if encoding_profile:
+                self.__encoding_profile = encoding_profile
                 self.__encoding_target_file = encoding_format
+                self.proxyingUnsupported = False
                 self.info("Using %s as proxying format", encoding_format)
-                break
+                return
 
-        if not self.__encoding_profile:
-            self.proxyingUnsupported = True
+        self.proxyingUnsupported = True
 
-            self.error("Not supporting any proxy formats!")
-            return
+    def __proxyingFormatChangedCb(self, unused_settings):
+        self.__selectEncodingFormat()
+        if not self.app.settings.proxyingFormat:
+            # Back to Automatic, the best format is picked again.
+            self.benchmarkFormats()
 
-    def _assetMatchesEncodingFormat(self, asset, encoding_profile):
-        def capsMatch(info, profile):
-            return not info.get_caps().intersect(profile.get_format()).is_empty()
+    def benchmarkFormats(self):
+        """Picks the best proxying format, unless one is already set.
 
+        The supported formats are benchmarked in the background and the
+        result is saved in the `proxyingFormat` setting.
+
+        Returns:
+            bool: Whether a benchmark has been started.
+        """
+        if self.app.settings.proxyingFormat or self.__benchmark:
+            return False
+
+        profiles = []
+        for unused_label, encoding_format in PROXY_FORMATS:
+            encoding_profile = self.__getEncodingProfile(encoding_format)
+            if encoding_profile:
+                profiles.append((encoding_format, encoding_profile))
+        if len(profiles) < 2:
+            return False
+
+        self.__benchmark = ProxyFormatsBenchmark(profiles)
+        self.__benchmark.connect("done", self.__benchmarkDoneCb)
+        GLib.idle_add(self.__benchmark.start, priority=GLib.PRIORITY_LOW)
+        return True
+
+    def __benchmarkDoneCb(self, benchmark, best_format):
+        benchmark.disconnect_by_func(self.__benchmarkDoneCb)
+        self.__benchmark = None
+        # Keep the format chosen by the user in the meantime.
+        if best_format and not self.app.settings.proxyingFormat:
+            self.app.settings.proxyingFormat = best_format
+
+    def __capsMatch(self, caps, format_caps):
+        key = (caps.to_string(), format_caps.to_string())
+        matches = self.__caps_matches.get(key)
+        if matches is None:
+            matches = not caps.intersect(format_caps).is_empty()
+            self.__caps_matches[key] = matches
+        return matches
+
+    def __streamsMatchSomeCaps(self, streams, formats_caps):
+        """Checks whether all the streams match one of the specified caps."""
+        if not streams:
+            return True
+
+        for format_caps in formats_caps:
+            if all(self.__capsMatch(stream.get_caps(), format_caps)
+                   for stream in streams):
+                return True
+        return False
+
+    def _assetMatchesEncodingFormat(self, asset, encoding_profile):
         info = asset.get_info()
         container = info.get_stream_info()
         if container:
-            if not capsMatch(container, encoding_profile):
+            if not self.__capsMatch(container.get_caps(),
+                                    encoding_profile.get_format()):
                 return False
 
         for profile in encoding_profile.get_profiles():
             if isinstance(profile, GstPbutils.EncodingAudioProfile):
-                audios = info.get_audio_streams()
-                for audio_stream in audios:
-                    if not capsMatch(audio_stream, profile):
-                        return False
+                streams = info.get_audio_streams()
             elif isinstance(profile, GstPbutils.EncodingVideoProfile):
-                videos = info.get_video_streams()
-                for video_stream in videos:
-                    if not capsMatch(video_stream, profile):
-                        return False
+                streams = info.get_video_streams()
+            else:
+                continue
+            if not self.__streamsMatchSomeCaps(streams, [profile.get_format()]):
+                return False
         return True
 
+    def __updateFactoriesCache(self):
+        """Resets the capabilities cache if the registry changed."""
+        cookie = Gst.Registry.get().get_feature_list_cookie()
+        if cookie == self.__registry_cookie:
+            return
+
+        self.debug("Registry changed, probing encoders and decoders")
+        self.__registry_cookie = cookie
+        self.__encoders = Gst.ElementFactory.list_get_elements(
+            Gst.ELEMENT_FACTORY_TYPE_ENCODER, Gst.Rank.MARGINAL)
+        self.__decoders = Gst.ElementFactory.list_get_elements(
+            Gst.ELEMENT_FACTORY_TYPE_DECODER, Gst.Rank.MARGINAL)
+        self.__supported_targets = {}
+
+    def __isEncodingProfileSupported(self, encoding_target_file,
+                                     encoding_profile):
+        self.__updateFactoriesCache()
+        supported = self.__supported_targets.get(encoding_target_file)
+        if supported is not None:
+            return supported
+
+        supported = True
+        for profile in encoding_profile.get_profiles():
+            if not Gst.ElementFactory.list_filter(
+                    self.__encoders, profile.get_format(),
+                    Gst.PadDirection.SRC, False) or \
+                    not Gst.ElementFactory.list_filter(
+                        self.__decoders, profile.get_format(),
+                        Gst.PadDirection.SINK, False):
+                supported = False
+                break
+
+        self.__supported_targets[encoding_target_file] = supported
+        return supported
+
     def __getEncodingProfile(self, encoding_target_file, asset=None):
         encoding_target = GstPbutils.EncodingTarget.load_from_file(
             os.path.join(get_gstpresets_dir(), encoding_target_file))
@@ -154,19 +785,22 @@ class ProxyManager(GObject.Object, Loggable):
         if not encoding_profile:
             return None
 
-        for profile in encoding_profile.get_profiles():
-            if not Gst.ElementFactory.list_filter(
-                Gst.ElementFactory.list_get_elements(
-                    Gst.ELEMENT_FACTORY_TYPE_ENCODER, Gst.Rank.MARGINAL),
-                    profile.get_format(), Gst.PadDirection.SRC, False):
-                return None
-            if not Gst.ElementFactory.list_filter(
-                Gst.ElementFactory.list_get_elements(
-                    Gst.ELEMENT_FACTORY_TYPE_DECODER, Gst.Rank.MARGINAL),
-                    profile.get_format(), Gst.PadDirection.SINK, False):
-                return None
+        if not self.__isEncodingProfileSupported(encoding_target_file,
+                                                 encoding_profile):
+            return None
 
         if asset:
+            size = self.getProxySize(asset)
+            if size:
+                video_profile = [
+                    profile for profile in encoding_profile.get_profiles()
+                    if isinstance(profile, GstPbutils.EncodingVideoProfile)][0]
+                video = asset.get_info().get_video_streams()[0]
+                video_profile.set_restriction(Gst.Caps.from_string(
+                    "video/x-raw,width=%d,height=%d,pixel-aspect-ratio=%d/%d" %
+                    (size[0], size[1], video.get_par_num(),
+                     video.get_par_denom())))
+
             # If we have an asset, we force audioconvert to keep
             # the number of channels
             # TODO: remove once https://bugzilla.gnome.org/show_bug.cgi?id=767226
@@ -202,29 +836,159 @@ class ProxyManager(GObject.Object, Loggable):
         self.emit("error-preparing-asset", None, proxy, proxy.get_error())
         return False
 
-    def getTargetUri(self, proxy_asset):
-        return ".".join(proxy_asset.props.id.split(".")[:-3])
+    def _getProxyStore(self):
+        """Gets the central proxy store, if one is configured."""
+        directory = self.app.settings.proxyStoreDirectory
+        if not directory:
+            return None
+
+        if directory.startswith("file://"):
+            directory = path_from_uri(directory)
+        if self.__proxy_store is None or \
+                self.__proxy_store.directory != directory:
+            self.__proxy_store = ProxyStore(directory)
+        self.__proxy_store.quota = \
+            self.app.settings.proxyStoreQuota * 1024 * 1024
+        return self.__proxy_store
+
+    def __projectClosedCb(self, unused_project_manager, unused_project):
+        if self.__proxy_store:
+            self.__proxy_store.release()
+
+    def releaseProxy(self, proxy_uri):
+        """Allows the proxy store to evict the specified proxy."""
+        if self.__proxy_store:
+            self.__proxy_store.release(proxy_uri)
+
+    def getTargetUri(self, proxy_asset, project=None):
+        """Gets the URI of the asset the specified proxy is for.
+
+        Args:
+            proxy_asset (GES.Asset): The proxy.
+            project (Optional[Project]): The project containing the target,
+                for choosing between the copies of the same file which share
+                the proxy in the proxy store.
+
+        Returns:
+            str: The URI of the target, or None if unknown.
+        """
+        target = proxy_asset.get_proxy_target()
+        if target is not None:
+            return target.props.id
+
+        store = self._getProxyStore()
+        if store and store.contains(proxy_asset.props.id):
+            uris = store.getTargetUris(proxy_asset.props.id)
+            if project is not None:
+                for uri in uris:
+                    if project.get_asset(uri, GES.UriClip):
+                        return uri
+            return uris[0] if uris else None
+
+        parts = proxy_asset.props.id.split(".")[:-2]
+        if self.__size_re.match(parts[-1]):
+            parts.pop()
+        return ".".join(parts[:-1])
+
+    def getProxySize(self, asset):
+        """Gets the size of the video of the proxy for the specified asset.
+
+        For assets being transcoded, this is the size from when the job
+        has been queued.
+
+        Args:
+            asset (GES.UriClipAsset): The original asset.
+
+        Returns:
+            (int, int): The width and height of the proxy, or None if the
+                proxy has the same size as the original.
+        """
+        try:
+            return self.__proxy_sizes[asset.get_id()]
+        except KeyError:
+            return self.__computeProxySize(asset)
+
+    def __computeProxySize(self, asset):
+        scale = self.app.settings.proxyingScale
+        if scale == ProxyingScale.FULL:
+            return None
+
+        video_streams = asset.get_info().get_video_streams()
+        if not video_streams or video_streams[0].is_image():
+            return None
+
+        width = video_streams[0].get_width()
+        height = video_streams[0].get_height()
+        if scale == ProxyingScale.HALF:
+            factor = 1 / 2
+        elif scale == ProxyingScale.QUARTER:
+            factor = 1 / 4
+        elif scale == ProxyingScale.PROJECT:
+            project = self.app.project_manager.current_project
+            if not project:
+                return None
+            factor = min(1, project.videowidth / width,
+                         project.videoheight / height)
+        else:
+            self.warning("Unknown proxying scale: %s", scale)
+            return None
+
+        # Keep the dimensions even, as required by most encoders.
+        size = (max(2, int(width * factor) // 2 * 2),
+                max(2, int(height * factor) // 2 * 2))
+        if size[0] >= width and size[1] >= height:
+            return None
+        return size
+
+    def isScaledProxy(self, proxy_asset):
+        """Checks whether the proxy is smaller than its original."""
+        parts = proxy_asset.props.id.split(".")
+        return bool(len(parts) > 2 and self.__size_re.match(parts[-3]))
 
     def getProxyUri(self, asset):
         """Returns the URI of a possible proxy file.
 
         The name looks like:
-            <filename>.<file_size>.<proxy_extension>
+            <filename>.<file_size>[.<width>x<height>].<proxy_extension>
+        or, when a central proxy store is configured:
+            <store>/<fingerprint>.<file_size>[.<width>x<height>].<proxy_extension>
+
+        The size is specified only for proxies smaller than the original.
         """
+        extension = self.proxy_extension
+        size = self.getProxySize(asset)
+        if size:
+            extension = "%dx%d.%s" % (size[0], size[1], extension)
+
+        store = self._getProxyStore()
+        if store:
+            return store.getProxyUri(asset.get_id(), extension)
+
         asset_file = Gio.File.new_for_uri(asset.get_id())
         file_size = asset_file.query_info(Gio.FILE_ATTRIBUTE_STANDARD_SIZE,
                                           Gio.FileQueryInfoFlags.NONE,
                                           None).get_size()
 
-        return "%s.%s.%s" % (asset.get_id(), file_size, self.proxy_extension)
+        return "%s.%s.%s" % (asset.get_id(), file_size, extension)
 
     def isAssetFormatWellSupported(self, asset):
-        for encoding_format in self.WHITELIST_FORMATS:
-            if self._assetMatchesEncodingFormat(asset, encoding_format):
-                self.info("Automatically not proxying")
-                return True
+        # WHITELIST_FORMATS is the product of the whitelisted containers,
+        # audio and video formats, so each of them can be checked separately.
+        containers, audios, videos = self.__whitelist_caps
+        info = asset.get_info()
+        container = info.get_stream_info()
+        if container and \
+                not self.__streamsMatchSomeCaps([container], containers):
+            return False
 
-        return False
+        if not self.__streamsMatchSomeCaps(info.get_audio_streams(), audios):
+            return False
+
+        if not self.__streamsMatchSomeCaps(info.get_video_streams(), videos):
+            return False
+
+        self.info("Automatically not proxying")
+        return True
 
     def __assetNeedsTranscoding(self, asset, force_proxying=False):
         if self.proxyingUnsupported:
@@ -255,11 +1019,17 @@ class ProxyManager(GObject.Object, Loggable):
         return False
 
     def __startTranscoder(self, transcoder):
+        job = self.__jobs.get(transcoder.props.src_uri)
+        if not job:
+            self.warning("No job for %s, not starting it",
+                         transcoder.props.src_uri)
+            return False
+
         self.debug("Starting %s", transcoder.props.src_uri)
-        if self._start_proxying_time == 0:
-            self._start_proxying_time = time.time()
+        job.start(time.time())
         transcoder.run_async()
         self.__running_transcoders.append(transcoder)
+        return True
 
     def __assetsMatch(self, asset, proxy):
         if self.__assetNeedsTranscoding(proxy):
@@ -296,6 +1066,8 @@ class ProxyManager(GObject.Object, Loggable):
         self.__emitProgress(proxy, 100)
 
     def __transcoderErrorCb(self, transcoder, error, asset):
+        self.__jobs.pop(asset.get_id(), None)
+        self.__proxy_sizes.pop(asset.get_id(), None)
         self.emit("error-preparing-asset", asset, None, error)
 
     def __transcoderDoneCb(self, transcoder, asset):
@@ -307,43 +1079,121 @@ class ProxyManager(GObject.Object, Loggable):
 
         self.__running_transcoders.remove(transcoder)
 
-        proxy_uri = self.getProxyUri(asset)
+        # The proxy settings might have changed in the meantime.
+        proxy_uri = transcoder.props.dest_uri[:-len(".part")]
         os.rename(Gst.uri_get_location(transcoder.props.dest_uri),
                   Gst.uri_get_location(proxy_uri))
 
+        store = self._getProxyStore()
+        if store:
+            store.use(asset.get_id(), proxy_uri)
+            store.evict()
+
         # Make sure that if it first failed loading, the proxy is forced to be
         # reloaded in the GES cache.
         GES.Asset.needs_reload(GES.UriClip, proxy_uri)
         GES.Asset.request_async(GES.UriClip, proxy_uri, None,
                                 self.__assetLoadedCb, asset, transcoder)
 
-        try:
-            self.__startTranscoder(self.__pending_transcoders.pop())
-        except IndexError:
-            if not self.__running_transcoders:
-                self._total_transcoded_time = 0
-                self._total_time_to_transcode = 0
-                self._start_proxying_time = 0
+        self.__proxy_sizes.pop(asset.get_id(), None)
+        job = self.__jobs.pop(asset.get_id(), None)
+        if job:
+            job.update(job.duration, time.time())
+            self.__history.record(job.key, job.averageThroughput())
 
-    def __emitProgress(self, asset, progress):
-        if self._total_transcoded_time:
-            time_spent = time.time() - self._start_proxying_time
-            self._estimated_time = max(
-                0, (time_spent * self._total_time_to_transcode /
-                    self._total_transcoded_time) - time_spent)
+        while self.__pending_transcoders:
+            if self.__startTranscoder(self.__pending_transcoders.pop()):
+                break
+
+    def getTranscodingKey(self, asset):
+        """Gets the kind of media of the asset, for the throughput history.
+
+        The transcoding speed depends mostly on the video codec and size of
+        the original and on the proxy format and size.
+        """
+        key = [str(self.__encoding_target_file)]
+        video_streams = asset.get_info().get_video_streams()
+        if video_streams:
+            video = video_streams[0]
+            caps = video.get_caps()
+            codec = caps.get_structure(0).get_name() if caps else "unknown"
+            key.append("%s %dx%d" % (codec, video.get_width(),
+                                     video.get_height()))
+        size = self.getProxySize(asset)
+        if size:
+            key.append("%dx%d" % size)
+        return " ".join(key)
+
+    def getThroughput(self):
+        """Gets the smoothed throughput of all the running jobs.
+
+        Returns:
+            float: The media seconds transcoded per wall-clock second.
+        """
+        return sum(job.throughput for job in self.__jobs.values()
+                   if job.started)
+
+    def getJobThroughput(self, asset):
+        """Gets the smoothed throughput of the job transcoding the asset.
+
+        Returns:
+            float: The media seconds transcoded per wall-clock second, or 0
+                if the asset is not being transcoded.
+        """
+        job = self.__jobs.get(asset.get_id())
+        if not job:
+            return 0
+        return job.throughput
+
+    def predictTranscodingTime(self, asset):
+        """Predicts the time needed to create the proxy of the asset.
+
+        The prediction is based on the throughputs recorded in the past.
+
+        Returns:
+            float: The time in seconds, or None if nothing is known.
+        """
+        throughput = self.__history.getThroughput(
+            self.getTranscodingKey(asset)) or \
+            self.__history.getAverageThroughput()
+        if not throughput:
+            return None
+        return asset.get_duration() / Gst.SECOND / throughput
+
+    def __estimateTimeLeft(self):
+        running = [job for job in self.__jobs.values() if job.started]
+        known = [job.throughput for job in running if job.throughput]
+        if known:
+            default_throughput = sum(known) / len(known)
         else:
-            self._estimated_time = 0
+            default_throughput = self.__history.getAverageThroughput()
 
+        time_left = 0
+        for job in self.__jobs.values():
+            job_time_left = job.estimateTimeLeft(default_throughput)
+            if job_time_left is None:
+                return 0
+            time_left += job_time_left
+
+        # The jobs run in parallel.
+        parallel_jobs = max(1, min(len(self.__jobs),
+                                   self.app.settings.numTranscodingJobs))
+        return time_left / parallel_jobs
+
+    def __emitProgress(self, asset, progress):
+        self._estimated_time = self.__estimateTimeLeft()
         asset.creation_progress = progress
         self.emit("progress", asset, asset.creation_progress,
                   self._estimated_time)
 
     def __proxyingPositionChangedCb(self, transcoder, position, asset):
-        # Do not set to >= 100 as we need to notify about the proxy first
-        self._total_transcoded_time -= (asset.creation_progress * (asset.get_duration() /
-                                                                   Gst.SECOND)) / 100
-        self._total_transcoded_time += position / Gst.SECOND
+        job = self.__jobs.get(asset.get_id())
+        if job:
+            job.update(position / Gst.SECOND, time.time())
+            self.emit("throughput", asset, job.throughput,
+                      self.getThroughput())
 
+        # Do not set to >= 100 as we need to notify about the proxy first
         if transcoder.props.duration:
             asset.creation_progress = max(
                 0, min(99, (position / transcoder.props.duration) * 100))
@@ -359,8 +1209,11 @@ class ProxyManager(GObject.Object, Loggable):
         return False
 
     def __createTranscoder(self, asset):
-        self._total_time_to_transcode += asset.get_duration() / Gst.SECOND
         asset_uri = asset.get_id()
+        key = self.getTranscodingKey(asset)
+        self.__jobs[asset_uri] = TranscodingJob(
+            key, asset.get_duration() / Gst.SECOND,
+            self.__history.getThroughput(key))
         proxy_uri = self.getProxyUri(asset)
 
         dispatcher = GstTranscoder.TranscoderGMainContextSignalDispatcher.new()
@@ -399,6 +1252,8 @@ class ProxyManager(GObject.Object, Loggable):
         for transcoder in self.__running_transcoders:
             if asset.props.id == transcoder.props.src_uri:
                 self.__running_transcoders.remove(transcoder)
+                self.__jobs.pop(asset.get_id(), None)
+                self.__proxy_sizes.pop(asset.get_id(), None)
                 self.info("Cancelling running transcoder %s %s",
                           transcoder.props.src_uri,
                           transcoder.__grefcount__)
@@ -411,6 +1266,8 @@ class ProxyManager(GObject.Object, Loggable):
                 # will lead to its destruction (only reference)
                 # here, which means it will be stopped.
                 self.__pending_transcoders.remove(transcoder)
+                self.__jobs.pop(asset.get_id(), None)
+                self.__proxy_sizes.pop(asset.get_id(), None)
                 self.emit("asset-preparing-cancelled", asset)
                 self.info("Cancelling pending transcoder %s",
                           transcoder.props.src_uri)
@@ -436,10 +1293,15 @@ class ProxyManager(GObject.Object, Loggable):
         if self.__assetQueued(asset):
             return True
 
+        self.__proxy_sizes[asset.get_id()] = self.__computeProxySize(asset)
         proxy_uri = self.getProxyUri(asset)
         if Gio.File.new_for_uri(proxy_uri).query_exists(None):
             self.debug("Using proxy already generated: %s",
                        proxy_uri)
+            self.__proxy_sizes.pop(asset.get_id(), None)
+            store = self._getProxyStore()
+            if store:
+                store.use(asset.get_id(), proxy_uri)
             GES.Asset.request_async(GES.UriClip,
                                     proxy_uri, None,
                                     self.__assetLoadedCb, asset,
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+import os
+import pickle
+from unittest import mock
+
+import numpy
+from gi.repository import Gst
+
+from pitivi.autoaligner import affinealign
+from pitivi.autoaligner import AutoAligner
+from pitivi.autoaligner import driftalign
+from pitivi.autoaligner import EnvelopeExtractee
+from pitivi.autoaligner import fastlen
+from pitivi.autoaligner import getCachedEnvelope
+from pitivi.autoaligner import globalalign
+from pitivi.autoaligner import rigidalign
+from pitivi.autoaligner import submax
+from pitivi.timeline.previewers import get_wavefile_location_for_uri
+from pitivi.timeline.previewers import SAMPLE_DURATION
+from tests import common
+
+
+class TestCachedEnvelope(common.TestCase):
+
+    def _createClip(self, samples, in_point, duration):
+        uri = common.get_sample_uri("tears_of_steel.webm")
+        wavefile = get_wavefile_location_for_uri(uri)
+        with open(wavefile, "wb") as f:
+            pickle.dump(samples, f)
+        self.addCleanup(os.remove, wavefile)
+
+        clip = mock.Mock()
+        clip.get_asset.return_value.get_id.return_value = uri
+        clip.props.in_point = in_point
+        clip.props.duration = duration
+        return clip
+
+    def testResample(self):
+        samples = list(range(100))
+        clip = self._createClip(samples, 10 * SAMPLE_DURATION, Gst.SECOND // 2)
+        envelope = getCachedEnvelope(clip, 25)
+        self.assertEqual(list(envelope),
+                         [sum(samples[i:i + 4]) for i in range(10, 58, 4)])
+
+    def testIncompleteCache(self):
+        clip = self._createClip([1] * 50, 0, Gst.SECOND)
+        self.assertIsNone(getCachedEnvelope(clip, 25))
+
+    def testNoCache(self):
+        clip = mock.Mock()
+        clip.get_asset.return_value.get_id.return_value = \
+            common.get_sample_uri("1sec_simpsons_trailer.mp4")
+        clip.props.in_point = 0
+        clip.props.duration = Gst.SECOND
+        self.assertIsNone(getCachedEnvelope(clip, 25))
+
+
+class TestEnvelopeExtractee(common.TestCase):
+
+    def _extract(self, samples, blocksize, chunk_sizes, num_samples):
+        envelopes = []
+        extractee = EnvelopeExtractee(blocksize, envelopes.append,
+                                      num_samples=num_samples)
+        position = 0
+        for size in chunk_sizes:
+            extractee.receive(samples[position:position + size])
+            position += size
+        extractee.finalize()
+        return envelopes[0]
+
+    def testEnvelope(self):
+        samples = numpy.sin(numpy.arange(10007)).astype(numpy.float32)
+        expected = numpy.abs(samples[:10000]).reshape((100, 100)).sum(1)
+        # Chunks smaller than, equal to and larger than a block.
+        chunk_sizes = [37, 100, 263, 1, 5000] + [1000] * 5
+        for num_samples in (len(samples), 0):
+            envelope = self._extract(samples, 100, chunk_sizes, num_samples)
+            numpy.testing.assert_allclose(envelope, expected, rtol=1e-5)
+
+    def testAbort(self):
+        callback = mock.Mock()
+        extractee = EnvelopeExtractee(100, callback, "clip")
+        extractee.receive(numpy.ones(250, dtype=numpy.float32))
+        extractee.abort(mock.Mock())
+        callback.assert_called_once_with(None, "clip")
+
+
+class TestAutoAligner(common.TestCase):
+
+    def testFailedExtractionSkipsClip(self):
+        clips = [mock.Mock() for unused_i in range(3)]
+        callback = mock.Mock()
+        aligner = AutoAligner(clips, callback)
+        aligner._extractors = {clip: mock.Mock() for clip in clips}
+        envelope = numpy.ones(100, dtype=numpy.float32)
+        with mock.patch.object(aligner, "_performShifts") as perform_shifts:
+            aligner._envelopeCb(envelope, clips[0])
+            aligner._envelopeCb(None, clips[1])
+            aligner._envelopeCb(envelope, clips[2])
+        perform_shifts.assert_called_once_with()
+        callback.assert_called_once_with()
+        self.assertEqual(set(aligner._clips), {clips[0], clips[2]})
+
+    def testNotEnoughClipsLeft(self):
+        clips = [mock.Mock() for unused_i in range(2)]
+        callback = mock.Mock()
+        aligner = AutoAligner(clips, callback)
+        aligner._extractors = {clip: mock.Mock() for clip in clips}
+        with mock.patch.object(aligner, "_performShifts") as perform_shifts:
+            aligner._envelopeCb(None, clips[0])
+            aligner._envelopeCb(numpy.ones(100), clips[1])
+        perform_shifts.assert_not_called()
+        callback.assert_called_once_with()
+
+
+class TestGlobalAlign(common.TestCase):
+
+    def testStaggeredRecordings(self):
+        random = numpy.random.RandomState(1)
+        event = numpy.abs(random.randn(3000))
+        # The first and the third recordings do not overlap.
+        segments = [(0, 1000), (800, 1800), (1600, 2600), (500, 1200)]
+        envelopes = [event[start:end] + 0.1 * numpy.abs(random.randn(end - start))
+                     for start, end in segments]
+        shifts = globalalign(envelopes, reference=0)
+        for shift, (start, unused_end) in zip(shifts, segments):
+            self.assertAlmostEqual(shift, start, delta=0.1)
+
+    def testLongRecordings(self):
+        random = numpy.random.RandomState(4)
+        event = numpy.abs(random.randn(400000))
+        # Longer than COARSE_LENGTH, so aligned coarse to fine.
+        segments = [(0, 150000), (37013, 250000), (120007, 400000)]
+        envelopes = [event[start:end] + 0.1 * numpy.abs(random.randn(end - start))
+                     for start, end in segments]
+        shifts = globalalign(envelopes, reference=0)
+        for shift, (start, unused_end) in zip(shifts, segments):
+            self.assertAlmostEqual(shift, start, delta=0.1)
+
+
+class TestRigidAlign(common.TestCase):
+
+    def testFastLen(self):
+        for size in (1, 7, 17, 100, 1001, 4097):
+            length = fastlen(size)
+            self.assertGreaterEqual(length, size)
+            for factor in (2, 3, 5):
+                while length % factor == 0:
+                    length //= factor
+            self.assertEqual(length, 1, size)
+
+    def testShifts(self):
+        random = numpy.random.RandomState(2)
+        event = numpy.abs(random.randn(2000))
+        reference = event[300:1300]
+        targets = [event[0:800], event[700:1900], event[300:1000]]
+        for unused_i in range(2):
+            # The second time, the cached spectra are used.
+            shifts = rigidalign(reference, targets)
+            for shift, expected in zip(shifts, (-300, 400, 0)):
+                self.assertAlmostEqual(shift, expected, delta=0.1)
+
+    def testSubmax(self):
+        for extreme in (-0.4, 0, 0.1, 0.25):
+            def quadratic(x):
+                return 3 - 2 * (x - extreme) ** 2
+            self.assertAlmostEqual(
+                submax(quadratic(-1), quadratic(0), quadratic(1)), extreme)
+
+
+class TestAffineAlign(common.TestCase):
+
+    def testDrift(self):
+        random = numpy.random.RandomState(3)
+        event = numpy.abs(random.randn(25000))
+        reference = event[:20000]
+        for drift in (0.001, -0.002, 0):
+            # Sample k of the target was recorded at 500 + k * (1 + drift)
+            # in the reference.
+            positions = 500 + numpy.arange(18000) * (1 + drift)
+            target = numpy.interp(positions, numpy.arange(len(event)), event)
+            offsets, drifts = affinealign(reference, [target], 0.02)
+            self.assertAlmostEqual(offsets[0], 500, delta=1)
+            self.assertAlmostEqual(drifts[0], drift, delta=0.0001)
+
+
+class TestDriftAlign(common.TestCase):
+
+    def testDrift(self):
+        random = numpy.random.RandomState(3)
+        event = numpy.abs(random.randn(50000))
+        reference = event[:45000]
+        for drift in (0.001, -0.001, 0.00003, 0):
+            # Sample k of the target was recorded at 500 + k * (1 + drift)
+            # in the reference.
+            positions = 500 + numpy.arange(40000) * (1 + drift)
+            target = numpy.interp(positions, numpy.arange(len(event)), event)
+            # The coarse offset is the average position of the target.
+            coarse = 500 + 20000 * drift
+            offset, estimated = driftalign(reference, target, coarse, 0.001)
+            self.assertAlmostEqual(offset, 500, delta=1)
+            self.assertAlmostEqual(estimated, drift, delta=0.00001)
+
+    def testSmallDrift(self):
+        # The drifts right above AutoAligner.MIN_DRIFT must not be
+        # overestimated.
+        for seed in range(3):
+            random = numpy.random.RandomState(seed)
+            event = numpy.abs(random.randn(95000))
+            reference = event[:90000]
+            for drift in (0.00001, 0.00002):
+                positions = 500 + numpy.arange(81000) * (1 + drift)
+                target = numpy.interp(positions, numpy.arange(len(event)),
+                                      event)
+                coarse = 500 + 40500 * drift
+                offset, estimated = driftalign(reference, target, coarse,
+                                               0.001)
+                self.assertAlmostEqual(offset, 500, delta=0.1)
+                self.assertAlmostEqual(estimated, drift, delta=0.000002)
+
+    def testShortOverlap(self):
+        reference = numpy.ones(100)
+        self.assertIsNone(driftalign(reference, numpy.ones(100), 90, 0.001))
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+import tempfile
+from unittest import mock
+
+import numpy
+
+from pitivi.utils import fingerprint
+from pitivi.utils.fingerprint import FingerprintIndex
+from tests import common
+
+
+class TestFingerprint(common.TestCase):
+
+    def _spectrogram(self, num_frames, seed=42):
+        random = numpy.random.RandomState(seed)
+        spectrogram = random.normal(-60, 3, (num_frames, fingerprint.NUM_BINS))
+        # A few loud tones starting and stopping randomly.
+        for unused_i in range(num_frames // 2):
+            frame = random.randint(num_frames)
+            bin_ = random.randint(fingerprint.NUM_BINS)
+            spectrogram[frame:frame + random.randint(1, 5), bin_] = -20
+        return spectrogram
+
+    def _landmarks(self, spectrogram):
+        return fingerprint.computeLandmarks(fingerprint.findPeaks(spectrogram))
+
+    def testFrequencyBins(self):
+        bins = fingerprint.frequencyBins(44100)
+        self.assertEqual(bins[0], -1)
+        self.assertEqual(bins[-1], -1)
+        valid = bins[bins >= 0]
+        # The first bins are narrower than the bands.
+        self.assertLess(valid[0], 4)
+        self.assertEqual(valid[-1], fingerprint.NUM_BINS - 1)
+        self.assertTrue((numpy.diff(valid) >= 0).all())
+
+    def testReduceSpectrum(self):
+        bins = fingerprint.frequencyBins(44100)
+        magnitudes = numpy.full(len(bins), -60.)
+        frame = fingerprint.reduceSpectrum(magnitudes, bins)
+        # The bins narrower than the bands are filled.
+        self.assertFalse(numpy.isneginf(frame).any())
+        self.assertEqual(fingerprint.findPeaks(numpy.tile(frame, (5, 1))), [])
+
+    def testLandmarksVersion(self):
+        with tempfile.NamedTemporaryFile() as db, \
+                mock.patch.object(FingerprintIndex, "_key",
+                                  staticmethod(lambda uri: uri)):
+            index = FingerprintIndex(db.name)
+            index.addLandmarks("file:///a", [(1, 2)])
+            self.assertTrue(FingerprintIndex(db.name).contains("file:///a"))
+
+            with mock.patch.object(fingerprint, "LANDMARKS_VERSION", 1):
+                index = FingerprintIndex(db.name)
+            self.assertFalse(index.contains("file:///a"))
+
+    def testFindOverlaps(self):
+        spectrogram = self._spectrogram(2000)
+        with tempfile.NamedTemporaryFile() as db, \
+                mock.patch.object(FingerprintIndex, "_key",
+                                  staticmethod(lambda uri: uri)):
+            index = FingerprintIndex(db.name)
+            self.assertFalse(index.contains("file:///a"))
+            index.addLandmarks("file:///a", self._landmarks(spectrogram))
+            index.addLandmarks("file:///b",
+                               self._landmarks(spectrogram[300:1500]))
+            index.addLandmarks("file:///c",
+                               self._landmarks(self._spectrogram(1000, seed=7)))
+            self.assertTrue(index.contains("file:///a"))
+
+            overlaps = index.findOverlaps("file:///b")
+            self.assertEqual(len(overlaps), 1)
+            uri, offset, unused_score = overlaps[0]
+            self.assertEqual(uri, "file:///a")
+            self.assertEqual(offset, 300 * fingerprint.FRAME_DURATION)
+
+            # Only a part of the file.
+            overlaps = index.findOverlaps(
+                "file:///a", 1000 * fingerprint.FRAME_DURATION,
+                200 * fingerprint.FRAME_DURATION)
+            self.assertEqual(len(overlaps), 1)
+            uri, offset, unused_score = overlaps[0]
+            self.assertEqual(uri, "file:///b")
+            self.assertEqual(offset, -300 * fingerprint.FRAME_DURATION)
+
+            # Nothing matches the end of the file.
+            self.assertEqual(index.findOverlaps(
+                "file:///a", 1600 * fingerprint.FRAME_DURATION), [])
@@ -16,13 +16,17 @@
 # License along with this program; if not, write to the
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
+import collections
 import os
 import tempfile
 from gettext import gettext as _
 from unittest import mock
 
+from gi.repository import GdkPixbuf
 from gi.repository import GES
+from gi.repository import GLib
 from gi.repository import Gst
+from gi.repository import Gtk
 
 from pitivi import medialibrary
 from pitivi.project import ProjectManager
@@ -127,8 +131,11 @@ class TestMediaLibrary(BaseTestMediaLibrary):
 
         self.assertEqual(proxy.props.proxy_target.props.id, asset_uri)
 
-        self.app.project_manager.current_project.disableProxiesForAssets(
-            [proxy], delete_proxies)
+        # The row is updated in place, its thumbnails are not searched again.
+        with mock.patch.object(self.medialibrary, "_addAsset") as add_asset:
+            self.app.project_manager.current_project.disableProxiesForAssets(
+                [proxy], delete_proxies)
+        add_asset.assert_not_called()
         self.assertEqual(len(self.medialibrary.storemodel),
                          len(self.samples))
 
@@ -216,7 +223,267 @@ class TestMediaLibrary(BaseTestMediaLibrary):
         self.assertEqual(asset.creation_progress, 100)
         self.assertEqual(asset.get_proxy(), proxy)
 
+    def testRowsIndex(self):
+        samples = ["30fps_numeroted_frames_red.mkv",
+                   "30fps_numeroted_frames_blue.webm"]
+        self.runCheckImport(samples, ProxyingStrategy.NOTHING)
+
+        for row in self.medialibrary.storemodel:
+            self.assertEqual(
+                self.medialibrary.getAssetForUri(row[medialibrary.COL_URI]),
+                row[medialibrary.COL_ASSET])
+
+        self.medialibrary._selectSources([common.get_sample_uri(samples[0])])
+        self.medialibrary.remove_assets_action.emit("activate", None)
+        self.assertEqual(len(self.medialibrary.storemodel), 1)
+        self.assertEqual(list(self.medialibrary._rows.keys()),
+                         [common.get_sample_uri(samples[1])])
+
+    def testRowsSortedAfterImport(self):
+        samples = ["30fps_numeroted_frames_red.mkv",
+                   "30fps_numeroted_frames_blue.webm"]
+        self.runCheckImport(samples, ProxyingStrategy.NOTHING)
+
+        self.assertFalse(self.medialibrary.pending_rows)
+        self.assertEqual([row[medialibrary.COL_URI]
+                          for row in self.medialibrary.storemodel],
+                         [common.get_sample_uri(sample)
+                          for sample in sorted(samples)])
+
+    def testFewRowsInsertedSorted(self):
+        samples = ["30fps_numeroted_frames_red.mkv",
+                   "30fps_numeroted_frames_blue.webm"]
+        with mock.patch.object(Gtk.ListStore, "set_sort_column_id") as \
+                set_sort_column_id:
+            self.runCheckImport(samples, ProxyingStrategy.NOTHING)
+
+        # The store is not re-sorted for a few rows.
+        for args, unused_kwargs in set_sort_column_id.call_args_list:
+            self.assertNotEqual(args[0],
+                                Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID)
+
+    def testInfoRefreshedAtFixedRate(self):
+        self.runCheckImport(["30fps_numeroted_frames_red.mkv"],
+                            ProxyingStrategy.NOTHING)
+        row = self.medialibrary.storemodel[0]
+        asset = row[medialibrary.COL_ASSET]
+
+        asset.creation_progress = 42
+        self.app.proxy_manager.emit("progress", asset, 42, 0)
+        self.assertNotIn("42%", row[medialibrary.COL_INFOTEXT])
+
+        GLib.timeout_add(medialibrary.INFO_REFRESH_INTERVAL * 2,
+                         self.mainloop.quit)
+        self.mainloop.run()
+        self.assertIn("42%", row[medialibrary.COL_INFOTEXT])
+        asset.creation_progress = 100
+
+    def testMissingThumbnailsGenerated(self):
+        pixbuf_128 = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8,
+                                          128, 72)
+        pixbuf_64 = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8,
+                                         64, 36)
+        widget_class = medialibrary.MediaLibraryWidget
+        with mock.patch.object(widget_class, "_getThumbnailer"), \
+                mock.patch.object(medialibrary.IconsCache, "getIcons",
+                                  return_value=(None, None)), \
+                mock.patch.object(widget_class, "_getThumbnailInDir",
+                                  return_value=(None, None)), \
+                mock.patch.object(widget_class, "_generateThumbnails",
+                                  return_value=(pixbuf_128, pixbuf_64)):
+            self.runCheckImport(["30fps_numeroted_frames_red.mkv",
+                                 "30fps_numeroted_frames_blue.webm"],
+                                ProxyingStrategy.NOTHING)
+            # Let the threads generate the thumbnails.
+            GLib.timeout_add(500, self.mainloop.quit)
+            self.mainloop.run()
+
+        for row in self.medialibrary.storemodel:
+            self.assertEqual(row[medialibrary.COL_ICON_64], pixbuf_64)
+            self.assertEqual(row[medialibrary.COL_ICON_128], pixbuf_128)
+
+    def testThumbnailsNotOverwritten(self):
+        pixbuf_128 = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8,
+                                          128, 72)
+        pixbuf_64 = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8,
+                                         64, 36)
+        widget_class = medialibrary.MediaLibraryWidget
+        with mock.patch.object(widget_class, "_getThumbnailer"), \
+                mock.patch.object(medialibrary.IconsCache, "getIcons",
+                                  return_value=(pixbuf_64, pixbuf_128)), \
+                mock.patch.object(widget_class,
+                                  "_generateThumbnails") as generate:
+            self.runCheckImport(["30fps_numeroted_frames_red.mkv"],
+                                ProxyingStrategy.NOTHING)
+        # The assets having a thumbnail are not queued.
+        generate.assert_not_called()
+
+        # A thumbnail generated meanwhile does not replace the real one.
+        row = self.medialibrary.storemodel[0]
+        other_128 = pixbuf_128.copy()
+        other_64 = pixbuf_64.copy()
+        self.medialibrary._MediaLibraryWidget__generated_thumbs.append(
+            (row[medialibrary.COL_URI], (other_128, other_64)))
+        self.medialibrary._MediaLibraryWidget__showGeneratedThumbnailsCb()
+        self.assertEqual(row[medialibrary.COL_ICON_64], pixbuf_64)
+        self.assertEqual(row[medialibrary.COL_ICON_128], pixbuf_128)
+
     def testMissingUriDisplayed(self):
         with common.created_project_file() as uri:
             self._customSetUp(project_uri=uri)
         self.assertTrue(self.medialibrary._import_warning_infobar.props.visible)
+
+
+class TestIsMediaFile(common.TestCase):
+
+    def testSamples(self):
+        for name in ("30fps_numeroted_frames_red.mkv",
+                     "30fps_numeroted_frames_blue.webm",
+                     "flat_colour1_640x480.png",
+                     "flat_colour4_1600x1200.jpg"):
+            path = Gst.uri_get_location(common.get_sample_uri(name))
+            self.assertTrue(medialibrary.is_media_file(path), name)
+
+    def testUnrelatedFiles(self):
+        with tempfile.NamedTemporaryFile(suffix=".txt") as text_file:
+            text_file.write(b"Not a video")
+            text_file.flush()
+            self.assertFalse(medialibrary.is_media_file(text_file.name))
+        with tempfile.NamedTemporaryFile(suffix=".xges") as project_file:
+            project_file.write(b"<ges version='0.3'></ges>")
+            project_file.flush()
+            self.assertFalse(medialibrary.is_media_file(project_file.name))
+
+    def testUnreadableFile(self):
+        self.assertFalse(medialibrary.is_media_file("/nonexistent/file"))
+
+
+class TestIconsCache(common.TestCase):
+
+    def testIconsReusedUntilFileModified(self):
+        thumb_64 = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8,
+                                        64, 36)
+        thumb_128 = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8,
+                                         128, 72)
+        with tempfile.NamedTemporaryFile() as dbfile, \
+                tempfile.NamedTemporaryFile() as media_file:
+            uri = Gst.filename_to_uri(media_file.name)
+            cache = medialibrary.IconsCache(dbfile.name)
+            self.assertEqual(cache.getIcons(uri), (None, None))
+
+            cache.setIcons(uri, thumb_64, thumb_128)
+            cache.commit()
+            icon_64, icon_128 = medialibrary.IconsCache(
+                dbfile.name).getIcons(uri)
+            self.assertEqual((icon_64.get_width(), icon_64.get_height()),
+                             (64, 36))
+            self.assertEqual((icon_128.get_width(), icon_128.get_height()),
+                             (128, 72))
+
+            media_file.write(b"modified")
+            media_file.flush()
+            self.assertEqual(cache.getIcons(uri), (None, None))
+
+    def testIconsSavedOnClose(self):
+        thumb_64 = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8,
+                                        64, 36)
+        thumb_128 = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8,
+                                         128, 72)
+        with tempfile.NamedTemporaryFile() as dbfile, \
+                tempfile.NamedTemporaryFile() as media_file:
+            uri = Gst.filename_to_uri(media_file.name)
+            cache = medialibrary.IconsCache(dbfile.name)
+            cache.setIcons(uri, thumb_64, thumb_128)
+            cache.close()
+            icon_64, unused_icon_128 = medialibrary.IconsCache(
+                dbfile.name).getIcons(uri)
+            self.assertIsNotNone(icon_64)
+
+    def testLeastRecentlyUsedIconsForgotten(self):
+        thumb_64 = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8,
+                                        64, 36)
+        thumb_128 = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8,
+                                         128, 72)
+        with tempfile.NamedTemporaryFile() as dbfile, \
+                tempfile.TemporaryDirectory() as directory:
+            uris = []
+            for name in ("a", "b", "c"):
+                path = os.path.join(directory, name)
+                with open(path, "wb") as media_file:
+                    media_file.write(name.encode())
+                uris.append(Gst.filename_to_uri(path))
+
+            cache = medialibrary.IconsCache(dbfile.name, max_files=2)
+            with mock.patch("time.time") as time_mock:
+                for now, uri in enumerate(uris):
+                    time_mock.return_value = now
+                    cache.setIcons(uri, thumb_64, thumb_128)
+                time_mock.return_value = len(uris)
+                self.assertIsNotNone(cache.getIcons(uris[0])[0])
+            cache.close()
+
+            cache = medialibrary.IconsCache(dbfile.name, max_files=2)
+            self.assertEqual([cache.getIcons(uri)[0] is not None
+                              for uri in uris], [True, False, True])
+
+
+class TestThumbnailsDecorator(common.TestCase):
+
+    def testDecoratedThumbnailsReused(self):
+        thumbs = [GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8,
+                                       64, 36),
+                  GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8,
+                                       128, 72)]
+        asset = mock.Mock()
+        asset.get_proxy_target.return_value = None
+        asset.proxying_error = None
+        asset.creation_progress = 50
+
+        decorated = collections.OrderedDict()
+        decorator = medialibrary.ThumbnailsDecorator(thumbs, asset,
+                                                     decorated=decorated)
+        self.assertEqual(decorator.state,
+                         medialibrary.ThumbnailsDecorator.IN_PROGRESS)
+        self.assertIsNot(decorator.thumb_64, thumbs[0])
+        self.assertIsNot(decorator.thumb_128, thumbs[1])
+
+        with mock.patch.object(GdkPixbuf.Pixbuf, "composite") as composite:
+            other = medialibrary.ThumbnailsDecorator(thumbs, asset,
+                                                     decorated=decorated)
+        composite.assert_not_called()
+        self.assertIs(other.thumb_64, decorator.thumb_64)
+        self.assertIs(other.thumb_128, decorator.thumb_128)
+
+        # The decorators of another media library do not share them.
+        other = medialibrary.ThumbnailsDecorator(thumbs, asset)
+        self.assertIsNot(other.thumb_64, decorator.thumb_64)
+
+        asset.creation_progress = 100
+        decorator.decorate()
+        self.assertEqual(decorator.state,
+                         medialibrary.ThumbnailsDecorator.NO_PROXY)
+        self.assertIs(decorator.thumb_64, thumbs[0])
+
+
+class TestSearchIndex(common.TestCase):
+
+    def testSearch(self):
+        index = medialibrary.SearchIndex()
+        index.add("a", "<b>/videos/Beach.MKV</b>\nH.264")
+        index.add("b", "<b>/videos/mountain.webm</b>\nVP8")
+        index.add("c", "<b>/music/rock &amp; roll.ogg</b>")
+
+        self.assertEqual(index.search("videos"), {"a", "b"})
+        self.assertEqual(index.search("beach"), {"a"})
+        self.assertEqual(index.search("&amp;"), {"c"})
+        self.assertEqual(index.search("vp"), {"b"})
+        self.assertEqual(index.search("nothing"), set())
+
+        # Refine the results of a previous search.
+        self.assertEqual(index.search("/videos/m", {"a", "b"}), {"b"})
+
+        index.remove("a")
+        self.assertEqual(index.search("videos"), {"b"})
+        index.add("b", "Updated")
+        self.assertEqual(index.search("videos"), set())
+        self.assertEqual(index.search("updated"), {"b"})
@@ -16,9 +16,13 @@
 # License along with this program; if not, write to the
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
+import os
+import tempfile
 import unittest
+from unittest import mock
 
 from pitivi.utils.misc import binary_search
+from pitivi.utils.misc import PathWalker
 
 
 class BinarySearchTest(unittest.TestCase):
@@ -40,3 +44,31 @@ class BinarySearchTest(unittest.TestCase):
         self.assertEqual(binary_search([10, 20, 30], 11), 0)
         self.assertEqual(binary_search([10, 20, 30], 24), 1)
         self.assertEqual(binary_search([10, 20, 30], 40), 2)
+
+
+class PathWalkerTest(unittest.TestCase):
+
+    def testBatchesAndFilter(self):
+        with tempfile.TemporaryDirectory() as root:
+            subdir = os.path.join(root, "sub")
+            os.mkdir(subdir)
+            for i in range(5):
+                open(os.path.join(root, "%d.ogg" % i), "w").close()
+                open(os.path.join(root, "%d.txt" % i), "w").close()
+            open(os.path.join(subdir, "x.ogg"), "w").close()
+
+            callback = mock.Mock()
+            walker = PathWalker(["file://" + root], callback,
+                                accept=lambda path: path.endswith(".ogg"))
+            walker.BATCH_SIZE = 2
+            with mock.patch("pitivi.utils.misc.GLib.idle_add") as idle_add:
+                walker.process()
+
+            batches = [args[1] for args, unused_kwargs in idle_add.call_args_list]
+            self.assertTrue(all(args[0] is callback
+                                for args, unused_kwargs in idle_add.call_args_list))
+            self.assertTrue(all(len(batch) <= 2 for batch in batches))
+            uris = sorted(uri for batch in batches for uri in batch)
+            expected = ["file://%s/%d.ogg" % (root, i) for i in range(5)]
+            expected.append("file://%s/x.ogg" % subdir)
+            self.assertEqual(uris, sorted(expected))
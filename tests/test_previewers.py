@@ -18,18 +18,46 @@
 # Boston, MA 02110-1301, USA.
 import os
 import pickle
+import tempfile
 from unittest import mock
 
+from gi.repository import GdkPixbuf
 from gi.repository import GES
 from gi.repository import Gst
 
+from pitivi.timeline.previewers import CACHES
+from pitivi.timeline.previewers import findThumbnailCache
 from pitivi.timeline.previewers import get_wavefile_location_for_uri
 from pitivi.timeline.previewers import getThumbnailCache
+from pitivi.timeline.previewers import PreviewGeneratorManager
 from pitivi.timeline.previewers import THUMB_HEIGHT
 from tests import common
 from tests.test_media_library import BaseTestMediaLibrary
 
 
+class TestPreviewGeneratorManager(common.TestCase):
+
+    def testLowPriority(self):
+        manager = PreviewGeneratorManager()
+        previewers = [mock.Mock(track_type=GES.TrackType.AUDIO)
+                      for unused_i in range(4)]
+        manager.add_previewer(previewers[0])
+        manager.add_previewer(previewers[1], low_priority=True)
+        manager.add_previewer(previewers[2])
+        manager.add_previewer(previewers[3], low_priority=True)
+
+        # The low priority previewers run one at a time, after the others.
+        started = []
+        for expected in (0, 2, 1, 3):
+            running = [previewer for previewer in previewers
+                       if previewer.startGeneration.called and
+                       previewer not in started]
+            self.assertEqual(running, [previewers[expected]])
+            started.append(running[0])
+            done_cb = running[0].connect.call_args[0][1]
+            done_cb(running[0])
+
+
 class TestPreviewers(BaseTestMediaLibrary):
 
     def testCreateThumbnailBin(self):
@@ -59,3 +87,40 @@ class TestPreviewers(BaseTestMediaLibrary):
             samples = pickle.load(fsamples)
 
         self.assertTrue(bool(samples))
+
+    def testFilmstrip(self):
+        pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8,
+                                      THUMB_HEIGHT * 16 // 9, THUMB_HEIGHT)
+        with tempfile.NamedTemporaryFile() as media_file:
+            media_file.write(b"filmstrip")
+            media_file.flush()
+            asset = mock.Mock()
+            asset.get_proxy_target.return_value = None
+            asset.props.id = Gst.filename_to_uri(media_file.name)
+            thumb_cache = getThumbnailCache(asset.props.id)
+            self.addCleanup(CACHES.pop, asset.props.id)
+            for i in range(10):
+                thumb_cache[i * Gst.SECOND] = pixbuf
+            thumb_cache.commit()
+
+            frames = thumb_cache.getFilmstrip(4)
+            self.assertEqual(len(frames), 4)
+            for frame in frames:
+                self.assertEqual(frame.get_height(), THUMB_HEIGHT)
+            self.assertEqual(len(thumb_cache.getFilmstrip(1000)), 10)
+            self.assertIs(findThumbnailCache(asset), thumb_cache)
+
+    def testFilmstripEmptyCache(self):
+        with tempfile.NamedTemporaryFile() as media_file:
+            media_file.write(b"no thumbnails")
+            media_file.flush()
+            asset = mock.Mock()
+            asset.get_proxy_target.return_value = None
+            asset.props.id = Gst.filename_to_uri(media_file.name)
+            # No cache is created for looking up the thumbnails.
+            self.assertIsNone(findThumbnailCache(asset))
+            self.assertNotIn(asset.props.id, CACHES)
+
+            thumb_cache = getThumbnailCache(asset.props.id)
+            self.addCleanup(CACHES.pop, asset.props.id)
+            self.assertEqual(thumb_cache.getFilmstrip(4), [])
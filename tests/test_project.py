@@ -27,6 +27,7 @@ from unittest import TestCase
 from gi.repository import GES
 from gi.repository import Gst
 
+from pitivi.project import MAX_DISCOVERIES
 from pitivi.project import Project
 from pitivi.project import ProjectManager
 from pitivi.utils.misc import uri_is_reachable
@@ -273,7 +274,10 @@ class TestProjectManager(TestCase):
         # Save the backup
         self.assertTrue(self.manager.saveProject(
             self.manager.current_project, backup=True))
+        # The backup file is moved in place by a thread.
+        self.manager._backup_thread.join()
         self.assertTrue(uri_is_reachable(backup_uri))
+        self.assertFalse(uri_is_reachable(backup_uri + ".part"))
 
         self.manager.closeRunningProject()
         self.assertFalse(uri_is_reachable(backup_uri),
@@ -342,6 +346,75 @@ class TestProjectLoading(common.TestCase):
 
         self.assertEqual(len(assets), 1, assets)
 
+    def test_asset_loading_progress(self):
+        project = common.create_project()
+        project.loaded = True
+        progress_cb = mock.Mock()
+        project.connect("asset-loading-progress", progress_cb)
+
+        assets = []
+        for i, duration in enumerate([Gst.SECOND, 3 * Gst.SECOND]):
+            asset = mock.Mock()
+            asset.props.id = "file:///asset%d" % i
+            asset.get_extractable_type.return_value = GES.UriClip
+            asset.get_duration.return_value = duration
+            project.do_asset_loading(asset)
+            assets.append(asset)
+        self.assertEqual(len(project.loading_assets), 2)
+        self.assertEqual(project.getNumAssetsInProgress(), 2)
+
+        # The progress is weighted by the durations of the assets.
+        assets[1].creation_progress = 60
+        project.app.proxy_manager.emit("progress", assets[1], 60, 0)
+        self.assertEqual(progress_cb.call_args[0][1], 45)
+
+        assets[0].creation_progress = 100
+        project.app.proxy_manager.emit("progress", assets[0], 100, 0)
+        self.assertEqual(progress_cb.call_args[0][1], 70)
+        self.assertTrue(assets[0].ready)
+        self.assertEqual(project.getNumAssetsInProgress(), 1)
+
+        assets[1].creation_progress = 100
+        project.app.proxy_manager.emit("progress", assets[1], 100, 0)
+        self.assertEqual(progress_cb.call_args[0][1], 100)
+        self.assertEqual(project.loading_assets, {})
+        self.assertEqual(project.getNumAssetsInProgress(), 0)
+
+    @staticmethod
+    def _createAsset(uri, proxy_target=None):
+        asset = mock.Mock()
+        asset.props.id = uri
+        asset.get_extractable_type.return_value = GES.UriClip
+        asset.get_proxy_target.return_value = proxy_target
+        return asset
+
+    def test_bounded_discoveries(self):
+        project = common.create_project()
+        uris = ["file:///asset%d" % i for i in range(MAX_DISCOVERIES + 2)]
+        with mock.patch.object(project, "create_asset",
+                               return_value=True) as create_asset:
+            project.addUris(uris)
+            self.assertEqual(create_asset.call_count, MAX_DISCOVERIES)
+
+            # A file which cannot be loaded frees its slot.
+            project.do_loading_error(None, uris[0], GES.UriClip)
+            self.assertEqual(create_asset.call_count, MAX_DISCOVERIES + 1)
+
+            # The proxy added instead of its target frees the slot.
+            target = self._createAsset(uris[1])
+            project.do_asset_added(self._createAsset("file:///proxy", target))
+            self.assertEqual(create_asset.call_count, MAX_DISCOVERIES + 2)
+            self.assertEqual([call[0][0] for call in create_asset.call_args_list],
+                             uris)
+
+            # An asset found elsewhere frees its slot.
+            asset = self._createAsset(uris[2])
+            project.do_asset_loading(asset)
+            asset.props.id = "file:///elsewhere/asset2"
+            project.do_asset_added(asset)
+            self.assertEqual(len(project._Project__discovering_uris),
+                             MAX_DISCOVERIES - 1)
+
 
 class TestProjectSettings(common.TestCase):
 
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from gi.repository import GES
+from gi.repository import Gst
+
+from pitivi.utils.proxy import ENCODING_FORMAT_JPEG
+from pitivi.utils.proxy import ProxyingScale
+from pitivi.utils.proxy import ProxyManager
+from pitivi.utils.proxy import ProxyStore
+from pitivi.utils.proxy import TranscodingHistory
+from pitivi.utils.proxy import TranscodingJob
+from tests import common
+
+
+class TestProxyStore(common.TestCase):
+
+    def setUp(self):
+        common.TestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.store = ProxyStore(os.path.join(self.directory, "proxies"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        common.TestCase.tearDown(self)
+
+    def _createFile(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return Gst.filename_to_uri(path)
+
+    def testCopiesShareProxy(self):
+        uri1 = self._createFile("a.mov", b"same content")
+        uri2 = self._createFile("b.mov", b"same content")
+        uri3 = self._createFile("c.mov", b"other content")
+
+        extension = ProxyManager.proxy_extension
+        proxy_uri = self.store.getProxyUri(uri1, extension)
+        self.assertTrue(self.store.contains(proxy_uri))
+        self.assertTrue(ProxyManager.is_proxy_asset(proxy_uri))
+        self.assertEqual(proxy_uri, self.store.getProxyUri(uri2, extension))
+        self.assertNotEqual(proxy_uri, self.store.getProxyUri(uri3, extension))
+
+        self.assertEqual(self.store.getTargetUris(proxy_uri), [])
+        self.store.use(uri2, proxy_uri)
+        self.assertEqual(self.store.getTargetUris(proxy_uri), [uri2])
+        # Both copies are remembered, the last used first.
+        self.store.use(uri1, proxy_uri)
+        self.assertEqual(self.store.getTargetUris(proxy_uri), [uri1, uri2])
+
+    def testEvictLeastRecentlyUsed(self):
+        extension = ProxyManager.proxy_extension
+        proxies = []
+        for i in range(3):
+            uri = self._createFile("%d.mov" % i, b"content %d" % i)
+            proxy_uri = self.store.getProxyUri(uri, extension)
+            with open(Gst.uri_get_location(proxy_uri), "wb") as f:
+                f.write(b"x" * 100)
+            self.store.use(uri, proxy_uri)
+            proxies.append(Gst.uri_get_location(proxy_uri))
+
+        # The proxies used in this session are never evicted.
+        self.store.quota = 150
+        self.store.evict()
+        self.assertTrue(all(os.path.exists(path) for path in proxies))
+
+        self.store.release()
+        self.store.evict()
+        self.assertEqual([os.path.exists(path) for path in proxies],
+                         [False, False, True])
+
+    def testEvictKeepsTargetsOfScaledProxies(self):
+        uri = self._createFile("a.mov", b"content")
+        extension = ProxyManager.proxy_extension
+        proxy_uri = self.store.getProxyUri(uri, extension)
+        scaled_uri = self.store.getProxyUri(uri, "640x360." + extension)
+        other_uri = self.store.getProxyUri(uri, "other.mkv")
+        for uri_ in (proxy_uri, scaled_uri, other_uri):
+            with open(Gst.uri_get_location(uri_), "wb") as f:
+                f.write(b"x" * 100)
+            self.store.use(uri, uri_)
+
+        # The files of all the formats count in the quota.
+        self.store.quota = 250
+        self.store.release(proxy_uri)
+        self.store.evict()
+        self.assertFalse(os.path.exists(Gst.uri_get_location(proxy_uri)))
+        # The remaining proxies still know their target.
+        self.assertEqual(self.store.getTargetUris(scaled_uri), [uri])
+
+        self.store.release()
+        self.store.quota = 1
+        self.store.evict()
+        self.assertEqual(self.store.getTargetUris(scaled_uri), [])
+
+
+class TestTranscodingJob(common.TestCase):
+
+    def testThroughput(self):
+        job = TranscodingJob("key", 100, expected_throughput=4)
+        self.assertEqual(job.estimateTimeLeft(), 25)
+
+        job.start(10)
+        job.update(20, 20)
+        self.assertEqual(job.throughput, 2)
+        self.assertEqual(job.estimateTimeLeft(), 40)
+
+        job.update(60, 30)
+        self.assertAlmostEqual(job.throughput,
+                               TranscodingJob.SMOOTHING * 4 +
+                               (1 - TranscodingJob.SMOOTHING) * 2)
+        self.assertEqual(job.averageThroughput(), 3)
+
+    def testUnknownThroughput(self):
+        job = TranscodingJob("key", 100)
+        self.assertIsNone(job.estimateTimeLeft())
+        self.assertEqual(job.estimateTimeLeft(5), 20)
+
+
+class TestTranscodingHistory(common.TestCase):
+
+    def testRecord(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "transcoding.db")
+        history = TranscodingHistory(path)
+        self.assertEqual(history.getThroughput("h264"), 0)
+        self.assertEqual(history.getAverageThroughput(), 0)
+
+        history.record("h264", 2)
+        history.record("h264", 4)
+        history.record("vp8", 6)
+        self.assertEqual(history.getThroughput("h264"), 3)
+        self.assertEqual(history.getAverageThroughput(), 4.5)
+
+        # The record is persistent.
+        self.assertEqual(TranscodingHistory(path).getThroughput("vp8"), 6)
+
+
+class TestProxyManager(common.TestCase):
+
+    def testWellSupportedMatchesWhitelist(self):
+        app = common.create_pitivi_mock()
+        proxy_manager = app.proxy_manager
+        for sample in ("30fps_numeroted_frames_red.mkv",
+                       "30fps_numeroted_frames_blue.webm",
+                       "1sec_simpsons_trailer.mp4",
+                       "tears_of_steel.webm"):
+            asset = GES.UriClipAsset.request_sync(common.get_sample_uri(sample))
+            expected = any(
+                proxy_manager._assetMatchesEncodingFormat(asset, profile)
+                for profile in proxy_manager.WHITELIST_FORMATS)
+            self.assertEqual(
+                proxy_manager.isAssetFormatWellSupported(asset), expected,
+                sample)
+
+    def testBenchmarkSkippedWhenFormatSet(self):
+        app = common.create_pitivi_mock(proxyingFormat=ENCODING_FORMAT_JPEG)
+        self.assertFalse(app.proxy_manager.benchmarkFormats())
+        self.assertEqual(app.settings.proxyingFormat, ENCODING_FORMAT_JPEG)
+
+    def testBenchmarkRestartedWhenFormatAutomatic(self):
+        app = common.create_pitivi_mock(proxyingFormat=ENCODING_FORMAT_JPEG)
+        with mock.patch.object(app.proxy_manager, "benchmarkFormats") as \
+                benchmark_formats:
+            app.settings.proxyingFormat = ENCODING_FORMAT_JPEG
+            self.assertFalse(benchmark_formats.called)
+
+            app.settings.proxyingFormat = ""
+            benchmark_formats.assert_called_once_with()
+
+    def testScaledProxyUri(self):
+        app = common.create_pitivi_mock(proxyingScale=ProxyingScale.HALF)
+        proxy_manager = app.proxy_manager
+        uri = common.get_sample_uri("30fps_numeroted_frames_red.mkv")
+        asset = GES.UriClipAsset.request_sync(uri)
+        video = asset.get_info().get_video_streams()[0]
+        width, height = proxy_manager.getProxySize(asset)
+        self.assertEqual(width, video.get_width() // 2 // 2 * 2)
+        self.assertEqual(height, video.get_height() // 2 // 2 * 2)
+
+        proxy_uri = proxy_manager.getProxyUri(asset)
+        self.assertTrue(proxy_uri.endswith(
+            ".%dx%d.%s" % (width, height, ProxyManager.proxy_extension)))
+        proxy = mock.Mock()
+        proxy.props.id = proxy_uri
+        proxy.get_proxy_target.return_value = None
+        self.assertTrue(proxy_manager.isScaledProxy(proxy))
+        self.assertEqual(proxy_manager.getTargetUri(proxy), uri)
+
+        app.settings.proxyingScale = ProxyingScale.FULL
+        self.assertIsNone(proxy_manager.getProxySize(asset))
+        proxy.props.id = proxy_manager.getProxyUri(asset)
+        self.assertFalse(proxy_manager.isScaledProxy(proxy))
+        self.assertEqual(proxy_manager.getTargetUri(proxy), uri)
+
+    def testScaledProxySizeSnapshot(self):
+        app = common.create_pitivi_mock(proxyingScale=ProxyingScale.HALF)
+        proxy_manager = app.proxy_manager
+        uri = common.get_sample_uri("30fps_numeroted_frames_red.mkv")
+        asset = GES.UriClipAsset.request_sync(uri)
+        size = proxy_manager.getProxySize(asset)
+        self.assertIsNotNone(size)
+
+        with mock.patch.object(proxy_manager,
+                               "_ProxyManager__createTranscoder"):
+            self.assertTrue(proxy_manager.addJob(asset, force_proxying=True))
+        proxy_uri = proxy_manager.getProxyUri(asset)
+
+        # Changing the settings does not affect the queued job.
+        app.settings.proxyingScale = ProxyingScale.QUARTER
+        self.assertEqual(proxy_manager.getProxySize(asset), size)
+        self.assertEqual(proxy_manager.getProxyUri(asset), proxy_uri)
+
+    def testScalingDoesNotForceProxying(self):
+        app = common.create_pitivi_mock(proxyingScale=ProxyingScale.HALF)
+        proxy_manager = app.proxy_manager
+        uri = common.get_sample_uri("30fps_numeroted_frames_red.mkv")
+        asset = GES.UriClipAsset.request_sync(uri)
+        ready = mock.Mock()
+        proxy_manager.connect("proxy-ready", ready)
+        with mock.patch.object(proxy_manager, "isAssetFormatWellSupported",
+                               return_value=True):
+            with mock.patch.object(proxy_manager,
+                                   "_ProxyManager__createTranscoder") as create:
+                self.assertTrue(proxy_manager.addJob(asset))
+        create.assert_not_called()
+        ready.assert_called_once_with(proxy_manager, asset, None)